@@ -1,34 +1,103 @@
 import os
-from typing import Any
-from uuid import UUID
+import asyncio
+from datetime import datetime
+from functools import partial
+from typing import Any, AsyncIterator
+from uuid import UUID, uuid4
 from pathlib import Path
-from pydantic import constr
+from pydantic import ValidationError, parse_obj_as
 from sqlalchemy.ext.asyncio import AsyncSession
-from aiobotocore.session import AioBaseClient
-from zipstream import AioZipStream
+from fastapi.concurrency import run_in_threadpool
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import StreamingResponse
+from fastapi.responses import (
+    StreamingResponse, RedirectResponse, FileResponse
+)
+from starlette.background import BackgroundTask
 from fastapi import (
-    APIRouter, Depends, HTTPException, status, Request, Query, Form, UploadFile
+    APIRouter, Depends, HTTPException, status, Request, Response, Query, Form,
+    UploadFile
 )
 
-from core.s3 import get_s3_client
-from db.db import get_session
+from core.config import app_settings
+from core.storage import get_storage
+from db.db import get_session, read_sessionmaker
+from models.file import Blob, File
 from schemas import file as file_schema
 from services.auth.auth_bearer import JWTBearer
+from services.archive.base import ArchiveEntry, is_compressed
+from services.archive.cache import (
+    archive_cache, archive_namespace, manifest_fingerprint
+)
+from services.archive.formats import (
+    MEDIA_TYPES, check_format, default_level, make_archive
+)
 from services.auth.auth_handler import get_user_id
-from services.exceptions import UploadException, DownloadException
-from services.s3_files.upload import upload_content
-from services.s3_files.download import download_content
-from services.utils import translit
+from services.blob import blob_exists, collect_blobs, get_stored_blobs
+from services.encoding import (
+    LEVELS, available_encodings, compress_stream, get_blob_encodings,
+    is_compressible, negotiate, store_variant
+)
+from services.exceptions import (
+    UploadException, DownloadException, FileTooLarge, MultipartException,
+    RangeNotSatisfiable, SearchException
+)
+from services.headers import (
+    parse_range, http_date, file_etag, listing_etag, is_not_modified,
+    if_range_matches
+)
+from services.multipart import MultipartReader
+from services.pagination import (
+    decode_child_cursor, decode_cursor, encode_child_cursor, encode_cursor
+)
+from services.rebalance import delete_objects
+from services.search import search_files_in_db
+from services.s3_files.upload import S3_MAX_PARTS, is_reserved_key
+from services.s3_files.cache import object_cache
+from services.storage import Storage
+from services.storage.operations import (
+    MultipartUpload, upload_content, upload_stream, download_content,
+    get_content_info, presign_upload, presign_download
+)
+from services.usage import check_quota, get_usage, quotas
+from services.utils import translit, hash_file
+from services.directory import get_children, get_directory
 from services.file import (
-    add_file_db_record, get_all_files, search_files_in_db, get_file_obj
+    add_file_db_record, add_file_db_records, delete_files, get_all_files,
+    get_file_obj
 )
 
 
 router = APIRouter()
 
 
+async def get_read_session(
+        user_id: str = Depends(get_user_id)
+) -> AsyncSession:
+    """
+    Session for read-only queries, on a replica unless the account has
+    just written.
+    """
+    async with read_sessionmaker(user_id)() as session:
+        yield session
+
+
+async def check_upload_quota(
+        request: Request,
+        db: AsyncSession = Depends(get_session),
+        user_id: str = Depends(get_user_id)
+) -> None:
+    """
+    Refuse an upload whose body cannot fit in the account's quota before
+    the body is read.
+    """
+    size = int(request.headers.get('content-length') or 0)
+    if not await check_quota(db, user_id, size):
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail='Storage quota exceeded'
+        )
+
+
 @router.get(
     '/list',
     response_model=file_schema.FileDownloaded,
@@ -37,15 +106,43 @@ router = APIRouter()
     dependencies=[Depends(JWTBearer())]
 )
 async def get_list_files(
-        db: AsyncSession = Depends(get_session),
+        request: Request,
+        response: Response,
+        db: AsyncSession = Depends(get_read_session),
         user_id: str = Depends(get_user_id),
         skip: int = Query(default=0, ge=0),
-        limit: int = Query(default=100, ge=0)
+        limit: int = Query(default=100, ge=0),
+        order_by: file_schema.ListOrder = file_schema.ListOrder.created_at,
+        cursor: str | None = Query(
+            default=None, description='next_cursor of the previous page'
+        )
 ) -> Any:
     """
     Retrieve list of files.
     """
-    files = await get_all_files(db=db, user_id=user_id, skip=skip, limit=limit)
+    after = None
+    if cursor:
+        try:
+            after = decode_cursor(order_by.value, cursor)
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)
+            )
+    files = await get_all_files(
+        db=db, user_id=user_id, skip=skip, limit=limit + 1,
+        order_by=order_by.value, after=after
+    )
+    next_cursor = None
+    if len(files) > limit:
+        files = files[:limit]
+        if files:
+            next_cursor = encode_cursor(order_by.value, files[-1])
+    etag = listing_etag(files, user_id, next_cursor)
+    if is_not_modified(request.headers, etag):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag}
+        )
+    response.headers['ETag'] = etag
 
     files_dict = jsonable_encoder(files)
     files = []
@@ -53,7 +150,8 @@ async def get_list_files(
         files = [file_schema.FileInfo(**file) for file in files_dict]
     result = file_schema.FileDownloaded(
         account_id=user_id,
-        files=files
+        files=files,
+        next_cursor=next_cursor
     )
     return result
 
@@ -64,16 +162,15 @@ async def get_list_files(
     response_model=file_schema.FileInDBBase,
     summary='Upload new file',
     description='Upload new file to file storage.',
-    dependencies=[Depends(JWTBearer())]
+    dependencies=[Depends(JWTBearer()), Depends(check_upload_quota)]
 )
 async def upload_file(
         *,
-        request: Request,
         db: AsyncSession = Depends(get_session),
         user_id: str = Depends(get_user_id),
-        path: constr(regex=r'^[^\/].+(?=\/)*[\/]?.+$') = Form(...),
+        path: file_schema.FilePath = Form(...),
         file_bytes: UploadFile,
-        s3_client: AioBaseClient = Depends(get_s3_client)
+        storage: Storage = Depends(get_storage)
 ) -> Any:
     """
     Upload new file.
@@ -81,44 +178,722 @@ async def upload_file(
     if path[-1] == '/':
         path = os.path.join(path, file_bytes.filename)
 
+    blob_hash, size = await run_in_threadpool(hash_file, file_bytes.file)
     object_in = file_schema.FileCreate(
             name=Path(path).name,
             path=path,
-            size=request.headers['content-length'],
+            size=size,
             is_downloadable=True,
             account_id=user_id,
             content_type=file_bytes.content_type,
-            extension=os.path.splitext(Path(path).name)[1].replace('.', '')
+            extension=os.path.splitext(Path(path).name)[1].replace('.', ''),
+            blob_hash=blob_hash,
+            shard=storage.shard_for(Blob.key_for(blob_hash))
+    )
+    if not await blob_exists(db, blob_hash):
+        try:
+            await upload_content(
+                storage=storage, content=file_bytes.file,
+                file_path=Blob.key_for(blob_hash)
+            )
+        except UploadException:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail='S3 upload error'
+            )
+    file_object = await add_file_db_record(
+        db=db, obj_in=object_in, storage=storage
     )
+
+    return file_object
+
+
+@router.post(
+    '/upload/stream',
+    status_code=status.HTTP_201_CREATED,
+    response_model=file_schema.FileInDBBase,
+    summary='Upload new file as a stream',
+    description=(
+        'Upload new file to file storage without buffering it on the server. '
+        'PATH is taken from the query or from a form field sent before '
+        'the file.'
+    ),
+    dependencies=[Depends(JWTBearer()), Depends(check_upload_quota)]
+)
+async def upload_file_stream(
+        *,
+        request: Request,
+        db: AsyncSession = Depends(get_session),
+        user_id: str = Depends(get_user_id),
+        path: file_schema.FilePath | None = Query(default=None),
+        storage: Storage = Depends(get_storage)
+) -> Any:
+    """
+    Upload new file streaming it to S3 by parts.
+    """
     try:
-        await upload_content(
-            client=s3_client, content=file_bytes.file, file_path=path
+        reader = MultipartReader(request.headers, request.stream())
+        async for part in reader:
+            if part.filename is None:
+                if part.name == 'path' and path is None:
+                    path = parse_obj_as(
+                        file_schema.FilePath, await part.read_text()
+                    )
+                continue
+            if path is None:
+                raise MultipartException
+            if path[-1] == '/':
+                path = os.path.join(path, part.filename)
+            content_type = part.content_type or 'application/octet-stream'
+            blob_hash, size, shard = await upload_stream(
+                storage=storage, content=part,
+                blob_exists=partial(blob_exists, db),
+                content_type=content_type
+            )
+            break
+        else:
+            raise MultipartException
+    except (MultipartException, ValidationError):
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail='Expected PATH and a file part'
+        )
+    except FileTooLarge:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail='File is too large'
+        )
+    except UploadException:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail='S3 upload error'
+        )
+
+    object_in = file_schema.FileCreate.from_path(
+        path, size=size, account_id=user_id, content_type=content_type,
+        blob_hash=blob_hash, shard=shard
+    )
+    file_object = await add_file_db_record(
+        db=db, obj_in=object_in, storage=storage
+    )
+
+    return file_object
+
+
+def batch_paths(
+        path: str, files: list[UploadFile]
+) -> tuple[dict[str, UploadFile], dict[str, str]]:
+    """
+    Files of a batch by their path under PATH, and errors of the files
+    whose name makes an invalid path. A path sent more than once is an
+    error, none of its files is kept.
+    """
+    items = {}
+    errors = {}
+    for file in files:
+        file_path = os.path.join(path, file.filename)
+        try:
+            file_path = parse_obj_as(file_schema.FilePath, file_path)
+        except ValidationError:
+            errors[file_path] = 'Invalid path'
+            continue
+        if file_path in items or file_path in errors:
+            items.pop(file_path, None)
+            errors[file_path] = 'Duplicate path'
+            continue
+        items[file_path] = file
+    return items, errors
+
+
+@router.post(
+    '/upload/batch',
+    response_model=file_schema.BatchUploadResult,
+    summary='Upload many files',
+    description=(
+        'Upload many files into the PATH directory in one request. '
+        'File names may contain subdirectories. Results are reported '
+        'per file.'
+    ),
+    dependencies=[Depends(JWTBearer()), Depends(check_upload_quota)]
+)
+async def upload_files_batch(
+        *,
+        db: AsyncSession = Depends(get_session),
+        user_id: str = Depends(get_user_id),
+        path: file_schema.FilePath = Form(...),
+        files: list[UploadFile],
+        storage: Storage = Depends(get_storage)
+) -> Any:
+    """
+    Upload many files.
+    """
+    if len(files) > app_settings.max_batch_files:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f'At most {app_settings.max_batch_files} files per batch'
+        )
+    semaphore = asyncio.Semaphore(app_settings.batch_upload_concurrency)
+
+    async def limited(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    items, errors = batch_paths(path, files)
+    hashes = dict(zip(items, await asyncio.gather(*[
+        limited(run_in_threadpool(hash_file, file.file))
+        for file in items.values()
+    ])))
+    for file_path, (_, size) in hashes.items():
+        if size > app_settings.max_size_file:
+            errors[file_path] = 'File is too large'
+
+    stored = await get_stored_blobs(
+        db, [blob_hash for blob_hash, _ in hashes.values()]
+    )
+    to_upload = {}
+    for file_path, (blob_hash, _) in hashes.items():
+        if file_path not in errors and blob_hash not in stored:
+            to_upload.setdefault(blob_hash, items[file_path].file)
+    uploaded = dict(zip(to_upload, await asyncio.gather(*[
+        limited(upload_content(
+            storage=storage, content=content,
+            file_path=Blob.key_for(blob_hash)
+        )) for blob_hash, content in to_upload.items()
+    ], return_exceptions=True)))
+    for file_path, (blob_hash, _) in hashes.items():
+        if isinstance(uploaded.get(blob_hash), Exception):
+            errors.setdefault(file_path, 'S3 upload error')
+
+    file_objects = await add_file_db_records(db=db, objs_in=[
+        file_schema.FileCreate.from_path(
+            file_path, size=size, account_id=user_id,
+            content_type=items[file_path].content_type, blob_hash=blob_hash,
+            shard=storage.shard_for(Blob.key_for(blob_hash))
+        ) for file_path, (blob_hash, size) in hashes.items()
+        if file_path not in errors
+    ], storage=storage)
+    file_objects = {file_object.path: file_object
+                    for file_object in file_objects}
+    return file_schema.BatchUploadResult(results=[
+        file_schema.BatchUploadItem(
+            path=file_path,
+            status=file_schema.BatchItemStatus.error,
+            detail=detail
+        ) for file_path, detail in errors.items()
+    ] + [
+        file_schema.BatchUploadItem(
+            path=file_path,
+            status=file_schema.BatchItemStatus.created,
+            file=file_schema.FileInDBBase.from_orm(file_object)
+        ) for file_path, file_object in file_objects.items()
+    ])
+
+
+@router.post(
+    '/upload/presigned',
+    response_model=file_schema.PresignedUpload,
+    summary='Get presigned upload URLs',
+    description=(
+        'Get URLs to upload a file directly to S3. Files larger than '
+        'presigned_multipart_threshold get one URL per part. '
+        'Register the uploaded file with /upload/presigned/complete.'
+    ),
+    dependencies=[Depends(JWTBearer())]
+)
+async def presign_file_upload(
+        *,
+        db: AsyncSession = Depends(get_session),
+        user_id: str = Depends(get_user_id),
+        upload_in: file_schema.PresignedUploadCreate,
+        storage: Storage = Depends(get_storage)
+) -> Any:
+    """
+    Presign upload.
+    """
+    if not storage.presigned:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Storage backend does not support presigned URLs'
+        )
+    path = str(upload_in.path)
+    if is_reserved_key(path):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Path is reserved'
+        )
+    if upload_in.size > app_settings.max_size_stream_file:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail='File is too large'
+        )
+    if not await check_quota(db, user_id, upload_in.size):
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail='Storage quota exceeded'
+        )
+    key = File.object_key_for(user_id, path)
+    if upload_in.size <= app_settings.presigned_multipart_threshold:
+        return file_schema.PresignedUpload(
+            path=path,
+            expires_in=app_settings.presigned_url_lifetime,
+            url=await presign_upload(
+                storage=storage, file_path=key,
+                content_type=upload_in.content_type
+            )
         )
+
+    part_size = max(
+        app_settings.s3_part_size, -(-upload_in.size // S3_MAX_PARTS)
+    )
+    upload = MultipartUpload(storage, key)
+    try:
+        await upload.create(upload_in.content_type)
     except UploadException:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail='S3 upload error'
         )
-    file_object = await add_file_db_record(db=db, obj_in=object_in)
+    numbers = range(1, -(-upload_in.size // part_size) + 1)
+    urls = await asyncio.gather(
+        *[upload.presign_part(number) for number in numbers]
+    )
+    return file_schema.PresignedUpload(
+        path=path,
+        expires_in=app_settings.presigned_url_lifetime,
+        upload_id=upload.upload_id,
+        part_size=part_size,
+        parts=[
+            file_schema.PresignedPart(number=number, url=url)
+            for number, url in zip(numbers, urls)
+        ]
+    )
+
+
+@router.post(
+    '/upload/presigned/complete',
+    status_code=status.HTTP_201_CREATED,
+    response_model=file_schema.FileInDBBase,
+    summary='Register presigned upload',
+    description=(
+        'Complete a direct S3 upload: finish multipart upload if any, '
+        'check the object size and ETag and register the file.'
+    ),
+    dependencies=[Depends(JWTBearer())]
+)
+async def complete_presigned_upload(
+        *,
+        db: AsyncSession = Depends(get_session),
+        user_id: str = Depends(get_user_id),
+        upload_in: file_schema.PresignedUploadComplete,
+        storage: Storage = Depends(get_storage)
+) -> Any:
+    """
+    Complete presigned upload.
+    """
+    if not storage.presigned:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Storage backend does not support presigned URLs'
+        )
+    path = str(upload_in.path)
+    key = File.object_key_for(user_id, path)
+    etag = upload_in.etag
+    if upload_in.upload_id:
+        upload = MultipartUpload(storage, key, upload_in.upload_id)
+        try:
+            etag = await upload.complete(
+                {part.number: part.etag for part in upload_in.parts}
+            )
+        except UploadException:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail='S3 upload error'
+            )
+    if not etag:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail='ETag or upload_id is required'
+        )
+    try:
+        info = await get_content_info(storage=storage, file_path=key)
+    except DownloadException:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail='Uploaded object not found'
+        )
+    if info['size'] > app_settings.max_size_stream_file:
+        await delete_objects(storage, [key], storage.shard_for(key))
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail='File is too large'
+        )
+    if (info['size'] != upload_in.size
+            or info['etag'].strip('"') != etag.strip('"')):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail='Uploaded object does not match size or ETag'
+        )
+
+    object_in = file_schema.FileCreate.from_path(
+        path, size=info['size'], account_id=user_id,
+        content_type=info['content_type'] or 'application/octet-stream',
+        shard=storage.shard_for(key), object_key=key
+    )
+    file_object = await add_file_db_record(
+        db=db, obj_in=object_in, storage=storage
+    )
 
     return file_object
 
 
+async def open_content(
+        storage: Storage, file_obj: File,
+        byte_range: tuple[int, int] | None = None
+) -> AsyncIterator[bytes]:
+    """
+    Read file content through the local object cache, unless the storage
+    is local itself.
+
+    Full reads of files up to object_cache_max_file fill the cache, range
+    reads are served from it when the whole file is already there.
+    """
+    storage = storage.on(file_obj.shard)
+    if storage.local:
+        return await download_content(
+            storage=storage, file_path=file_obj.storage_key,
+            byte_range=byte_range
+        )
+    etag = file_etag(file_obj)
+    cached = await object_cache.open(file_obj.storage_key, etag, byte_range)
+    if cached:
+        return cached[0]
+    content = await download_content(
+        storage=storage, file_path=file_obj.storage_key,
+        byte_range=byte_range
+    )
+    if byte_range or file_obj.size > app_settings.object_cache_max_file:
+        return content
+    return object_cache.write_through(file_obj.storage_key, etag, content)
+
+
+async def encoded_content(
+        storage: Storage, file_obj: File,
+        encoding: str, encodings: list[str]
+) -> tuple[AsyncIterator[bytes], BackgroundTask | None]:
+    """
+    Content in the ENCODING coding, from a stored variant when the blob
+    has one in ENCODINGS. Otherwise it is compressed on the fly, and for
+    large blobs a variant is stored after the response for the next
+    downloads.
+    """
+    storage = storage.on(file_obj.shard)
+    if file_obj.blob_hash:
+        if encoding in encodings:
+            content = await download_content(
+                storage=storage,
+                file_path=Blob.variant_key_for(file_obj.blob_hash, encoding)
+            )
+            return content, None
+    content = compress_stream(
+        await open_content(storage, file_obj), encoding, LEVELS[encoding]
+    )
+    background = None
+    if (file_obj.blob_hash
+            and file_obj.size >= app_settings.precompress_min_size):
+        background = BackgroundTask(
+            store_variant, storage=storage,
+            blob_hash=file_obj.blob_hash, encoding=encoding,
+            content_type=file_obj.content_type
+        )
+    return content, background
+
+
+async def ranged_response(
+        storage: Storage, file_obj: File,
+        ranges: list[tuple[int, int]], headers: dict[str, str]
+) -> StreamingResponse:
+    """
+    Build a 206 response for one range or a multipart/byteranges one.
+    """
+    size = file_obj.size
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        content = await open_content(storage, file_obj, (start, end))
+        return StreamingResponse(
+            content,
+            status_code=status.HTTP_206_PARTIAL_CONTENT,
+            media_type=file_obj.content_type,
+            headers={
+                **headers,
+                'Content-Range': f'bytes {start}-{end}/{size}',
+                'Content-Length': str(end - start + 1),
+            }
+        )
+
+    boundary = uuid4().hex
+    part_headers = [
+        (
+            f'\r\n--{boundary}\r\n'
+            f'Content-Type: {file_obj.content_type}\r\n'
+            f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+        ).encode() for start, end in ranges
+    ]
+    closing = f'\r\n--{boundary}--\r\n'.encode()
+    length = len(closing) + sum(
+        len(part) + end - start + 1
+        for part, (start, end) in zip(part_headers, ranges)
+    )
+
+    async def content():
+        for part, byte_range in zip(part_headers, ranges):
+            yield part
+            async for chunk in await open_content(
+                    storage, file_obj, byte_range):
+                yield chunk
+        yield closing
+
+    return StreamingResponse(
+        content(),
+        status_code=status.HTTP_206_PARTIAL_CONTENT,
+        media_type=f'multipart/byteranges; boundary={boundary}',
+        headers={**headers, 'Content-Length': str(length)}
+    )
+
+
+async def archive_content(
+        storage: Storage, files: list[File], archive_format: str,
+        level: int, root: str | None, user_id: str
+) -> tuple[AsyncIterator[bytes], int | None]:
+    """
+    Stream an archive of files and return its size when known upfront.
+
+    Archives of a directory ROOT are cached by the directory manifest.
+    """
+    if root:
+        namespace = archive_namespace(user_id, root)
+        fingerprint = manifest_fingerprint(files, archive_format, level)
+        cached = await archive_cache.open(namespace, fingerprint)
+        if cached:
+            return cached
+    archive = make_archive(
+        archive_format,
+        [
+            ArchiveEntry(
+                name=file.path[len(root):] if root else file.name,
+                size=file.size,
+                modified=file.created_at,
+                open=partial(open_content, storage, file),
+                compress=not is_compressed(file.content_type, file.extension)
+            ) for file in files
+        ],
+        level=level
+    )
+    content = archive.stream()
+    if root:
+        content = archive_cache.write_through(namespace, fingerprint, content)
+    return content, archive.content_length()
+
+
+def archive_options(
+        archive_format: file_schema.ArchiveFormat | None, level: int | None
+) -> tuple[str, int]:
+    archive_format = (
+        archive_format or file_schema.ArchiveFormat.zip
+    ).value
+    if level is None:
+        level = default_level(archive_format)
+    try:
+        check_format(archive_format, level)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)
+        )
+    return archive_format, level
+
+
+def response_encoding(request: Request) -> str | None:
+    """
+    Content coding negotiated from Accept-Encoding for a compressible
+    file. Range requests are served unencoded.
+    """
+    if 'range' in request.headers:
+        return None
+    return negotiate(
+        request.headers.get('accept-encoding'), available_encodings()
+    )
+
+
+def requested_ranges(
+        request: Request, etag: str, last_modified: datetime, size: int
+) -> list[tuple[int, int]] | None:
+    try:
+        if if_range_matches(
+                request.headers.get('if-range'), etag, last_modified):
+            return parse_range(request.headers.get('range'), size)
+    except RangeNotSatisfiable:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail='Requested range not satisfiable',
+            headers={'Content-Range': f'bytes */{size}'}
+        )
+    return None
+
+
+def validators(etag: str, last_modified: datetime) -> dict[str, str]:
+    return {
+        'ETag': etag,
+        'Last-Modified': http_date(last_modified),
+        'Cache-Control': 'private, no-cache',
+    }
+
+
+async def download_archive(
+        request: Request, db: AsyncSession, storage: Storage,
+        file_obj: File | list[File],
+        archive_format: file_schema.ArchiveFormat | None, level: int | None,
+        root: str | None, user_id: str
+) -> Response:
+    files = file_obj if isinstance(file_obj, list) else [file_obj]
+    archive_format, level = archive_options(archive_format, level)
+    etag = listing_etag(files, archive_format, level)
+    last_modified = max(file.created_at for file in files)
+    headers = validators(etag, last_modified)
+    if is_not_modified(request.headers, etag, last_modified):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED, headers=headers
+        )
+    # an archive cannot report a missing shard once it streams
+    for shard in {file.shard for file in files}:
+        storage.on(shard)
+    # nothing else is queried: give the connection back to the pool
+    # instead of holding it while the body streams
+    await db.close()
+    try:
+        content, content_length = await archive_content(
+            storage, files, archive_format, level, root=root,
+            user_id=user_id
+        )
+    except DownloadException:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail='S3 download error'
+        )
+    if content_length is not None:
+        headers['Content-Length'] = str(content_length)
+    headers['Content-Disposition'] = (
+        f'attachment; filename="files.{archive_format}"'
+    )
+    return StreamingResponse(
+        content, media_type=MEDIA_TYPES[archive_format], headers=headers
+    )
+
+
+async def download_single(
+        request: Request, db: AsyncSession, storage: Storage, file_obj: File,
+        redirect: bool | None
+) -> Response:
+    compressible = is_compressible(file_obj, app_settings.compress_min_size)
+    encoding = response_encoding(request) if compressible else None
+    etag = file_etag(file_obj, encoding)
+    headers = validators(etag, file_obj.created_at)
+    if compressible:
+        headers['Vary'] = 'Accept-Encoding'
+    if is_not_modified(request.headers, etag, file_obj.created_at):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED, headers=headers
+        )
+    storage = storage.on(file_obj.shard)
+    file_name = file_obj.name.translate(translit)
+    if redirect is None:
+        redirect = app_settings.download_redirect
+    if redirect and storage.presigned:
+        url = await presign_download(
+            storage=storage,
+            file_path=file_obj.storage_key,
+            content_type=file_obj.content_type,
+            content_disposition=f'attachment; filename="{file_name}"'
+        )
+        return RedirectResponse(
+            url, status_code=status.HTTP_307_TEMPORARY_REDIRECT
+        )
+    encodings = []
+    if encoding and file_obj.blob_hash:
+        encodings = await get_blob_encodings(db, file_obj.blob_hash)
+    await db.close()
+    headers['Accept-Ranges'] = 'bytes'
+    headers['Content-Disposition'] = f'attachment; filename="{file_name}"'
+    try:
+        return await file_response(
+            request, storage, file_obj, encoding, encodings, headers
+        )
+    except DownloadException:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail='S3 download error'
+        )
+
+
+async def file_response(
+        request: Request, storage: Storage, file_obj: File,
+        encoding: str | None, encodings: list[str], headers: dict[str, str]
+) -> Response:
+    """
+    The content of FILE_OBJ, in ENCODING or in the requested ranges.
+    """
+    if encoding:
+        headers['Content-Encoding'] = encoding
+        content, background = await encoded_content(
+            storage, file_obj, encoding, encodings
+        )
+        return StreamingResponse(
+            content, media_type=file_obj.content_type, headers=headers,
+            background=background
+        )
+    ranges = requested_ranges(
+        request, headers['ETag'], file_obj.created_at, file_obj.size
+    )
+    if ranges:
+        return await ranged_response(
+            storage, file_obj, ranges, headers=headers
+        )
+    local_path = storage.local_path(file_obj.storage_key)
+    if local_path:
+        return FileResponse(
+            local_path, media_type=file_obj.content_type, headers=headers
+        )
+    return StreamingResponse(
+        await open_content(storage, file_obj),
+        media_type=file_obj.content_type, headers=headers
+    )
+
+
 @router.get(
     '/download',
     status_code=status.HTTP_200_OK,
     response_class=StreamingResponse,
     summary='Download file',
-    description='Download file from file storage by PATH or UUID4.',
+    description=(
+        'Download file from file storage by PATH or UUID4. With REDIRECT '
+        'a single file is served by a redirect to a short-lived S3 URL. '
+        'Directories, or a file with ZIPPED or FORMAT, are downloaded as an '
+        'archive in FORMAT compressed with LEVEL.'
+    ),
     dependencies=[Depends(JWTBearer())]
 )
 async def download_file(
         *,
+        request: Request,
         zipped: bool = False,
-        db: AsyncSession = Depends(get_session),
+        archive_format: file_schema.ArchiveFormat | None = Query(
+            default=None, alias='format', description='Archive format'
+        ),
+        level: int | None = Query(
+            default=None, description='Archive compression level'
+        ),
+        redirect: bool | None = Query(
+            default=None, description='Redirect to S3 instead of proxying'
+        ),
+        db: AsyncSession = Depends(get_read_session),
         user_id: str = Depends(get_user_id),
-        path: constr(regex=r'^[^\/].+(?=\/)*[\/]?.+$') | UUID =
+        path: file_schema.FilePath | UUID =
         Query(..., description='Path or UUID4'),
-        s3_client: AioBaseClient = Depends(get_s3_client)
+        storage: Storage = Depends(get_storage)
 ) -> Any:
     """
     Download file.
@@ -130,36 +905,13 @@ async def download_file(
             status_code=status.HTTP_404_NOT_FOUND,
             detail='File with this UUID or PATH not found'
         )
-    if zipped is True:
-        file_obj = [file_obj]
-    if isinstance(file_obj, list):
-        files = [
-            {
-                'stream': await download_content(
-                    client=s3_client, file_path=file.path),
-                'name': file.name
-            } for file in file_obj
-        ]
-        content = AioZipStream(files, chunksize=32768).stream()
-        media_type = 'application/x-zip-compressed'
-        file_name = 'files.zip'
-    else:
-        content = await download_content(
-            client=s3_client, file_path=file_obj.path)
-        media_type = file_obj.content_type
-        file_name = file_obj.name.translate(translit)
-    try:
-        return StreamingResponse(
-            content,
-            media_type=media_type,
-            headers={
-                'Content-Disposition': f'attachment; filename="{file_name}"'
-            }
-        )
-    except DownloadException:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST, detail='S3 download error'
+    if isinstance(file_obj, list) or zipped or archive_format:
+        return await download_archive(
+            request, db, storage, file_obj, archive_format, level,
+            root=path if isinstance(file_obj, list) else None,
+            user_id=user_id
         )
+    return await download_single(request, db, storage, file_obj, redirect)
 
 
 @router.get(
@@ -170,27 +922,179 @@ async def download_file(
     dependencies=[Depends(JWTBearer())]
 )
 async def search_files(
-        db: AsyncSession = Depends(get_session),
+        request: Request,
+        response: Response,
+        db: AsyncSession = Depends(get_read_session),
         user_id: str = Depends(get_user_id),
         path: str = None,
         extension: str = None,
         limit: int = Query(default=100, ge=0),
-        query: str = '',
-        is_regex: bool = Query(default=False, description='query is regex'),
+        query: str = Query(
+            default='',
+            description='search query, e.g. `report ext:pdf size>1MB`: '
+                        'words and "phrases" of the path, name:, path: '
+                        '(prefix), ext:, re:, size and created compared '
+                        'with : = < <= > >=, AND, OR, NOT, - and ()'
+        ),
+        is_regex: bool = Query(
+            default=False, description='the whole query is a regex'
+        ),
+        words: str | None = Query(
+            default=None, description='full-text search of path words'
+        ),
         order_by: str = Query(
-            default='id', enum=['id', 'name', 'created_at', 'path', 'size']
+            default='id',
+            enum=['id', 'name', 'created_at', 'path', 'size', 'relevance']
         ),
 ) -> Any:
     """
     Search files.
     """
-    files = await search_files_in_db(
-        db=db, user_id=user_id, path=path, extension=extension, query=query,
-        is_regex=is_regex, order_by=order_by, limit=limit
-    )
+    try:
+        files = await search_files_in_db(
+            db=db, user_id=user_id, path=path, extension=extension,
+            query=query, is_regex=is_regex, order_by=order_by, limit=limit,
+            words=words
+        )
+    except SearchException as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)
+        )
+    etag = listing_etag(files, user_id)
+    if is_not_modified(request.headers, etag):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag}
+        )
+    response.headers['ETag'] = etag
     files_dict = jsonable_encoder(files)
     files = []
     if files_dict:
         files = [file_schema.FileInfo(**file) for file in files_dict]
     result = file_schema.SearchFile(matches=files)
     return result
+
+
+@router.get(
+    '/directory',
+    response_model=file_schema.DirectoryListing,
+    summary='List a directory',
+    description=(
+        'Subdirectories, then files, right inside directory PATH with the '
+        'file count and total size of everything under it.'
+    ),
+    dependencies=[Depends(JWTBearer())]
+)
+async def list_directory(
+        db: AsyncSession = Depends(get_read_session),
+        user_id: str = Depends(get_user_id),
+        path: str = Query(
+            default='', description='directory ending with /, empty for root'
+        ),
+        limit: int = Query(default=100, ge=1),
+        cursor: str | None = Query(
+            default=None, description='next_cursor of the previous page'
+        )
+) -> Any:
+    """
+    List a directory.
+    """
+    if path and not path.endswith('/'):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Directory PATH must end with /'
+        )
+    after = None
+    if cursor:
+        try:
+            after = decode_child_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)
+            )
+    if path:
+        directory = await get_directory(db=db, path=path, user_id=user_id)
+    else:
+        # the rollup of the root is the account usage
+        directory = await get_usage(db=db, user_id=user_id)
+    if directory is None and path:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail='Directory not found'
+        )
+    directories, files, last = await get_children(
+        db=db, path=path, user_id=user_id, limit=limit, after=after
+    )
+    return file_schema.DirectoryListing(
+        path=path,
+        name=directory.name if path else '',
+        file_count=directory.file_count if directory else 0,
+        total_size=directory.total_size if directory else 0,
+        directories=[
+            file_schema.DirectoryInfo.from_orm(entry)
+            for entry in directories
+        ],
+        files=[
+            file_schema.FileInfo(**file) for file in jsonable_encoder(files)
+        ],
+        next_cursor=encode_child_cursor(last) if last else None
+    )
+
+
+@router.get(
+    '/usage',
+    response_model=file_schema.AccountUsageInfo,
+    summary='Get storage usage',
+    description='Files and bytes the account holds, and its quotas.',
+    dependencies=[Depends(JWTBearer())]
+)
+async def get_account_usage(
+        db: AsyncSession = Depends(get_read_session),
+        user_id: str = Depends(get_user_id)
+) -> Any:
+    """
+    Get storage usage.
+    """
+    usage = await get_usage(db=db, user_id=user_id)
+    quota_bytes, quota_files = quotas(usage)
+    return file_schema.AccountUsageInfo(
+        file_count=usage.file_count if usage else 0,
+        total_size=usage.total_size if usage else 0,
+        quota_bytes=quota_bytes or None,
+        quota_files=quota_files or None
+    )
+
+
+@router.delete(
+    '',
+    response_model=file_schema.DeletedFiles,
+    summary='Delete files',
+    description=(
+        'Delete the file at PATH, or every file under PATH ending with /.'
+    ),
+    dependencies=[Depends(JWTBearer())]
+)
+async def delete_file(
+        db: AsyncSession = Depends(get_session),
+        user_id: str = Depends(get_user_id),
+        path: file_schema.FilePath = Query(...),
+        storage: Storage = Depends(get_storage)
+) -> Any:
+    """
+    Delete files.
+    """
+    deleted = await delete_files(db=db, path=path, user_id=user_id)
+    if not deleted:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail='File with this PATH not found'
+        )
+    # blobs are shared and deleted once no file refers to them, other
+    # objects belong to a file
+    await asyncio.gather(*[
+        delete_objects(storage, [file.object_key], file.shard)
+        for file in deleted if file.object_key
+    ])
+    await collect_blobs(db, storage, [file.blob_hash for file in deleted])
+    return file_schema.DeletedFiles(
+        deleted=len(deleted), size=sum(file.size for file in deleted)
+    )
@@ -5,13 +5,20 @@ from fastapi import APIRouter, Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 from asyncpg.exceptions import PostgresError
-from aiobotocore.session import AioBaseClient
 
 from core.config import app_settings
-from core.s3 import get_s3_client
-from db.db import get_session
-from schemas.inspect import Ping, DatabaseStatus, S3Status, Status
+from core.s3 import s3_pool, shard_pools
+from core.storage import get_storage
+from db.db import engine, get_session, replica_engines
+from schemas.inspect import (
+    Ping, DatabaseStatus, S3Status, Status, Stats, CacheStats, S3PoolStats,
+    S3ReadStats, DbPoolStats
+)
+from services.archive.cache import archive_cache
 from services.auth.auth_bearer import JWTBearer
+from services.s3_files.cache import object_cache
+from services.s3_files.policy import read_policy
+from services.storage import Storage
 
 
 router = APIRouter()
@@ -25,13 +32,12 @@ router = APIRouter()
 )
 async def ping_services(
         db: AsyncSession = Depends(get_session),
-        s3_client: AioBaseClient = Depends(get_s3_client)
+        storage: Storage = Depends(get_storage)
 ) -> Any:
     """
     Ping services
     """
     db_connected = True
-    s3_connected = True
     db_info = ''
     db_time = 0
 
@@ -46,12 +52,8 @@ async def ping_services(
 
     # ping file storage
     s3_start = time.time()
-    resp = await s3_client.get_object_acl(
-        Bucket=app_settings.s3_bucket, Key='for_ping.txt'
-    )
+    s3_connected = await storage.ping()
     s3_time = time.time() - s3_start
-    if resp['ResponseMetadata']['HTTPStatusCode'] != 200:
-        s3_connected = False
 
     return Ping(
         database=DatabaseStatus(
@@ -68,3 +70,33 @@ async def ping_services(
             time=s3_time
         )
     )
+
+
+@router.get(
+    '/stats',
+    response_model=Stats,
+    description='Get counters of this worker.',
+    dependencies=[Depends(JWTBearer())]
+)
+async def get_stats() -> Any:
+    """
+    Get stats
+    """
+    return Stats(
+        db_pool=DbPoolStats(**engine.sync_engine.pool.stats()),
+        db_replica_pools=[
+            DbPoolStats(**replica.sync_engine.pool.stats())
+            for replica in replica_engines
+        ],
+        s3_pool=S3PoolStats(**s3_pool.stats()),
+        s3_shard_pools={
+            endpoint: S3PoolStats(**pool.stats())
+            for endpoint, pool in shard_pools.items()
+        },
+        s3_reads={
+            operation: S3ReadStats(**stats)
+            for operation, stats in read_policy.info().items()
+        },
+        object_cache=CacheStats(**object_cache.info()),
+        archive_cache=CacheStats(**archive_cache.info())
+    )
@@ -0,0 +1,263 @@
+from typing import Any
+from uuid import UUID
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import (
+    APIRouter, Depends, HTTPException, status, Request, Response, Path
+)
+
+from core.config import app_settings
+from core.storage import get_storage
+from db.db import get_session
+from models.file import File
+from schemas import file as file_schema
+from services.auth.auth_bearer import JWTBearer
+from services.auth.auth_handler import get_user_id
+from services.exceptions import UploadException
+from services.file import add_file_db_record
+from services.s3_files.upload import S3_MAX_PARTS, is_reserved_key
+from services.storage import Storage
+from services.storage.operations import MultipartUpload
+from services.usage import check_quota
+from services.upload_session import (
+    create_upload_session, get_upload_session, add_upload_part,
+    delete_upload_session, delete_expired_upload_sessions
+)
+
+
+router = APIRouter()
+
+
+async def get_session_or_404(
+        db: AsyncSession, session_id: UUID, user_id: str):
+    upload_session = await get_upload_session(
+        db=db, pk=session_id, user_id=user_id
+    )
+    if not upload_session:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail='Upload session not found'
+        )
+    return upload_session
+
+
+@router.post(
+    '',
+    status_code=status.HTTP_201_CREATED,
+    response_model=file_schema.UploadSessionInfo,
+    summary='Start upload session',
+    description='Start a resumable upload session for a large file.',
+    dependencies=[Depends(JWTBearer())]
+)
+async def start_upload_session(
+        *,
+        db: AsyncSession = Depends(get_session),
+        user_id: str = Depends(get_user_id),
+        session_in: file_schema.UploadSessionCreate,
+        storage: Storage = Depends(get_storage)
+) -> Any:
+    """
+    Start upload session.
+    """
+    if is_reserved_key(str(session_in.path)):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Path is reserved'
+        )
+    if session_in.size > app_settings.max_size_stream_file:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail='File is too large'
+        )
+    if not await check_quota(db, user_id, session_in.size):
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail='Storage quota exceeded'
+        )
+    chunk_size = session_in.chunk_size or app_settings.s3_part_size
+    if chunk_size > app_settings.max_chunk_size:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'Chunk size is too large, max '
+                   f'{app_settings.max_chunk_size} bytes'
+        )
+    if -(-session_in.size // chunk_size) > S3_MAX_PARTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'Chunk size is too small, max {S3_MAX_PARTS} chunks'
+        )
+    await delete_expired_upload_sessions(db, storage, user_id=user_id)
+    upload = MultipartUpload(
+        storage, File.object_key_for(user_id, str(session_in.path))
+    )
+    try:
+        upload_id = await upload.create(session_in.content_type)
+    except UploadException:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail='S3 upload error'
+        )
+    return await create_upload_session(
+        db=db, obj_in=session_in, user_id=user_id, upload_id=upload_id
+    )
+
+
+@router.get(
+    '/{session_id}',
+    response_model=file_schema.UploadSessionInfo,
+    summary='Get upload session',
+    description='Get upload session state and the list of received chunks.',
+    dependencies=[Depends(JWTBearer())]
+)
+async def get_upload_session_state(
+        session_id: UUID,
+        db: AsyncSession = Depends(get_session),
+        user_id: str = Depends(get_user_id),
+) -> Any:
+    """
+    Get upload session.
+    """
+    return await get_session_or_404(
+        db=db, session_id=session_id, user_id=user_id
+    )
+
+
+@router.put(
+    '/{session_id}/chunks/{number}',
+    response_model=file_schema.UploadChunkInfo,
+    summary='Upload chunk',
+    description=(
+        'Upload chunk NUMBER (starting from 1) as raw request body. '
+        'Chunks may be sent in any order and in parallel; re-sending '
+        'a chunk replaces it.'
+    ),
+    dependencies=[Depends(JWTBearer())]
+)
+async def upload_chunk(
+        *,
+        request: Request,
+        session_id: UUID,
+        number: int = Path(..., ge=1, le=S3_MAX_PARTS),
+        db: AsyncSession = Depends(get_session),
+        user_id: str = Depends(get_user_id),
+        storage: Storage = Depends(get_storage)
+) -> Any:
+    """
+    Upload chunk.
+    """
+    upload_session = await get_session_or_404(
+        db=db, session_id=session_id, user_id=user_id
+    )
+    if number > upload_session.chunks_total:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f'Session has {upload_session.chunks_total} chunks'
+        )
+    length = upload_session.chunk_length(number)
+    body = bytearray()
+    async for chunk in request.stream():
+        body.extend(chunk)
+        if len(body) > length:
+            break
+    if len(body) != length:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'Chunk {number} must be {length} bytes'
+        )
+
+    upload = MultipartUpload(
+        storage, upload_session.storage_key, upload_session.upload_id
+    )
+    try:
+        etag = await upload.upload_part(number, bytes(body))
+    except UploadException:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail='S3 upload error'
+        )
+    return await add_upload_part(
+        db=db, session_id=upload_session.id, number=number, size=length,
+        etag=etag
+    )
+
+
+@router.post(
+    '/{session_id}/complete',
+    status_code=status.HTTP_201_CREATED,
+    response_model=file_schema.FileInDBBase,
+    summary='Complete upload session',
+    description='Assemble received chunks into the file.',
+    dependencies=[Depends(JWTBearer())]
+)
+async def complete_upload_session(
+        session_id: UUID,
+        db: AsyncSession = Depends(get_session),
+        user_id: str = Depends(get_user_id),
+        storage: Storage = Depends(get_storage)
+) -> Any:
+    """
+    Complete upload session.
+    """
+    upload_session = await get_session_or_404(
+        db=db, session_id=session_id, user_id=user_id
+    )
+    missing = (
+        set(range(1, upload_session.chunks_total + 1))
+        - set(upload_session.chunks_received)
+    )
+    if missing:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f'Missing chunks: {sorted(missing)}'
+        )
+
+    upload = MultipartUpload(
+        storage, upload_session.storage_key, upload_session.upload_id
+    )
+    try:
+        await upload.complete(
+            {part.number: part.etag for part in upload_session.parts}
+        )
+    except UploadException:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail='S3 upload error'
+        )
+    object_in = file_schema.FileCreate.from_path(
+        upload_session.path,
+        size=upload_session.size,
+        account_id=user_id,
+        content_type=upload_session.content_type,
+        shard=storage.shard_for(upload_session.storage_key),
+        object_key=upload_session.storage_key
+    )
+    file_object = await add_file_db_record(
+        db=db, obj_in=object_in, storage=storage
+    )
+    await delete_upload_session(db=db, pk=upload_session.id)
+
+    return file_object
+
+
+@router.delete(
+    '/{session_id}',
+    status_code=status.HTTP_204_NO_CONTENT,
+    response_class=Response,
+    summary='Abort upload session',
+    description='Abort upload session and drop received chunks.',
+    dependencies=[Depends(JWTBearer())]
+)
+async def abort_upload_session(
+        session_id: UUID,
+        db: AsyncSession = Depends(get_session),
+        user_id: str = Depends(get_user_id),
+        storage: Storage = Depends(get_storage)
+) -> None:
+    """
+    Abort upload session.
+    """
+    upload_session = await get_session_or_404(
+        db=db, session_id=session_id, user_id=user_id
+    )
+    upload = MultipartUpload(
+        storage, upload_session.storage_key, upload_session.upload_id
+    )
+    await upload.abort()
+    await delete_upload_session(db=db, pk=upload_session.id)
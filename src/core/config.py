@@ -1,5 +1,6 @@
-from pydantic import BaseSettings, PostgresDsn, HttpUrl
+from pydantic import BaseModel, BaseSettings, PostgresDsn, HttpUrl
 from logging import config as logging_config
+from typing import Literal
 
 from core.logger import LOGGING
 
@@ -7,9 +8,29 @@ from core.logger import LOGGING
 logging_config.dictConfig(LOGGING)
 
 
+class S3Shard(BaseModel):
+    name: str
+    bucket: str
+    endpoint: HttpUrl | None = None  # s3_endpoint when not set
+
+
 class AppSettings(BaseSettings):
     app_title: str = "File storage"
     database_dsn: PostgresDsn
+    db_pool_size: int = 20
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 10  # seconds to wait for a connection
+    db_pool_recycle: int = 1800  # seconds, -1 keeps connections forever
+    db_pool_pre_ping: bool = True
+    db_connect_timeout: float = 5  # seconds
+    # asyncpg prepared statements per connection, 0 behind pgbouncer
+    db_statement_cache_size: int = 100
+    # read-only queries are spread over these, in turn
+    database_replica_dsns: list[PostgresDsn] = []
+    # reads of an account stay on the primary after its writes
+    replica_pin_seconds: float = 5
+    # hash partitions of files, fixed once the table is created
+    files_partitions: int = 16
     project_host: str = '0.0.0.0'
     project_port: int = 8080
     echo_queries: bool = False
@@ -18,9 +39,55 @@ class AppSettings(BaseSettings):
     jwt_algorithm: str = 'HS256'
     aws_access_key_id: str = None
     aws_secret_access_key: str = None
+    storage_backend: Literal['s3', 'local'] = 's3'
+    storage_root: str = 'media/storage'  # for the local backend
     s3_endpoint: HttpUrl = 'https://storage.yandexcloud.net/'
     s3_bucket: str
+    # JSON list of bucket/endpoint pairs new objects are spread over,
+    # objects stay on s3_bucket when empty
+    s3_shards: list[S3Shard] = []
+    s3_shard_vnodes: int = 128
+    rebalance_concurrency: int = 8
+    s3_max_pool_connections: int = 64  # per client, reads have their own
+    s3_connect_timeout: float = 5  # seconds
+    s3_read_timeout: float = 60  # seconds
+    s3_keepalive_timeout: float = 12  # seconds, S3 drops idle ones at 20
+    s3_max_attempts: int = 3  # writes, reads use s3_read_attempts
+    # reads: per attempt time to response headers, retries and hedging
+    s3_attempt_timeout: float = 10  # seconds
+    s3_read_attempts: int = 3
+    s3_retry_base_delay: float = 0.1  # seconds, doubled per retry
+    s3_retry_max_delay: float = 2  # seconds
+    s3_hedge_percentile: float = 95  # 0 disables hedged reads
+    s3_hedge_min_delay: float = 0.02  # seconds
     max_size_file: int = 104857600  # 100 MB
+    max_size_stream_file: int = 53687091200  # 50 GB
+    s3_part_size: int = 8388608  # 8 MB, S3 minimum is 5 MB
+    s3_parts_in_flight: int = 4
+    upload_session_lifetime: int = 86400  # seconds
+    max_chunk_size: int = 104857600  # 100 MB, chunks are held in memory
+    max_batch_files: int = 1000
+    batch_upload_concurrency: int = 16
+    presigned_url_lifetime: int = 3600  # seconds
+    presigned_multipart_threshold: int = 104857600  # 100 MB
+    presigned_download_lifetime: int = 60  # seconds
+    download_redirect: bool = False
+    compress_min_size: int = 1024  # 1 KB
+    precompress_min_size: int = 1048576  # 1 MB
+    archive_prefetch: int = 4
+    zip_compression_level: int = 6
+    gzip_compression_level: int = 6
+    zstd_compression_level: int = 3
+    cache_dir: str = 'media/cache'
+    archive_cache_size: int = 10737418240  # 10 GB, 0 disables
+    object_cache_size: int = 10737418240  # 10 GB, 0 disables
+    object_cache_max_file: int = 1073741824  # 1 GB
+    # per account, unless set on its account_usage row; 0 is unlimited
+    quota_bytes: int = 0
+    quota_files: int = 0
+    # searches with a regular expression
+    search_timeout: int = 2000  # milliseconds
+    search_max_cost: float = 100000  # planner cost units
 
     class Config:
         env_file = '.env'
@@ -1,13 +1,120 @@
+import asyncio
+from contextlib import AsyncExitStack
+
+from aiobotocore.config import AioConfig
 from aiobotocore.session import get_session, AioBaseClient
 
 from core.config import app_settings
 
 
-async def get_s3_client() -> AioBaseClient:
-    session = get_session()
-    async with session.create_client(
+class S3ClientPool:
+    """
+    One S3 client per worker and endpoint, shared by all requests, so
+    connections and TLS sessions are reused. Opened on application
+    startup, or by the first request when the startup event didn't run
+    (e.g. in tests).
+    """
+
+    def __init__(self, endpoint: str | None = None):
+        self.endpoint = endpoint or app_settings.s3_endpoint
+        self.client: AioBaseClient | None = None
+        # for the reads of ReadPolicy, which does the retrying
+        self.read_client: AioBaseClient | None = None
+        self._exit_stack: AsyncExitStack | None = None
+        self._lock = asyncio.Lock()
+
+    def _create_client(self, retries: dict):
+        config = AioConfig(
+            max_pool_connections=app_settings.s3_max_pool_connections,
+            connect_timeout=app_settings.s3_connect_timeout,
+            read_timeout=app_settings.s3_read_timeout,
+            retries=retries,
+            connector_args={
+                'keepalive_timeout': app_settings.s3_keepalive_timeout
+            }
+        )
+        return get_session().create_client(
             's3',
             aws_secret_access_key=app_settings.aws_secret_access_key,
             aws_access_key_id=app_settings.aws_access_key_id,
-            endpoint_url=app_settings.s3_endpoint) as client:
-        yield client
+            endpoint_url=self.endpoint,
+            config=config
+        )
+
+    async def open(self) -> AioBaseClient:
+        async with self._lock:
+            if self.client is not None:
+                return self.client
+            exit_stack = AsyncExitStack()
+            self.client = await exit_stack.enter_async_context(
+                self._create_client(
+                    {'max_attempts': app_settings.s3_max_attempts}
+                )
+            )
+            self.read_client = await exit_stack.enter_async_context(
+                self._create_client({'total_max_attempts': 1})
+            )
+            self._exit_stack = exit_stack
+            return self.client
+
+    async def close(self) -> None:
+        async with self._lock:
+            if self._exit_stack is not None:
+                await self._exit_stack.aclose()
+            self.client = self.read_client = self._exit_stack = None
+
+    def stats(self) -> dict:
+        """
+        Connection usage of the aiohttp connectors of the clients.
+        """
+        connectors = [
+            getattr(client._endpoint.http_session, '_connector', None)
+            for client in (self.client, self.read_client)
+            if client is not None
+        ]
+        connectors = [
+            connector for connector in connectors if connector is not None
+        ]
+        if not connectors:
+            return {'limit': 2 * app_settings.s3_max_pool_connections,
+                    'in_use': 0, 'idle': 0, 'waiting': 0}
+        return {
+            'limit': sum(connector.limit for connector in connectors),
+            'in_use': sum(
+                len(connector._acquired) for connector in connectors
+            ),
+            'idle': sum(
+                len(conns) for connector in connectors
+                for conns in connector._conns.values()
+            ),
+            'waiting': sum(
+                len(waiters) for connector in connectors
+                for waiters in connector._waiters.values()
+            ),
+        }
+
+
+s3_pool = S3ClientPool()
+# pools of the s3_shards endpoints other than s3_endpoint
+shard_pools = {
+    shard.endpoint: S3ClientPool(shard.endpoint)
+    for shard in app_settings.s3_shards
+    if shard.endpoint and shard.endpoint != app_settings.s3_endpoint
+}
+
+
+def get_pool(endpoint: str | None = None) -> S3ClientPool:
+    return shard_pools.get(endpoint, s3_pool)
+
+
+async def get_s3_client(endpoint: str | None = None) -> AioBaseClient:
+    pool = get_pool(endpoint)
+    return pool.client or await pool.open()
+
+
+async def get_s3_read_client(
+        endpoint: str | None = None) -> AioBaseClient:
+    pool = get_pool(endpoint)
+    if pool.read_client is None:
+        await pool.open()
+    return pool.read_client
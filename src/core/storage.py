@@ -0,0 +1,34 @@
+from core.config import app_settings
+from core.s3 import get_s3_client, get_s3_read_client
+from services.storage import (
+    HashRing, LocalStorage, S3Storage, ShardedStorage, Storage
+)
+
+
+local_storage = LocalStorage(app_settings.storage_root)
+shard_ring = None
+if app_settings.s3_shards:
+    shard_ring = HashRing(
+        [shard.name for shard in app_settings.s3_shards],
+        vnodes=app_settings.s3_shard_vnodes
+    )
+
+
+async def get_storage() -> Storage:
+    if app_settings.storage_backend == 'local':
+        return local_storage
+    default = S3Storage(
+        await get_s3_client(), read_client=await get_s3_read_client()
+    )
+    if shard_ring is None:
+        return default
+    return ShardedStorage(
+        {
+            shard.name: S3Storage(
+                await get_s3_client(shard.endpoint), shard.bucket,
+                await get_s3_read_client(shard.endpoint)
+            ) for shard in app_settings.s3_shards
+        },
+        shard_ring,
+        default
+    )
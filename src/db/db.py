@@ -1,17 +1,85 @@
+import itertools
+import time
+
 from sqlalchemy.orm import declarative_base, sessionmaker
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.ext.asyncio import (
+    create_async_engine, AsyncEngine, AsyncSession
+)
 
 from core.config import app_settings
+from db.pool import InstrumentedQueuePool
 
 
 Base = declarative_base()
 
-engine = create_async_engine(
-    app_settings.database_dsn, echo=app_settings.echo_queries, future=True
-)
+
+def create_engine(dsn: str) -> AsyncEngine:
+    return create_async_engine(
+        dsn, echo=app_settings.echo_queries, future=True,
+        poolclass=InstrumentedQueuePool,
+        pool_size=app_settings.db_pool_size,
+        max_overflow=app_settings.db_max_overflow,
+        pool_timeout=app_settings.db_pool_timeout,
+        pool_recycle=app_settings.db_pool_recycle,
+        pool_pre_ping=app_settings.db_pool_pre_ping,
+        connect_args={
+            'prepared_statement_cache_size':
+                app_settings.db_statement_cache_size,
+            'timeout': app_settings.db_connect_timeout,
+        }
+    )
+
+
+engine = create_engine(app_settings.database_dsn)
 async_session = sessionmaker(
     engine, class_=AsyncSession, expire_on_commit=False
 )
+replica_engines = [
+    create_engine(dsn) for dsn in app_settings.database_replica_dsns
+]
+replica_sessions = [
+    sessionmaker(replica, class_=AsyncSession, expire_on_commit=False)
+    for replica in replica_engines
+]
+_next_replica = itertools.count()
+# account id: monotonic time until which its reads go to the primary
+_pinned: dict[str, float] = {}
+MAX_PINNED = 10000
+
+
+def pin_to_primary(account_ids) -> None:
+    """
+    Send reads of ACCOUNT_IDS to the primary for replica_pin_seconds,
+    so an account sees its own writes before replicas replay them.
+    Pins are kept by this process only.
+    """
+    if not replica_sessions:
+        return
+    now = time.monotonic()
+    if len(_pinned) > MAX_PINNED:
+        for account_id, until in list(_pinned.items()):
+            if until <= now:
+                del _pinned[account_id]
+    until = now + app_settings.replica_pin_seconds
+    for account_id in account_ids:
+        if account_id is not None:
+            _pinned[str(account_id)] = until
+
+
+def read_sessionmaker(user_id: str | None = None) -> sessionmaker:
+    """
+    Sessions for read-only queries of USER_ID: the replicas in turn,
+    or the primary when there are none or the account is pinned to it.
+    """
+    if not replica_sessions or (
+            _pinned.get(str(user_id), 0) > time.monotonic()):
+        return async_session
+    return replica_sessions[next(_next_replica) % len(replica_sessions)]
+
+
+def primary_session() -> AsyncSession:
+    # for writes outside of a request
+    return async_session()
 
 
 async def get_session() -> AsyncSession:
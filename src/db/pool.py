@@ -0,0 +1,56 @@
+import time
+from collections import Counter
+
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Queue pool counting checkouts, checkout timeouts and the time spent
+    waiting for a connection, including connecting a new one. Checkouts
+    blocked on a full pool are counted as waiting.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.counters = Counter()
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.waiting = 0
+
+    def _blocks(self) -> bool:
+        # no idle connection and no overflow left, as QueuePool._do_get
+        # decides whether to wait on its queue
+        return self.checkedin() == 0 and (
+            -1 < self._max_overflow <= self._overflow
+        )
+
+    def _do_get(self):
+        started = time.monotonic()
+        blocks = self._blocks()
+        self.waiting += blocks
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.counters['timeouts'] += 1
+            raise
+        finally:
+            self.waiting -= blocks
+            waited = time.monotonic() - started
+            self.counters['checkouts'] += 1
+            self.wait_time += waited
+            self.max_wait = max(self.max_wait, waited)
+
+    def stats(self) -> dict:
+        return {
+            'size': self.size(),
+            'checked_out': self.checkedout(),
+            'idle': self.checkedin(),
+            'overflow': max(self.overflow(), 0),
+            'waiting': self.waiting,
+            'checkouts': self.counters['checkouts'],
+            'timeouts': self.counters['timeouts'],
+            'wait_time': self.wait_time,
+            'max_wait': self.max_wait,
+        }
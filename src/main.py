@@ -1,11 +1,13 @@
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, status
 from fastapi.responses import ORJSONResponse
 from starlette_validation_uploadfile import ValidateUploadFileMiddleware
 
 from core.config import app_settings
 from core.logger import LOGGING
+from core.s3 import s3_pool, shard_pools
 from api.v1 import api_router as v1_router
+from services.exceptions import QuotaExceeded, UnknownShard
 
 
 app = FastAPI(
@@ -24,6 +26,38 @@ app.add_middleware(
 )
 
 
+@app.exception_handler(QuotaExceeded)
+async def quota_exceeded(request: Request, exc: QuotaExceeded):
+    # raised when files rows are written, after the upload checks passed
+    return ORJSONResponse(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        content={'detail': 'Storage quota exceeded'}
+    )
+
+
+@app.exception_handler(UnknownShard)
+async def unknown_shard(request: Request, exc: UnknownShard):
+    # objects recorded on a shard missing from s3_shards
+    return ORJSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={'detail': 'Storage shard unavailable'}
+    )
+
+
+@app.on_event('startup')
+async def startup() -> None:
+    await s3_pool.open()
+    for pool in shard_pools.values():
+        await pool.open()
+
+
+@app.on_event('shutdown')
+async def shutdown() -> None:
+    await s3_pool.close()
+    for pool in shard_pools.values():
+        await pool.close()
+
+
 if __name__ == '__main__':
     uvicorn.run(
         'main:app',
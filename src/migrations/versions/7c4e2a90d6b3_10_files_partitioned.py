@@ -0,0 +1,140 @@
+"""10_files_partitioned
+
+Creates files_new, files hash partitioned by account, and a trigger that
+mirrors every write to files into it. Then copy the existing rows with
+
+    python -m services.backfill_files
+
+and switch the tables with the next revision, which copies whatever is
+still missing under its lock.
+
+files gets the object_key column and the (account_id, path) unique
+constraint of the model first, so the application of this revision runs
+on either table. The constraint index is built concurrently, and it
+replaces the unique constraints on path alone, which refused a path
+already taken by another account. The partition count is fixed here, not
+taken from the settings, so the schema is the same wherever it is
+migrated.
+
+Revision ID: 7c4e2a90d6b3
+Revises: 2b8f51c9e7a4
+Create Date: 2026-10-18 19:20:33.871502
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = '7c4e2a90d6b3'
+down_revision = '2b8f51c9e7a4'
+branch_labels = None
+depends_on = None
+
+PARTITIONS = 16
+
+
+def upgrade() -> None:
+    op.add_column('files', sa.Column('object_key', sa.Text(), nullable=True))
+    with op.get_context().autocommit_block():
+        op.execute(
+            'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS '
+            'uq_files_account_id_path ON files (account_id, path)'
+        )
+    op.execute(
+        'ALTER TABLE files ADD CONSTRAINT uq_files_account_id_path '
+        'UNIQUE USING INDEX uq_files_account_id_path'
+    )
+    op.drop_constraint('path_uniq', 'files', type_='unique')
+    op.drop_constraint('files_path_key', 'files', type_='unique')
+
+    op.create_table('files_new',
+    sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('name', sa.String(length=256), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=True),
+    sa.Column('path', sa.Text(), nullable=False),
+    sa.Column('size', sa.BigInteger(), nullable=False),
+    sa.Column('is_downloadable', sa.Boolean(), nullable=False),
+    sa.Column('account_id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('content_type', sa.String(length=256), nullable=True),
+    sa.Column('extension', sa.String(length=256), nullable=True),
+    sa.Column('blob_hash', sa.String(length=64), nullable=True),
+    sa.Column('search_vector', postgresql.TSVECTOR(), sa.Computed("to_tsvector('simple'::regconfig, regexp_replace(path, '[^[:alnum:]]+', ' ', 'g'))", persisted=True), nullable=True),
+    sa.Column('shard', sa.String(length=64), nullable=True),
+    sa.Column('parent_path', sa.Text(), sa.Computed("regexp_replace(path, '[^/]*$', '')", persisted=True), nullable=True),
+    sa.Column('object_key', sa.Text(), nullable=True),
+    sa.ForeignKeyConstraint(['account_id'], ['users.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['blob_hash'], ['blobs.hash'], ),
+    sa.PrimaryKeyConstraint('id', 'account_id', name='files_new_pkey'),
+    sa.UniqueConstraint('account_id', 'path', name='uq_files_new_account_id_path'),
+    postgresql_partition_by='HASH (account_id)'
+    )
+    for remainder in range(PARTITIONS):
+        op.execute(
+            f'CREATE TABLE files_new_p{remainder} PARTITION OF files_new '
+            f'FOR VALUES WITH (MODULUS {PARTITIONS}, REMAINDER {remainder})'
+        )
+    # renamed to the names of the model when the tables are switched
+    op.create_index('ix_files_new_account_id_created_at_id', 'files_new', ['account_id', 'created_at', 'id'], unique=False)
+    op.create_index('ix_files_new_account_id_path_pattern', 'files_new', ['account_id', 'path'], unique=False, postgresql_ops={'path': 'text_pattern_ops'})
+    op.create_index('ix_files_new_account_id_parent_path_name', 'files_new', ['account_id', 'parent_path', 'name'], unique=False)
+    op.create_index('ix_files_new_path_trgm', 'files_new', ['path'], unique=False, postgresql_using='gin', postgresql_ops={'path': 'gin_trgm_ops'})
+    op.create_index('ix_files_new_search_vector', 'files_new', ['search_vector'], unique=False, postgresql_using='gin')
+    op.create_index('ix_files_new_blob_hash', 'files_new', ['blob_hash'], unique=False)
+
+    # rows of deleted accounts have no place in files_new and are dropped;
+    # content not stored as a blob and without an object_key is under the
+    # path of the file
+    op.execute("""
+        CREATE FUNCTION files_sync() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP <> 'INSERT' THEN
+                DELETE FROM files_new
+                WHERE id = OLD.id AND account_id = OLD.account_id;
+            END IF;
+            IF TG_OP <> 'DELETE' AND NEW.account_id IS NOT NULL THEN
+                INSERT INTO files_new (
+                    id, name, created_at, path, size, is_downloadable,
+                    account_id, content_type, extension, blob_hash, shard,
+                    object_key
+                ) VALUES (
+                    NEW.id, NEW.name, NEW.created_at, NEW.path, NEW.size,
+                    NEW.is_downloadable, NEW.account_id, NEW.content_type,
+                    NEW.extension, NEW.blob_hash, NEW.shard,
+                    COALESCE(
+                        NEW.object_key,
+                        CASE WHEN NEW.blob_hash IS NULL THEN NEW.path END
+                    )
+                )
+                ON CONFLICT (id, account_id) DO UPDATE SET
+                    name = EXCLUDED.name,
+                    created_at = EXCLUDED.created_at,
+                    path = EXCLUDED.path,
+                    size = EXCLUDED.size,
+                    is_downloadable = EXCLUDED.is_downloadable,
+                    content_type = EXCLUDED.content_type,
+                    extension = EXCLUDED.extension,
+                    blob_hash = EXCLUDED.blob_hash,
+                    shard = EXCLUDED.shard,
+                    object_key = EXCLUDED.object_key;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER files_sync
+        AFTER INSERT OR UPDATE OR DELETE ON files
+        FOR EACH ROW EXECUTE FUNCTION files_sync()
+    """)
+
+
+def downgrade() -> None:
+    op.execute('DROP TRIGGER files_sync ON files')
+    op.execute('DROP FUNCTION files_sync()')
+    op.drop_table('files_new')
+    # fails while accounts share a path
+    op.create_unique_constraint('files_path_key', 'files', ['path'])
+    op.create_unique_constraint('path_uniq', 'files', ['path'])
+    op.drop_constraint('uq_files_account_id_path', 'files', type_='unique')
+    op.drop_column('files', 'object_key')
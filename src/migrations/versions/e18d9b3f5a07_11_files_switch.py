@@ -0,0 +1,149 @@
+"""11_files_switch
+
+Replaces files with files_new. Under an exclusive lock on files, rows
+still missing from files_new are copied, and the switch fails when the
+tables then differ in row count. Without a backfill beforehand, as when
+10 and 11 are applied back to back, every row is copied under the lock
+and writes to files wait for it; run
+
+    python -m services.backfill_files --verify
+
+until it reports no missing rows to keep the lock short. The old table
+stays as files_unpartitioned, to be dropped by hand.
+
+Revision ID: e18d9b3f5a07
+Revises: 7c4e2a90d6b3
+Create Date: 2026-10-18 19:48:02.115964
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'e18d9b3f5a07'
+down_revision = '7c4e2a90d6b3'
+branch_labels = None
+depends_on = None
+
+# the partitions of files_new created by 7c4e2a90d6b3
+PARTITIONS = 16
+COLUMNS = (
+    'id, name, created_at, path, size, is_downloadable, account_id, '
+    'content_type, extension, blob_hash, shard'
+)
+INDEXES = (
+    'pkey', 'account_id_created_at_id', 'account_id_path_pattern',
+    'account_id_parent_path_name', 'path_trgm', 'search_vector', 'blob_hash',
+)
+
+
+def rename_indexes(table: str, prefix: str) -> None:
+    # frees the index names of the model
+    op.execute(f"""
+        DO $$
+        DECLARE index_name text;
+        BEGIN
+            FOR index_name IN
+                SELECT indexname FROM pg_indexes WHERE tablename = '{table}'
+            LOOP
+                EXECUTE format(
+                    'ALTER INDEX %I RENAME TO %I',
+                    index_name, left('{prefix}' || index_name, 63)
+                );
+            END LOOP;
+        END
+        $$
+    """)
+
+
+def copy_missing() -> None:
+    # the same copy as services.backfill_files, in one statement
+    op.execute(f"""
+        INSERT INTO files_new ({COLUMNS}, object_key)
+        SELECT {COLUMNS}, COALESCE(
+            object_key, CASE WHEN blob_hash IS NULL THEN path END
+        )
+        FROM files
+        WHERE account_id IS NOT NULL
+        ON CONFLICT DO NOTHING
+    """)
+    connection = op.get_bind()
+    expected = connection.execute(sa.text(
+        'SELECT count(*) FROM files WHERE account_id IS NOT NULL'
+    )).scalar()
+    copied = connection.execute(sa.text(
+        'SELECT count(*) FROM files_new'
+    )).scalar()
+    if copied != expected:
+        raise RuntimeError(
+            f'files_new has {copied} rows of the {expected} files with '
+            'an account, not switching'
+        )
+
+
+def upgrade() -> None:
+    op.execute('LOCK TABLE files IN ACCESS EXCLUSIVE MODE')
+    copy_missing()
+    # files_sync() stays for a downgrade
+    op.execute('DROP TRIGGER files_sync ON files')
+    op.execute('ALTER TABLE files RENAME TO files_unpartitioned')
+    rename_indexes('files_unpartitioned', 'old_')
+    op.execute('ALTER TABLE files_new RENAME TO files')
+    for remainder in range(PARTITIONS):
+        op.execute(
+            f'ALTER TABLE files_new_p{remainder} '
+            f'RENAME TO files_p{remainder}'
+        )
+    for index in INDEXES:
+        old_name = 'files_new_pkey' if index == 'pkey' else (
+            f'ix_files_new_{index}'
+        )
+        new_name = 'files_pkey' if index == 'pkey' else f'ix_files_{index}'
+        op.execute(f'ALTER INDEX {old_name} RENAME TO {new_name}')
+    op.execute(
+        'ALTER TABLE files RENAME CONSTRAINT uq_files_new_account_id_path '
+        'TO uq_files_account_id_path'
+    )
+
+
+def downgrade() -> None:
+    # writes made since the switch are not in the old table
+    op.execute('LOCK TABLE files IN ACCESS EXCLUSIVE MODE')
+    op.execute(
+        'ALTER TABLE files RENAME CONSTRAINT uq_files_account_id_path '
+        'TO uq_files_new_account_id_path'
+    )
+    for index in INDEXES:
+        old_name = 'files_new_pkey' if index == 'pkey' else (
+            f'ix_files_new_{index}'
+        )
+        new_name = 'files_pkey' if index == 'pkey' else f'ix_files_{index}'
+        op.execute(f'ALTER INDEX {new_name} RENAME TO {old_name}')
+    for remainder in range(PARTITIONS):
+        op.execute(
+            f'ALTER TABLE files_p{remainder} '
+            f'RENAME TO files_new_p{remainder}'
+        )
+    op.execute('ALTER TABLE files RENAME TO files_new')
+    op.execute('ALTER TABLE files_unpartitioned RENAME TO files')
+    op.execute("""
+        DO $$
+        DECLARE index_name text;
+        BEGIN
+            FOR index_name IN
+                SELECT indexname FROM pg_indexes
+                WHERE tablename = 'files' AND indexname LIKE 'old\\_%'
+            LOOP
+                EXECUTE format(
+                    'ALTER INDEX %I RENAME TO %I',
+                    index_name, substr(index_name, 5)
+                );
+            END LOOP;
+        END
+        $$
+    """)
+    op.execute("""
+        CREATE TRIGGER files_sync
+        AFTER INSERT OR UPDATE OR DELETE ON files
+        FOR EACH ROW EXECUTE FUNCTION files_sync()
+    """)
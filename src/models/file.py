@@ -1,31 +1,217 @@
 from datetime import datetime
 from uuid import uuid4
-from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.orm import relationship
+from sqlalchemy.dialects.postgresql import UUID, ARRAY, TSVECTOR
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy import (
-    Column, Integer, String, DateTime, Boolean, Text, ForeignKey,
-    UniqueConstraint, func, FetchedValue
+    Column, Integer, BigInteger, String, DateTime, Boolean, Text, ForeignKey,
+    UniqueConstraint, Index, Computed, func, FetchedValue, DDL, event
 )
 
+from core.config import app_settings
 from db.db import Base
 
 
 class File(Base):
+    """
+    Files of all accounts, hash partitioned by account so that every
+    account query reads one partition and its indexes.
+    """
     __tablename__ = 'files'
+    __table_args__ = (
+        # paths are per account, unique keys of a partitioned table have
+        # to include the partition key
+        UniqueConstraint(
+            'account_id', 'path', name='uq_files_account_id_path'
+        ),
+        # keyset pagination of listings
+        Index(
+            'ix_files_account_id_created_at_id',
+            'account_id', 'created_at', 'id'
+        ),
+        # path prefix (directory) lookups with LIKE 'dir/%'
+        Index(
+            'ix_files_account_id_path_pattern', 'account_id', 'path',
+            postgresql_ops={'path': 'text_pattern_ops'}
+        ),
+        # immediate children of a directory
+        Index(
+            'ix_files_account_id_parent_path_name',
+            'account_id', 'parent_path', 'name'
+        ),
+        # substring and regex search, name is the end of path
+        Index(
+            'ix_files_path_trgm', 'path', postgresql_using='gin',
+            postgresql_ops={'path': 'gin_trgm_ops'}
+        ),
+        Index(
+            'ix_files_search_vector', 'search_vector', postgresql_using='gin'
+        ),
+        # partitions are created by create_file_partitions
+        {'postgresql_partition_by': 'HASH (account_id)'},
+    )
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid4)
     name = Column(String(256), nullable=False)
     created_at = Column(
-        DateTime, index=True, default=func.now(), onupdate=func.now(),
+        DateTime, default=func.now(), onupdate=func.now(),
         server_default=func.now(), server_onupdate=func.now()
     )
-    path = Column(Text, unique=True, nullable=False)
-    size = Column(Integer, nullable=False, default=0)
+    path = Column(Text, nullable=False)
+    size = Column(BigInteger, nullable=False, default=0)
     is_downloadable = Column(Boolean, default=True, nullable=False)
     account_id = Column(
-        ForeignKey('users.id', ondelete='SET NULL'), nullable=True
+        ForeignKey('users.id', ondelete='CASCADE'), primary_key=True
     )
     content_type = Column(String(256), nullable=True)
     extension = Column(String(256), nullable=True)
+    blob_hash = Column(ForeignKey('blobs.hash'), index=True, nullable=True)
+    # words of the path for full-text search
+    search_vector = deferred(Column(
+        TSVECTOR,
+        Computed(
+            "to_tsvector('simple'::regconfig, "
+            "regexp_replace(path, '[^[:alnum:]]+', ' ', 'g'))",
+            persisted=True
+        )
+    ))
+    # s3_shards entry holding the content, NULL for s3_bucket
+    shard = Column(String(64), nullable=True)
+    # directory of the file, ending with '/', '' for the root
+    parent_path = Column(
+        Text, Computed("regexp_replace(path, '[^/]*$', '')", persisted=True)
+    )
+    # key of content not stored as a blob: uploads assembled in storage,
+    # and files from before deduplication under their path
+    object_key = Column(Text, nullable=True)
 
     account = relationship('User', back_populates='files')
-    path_uniq_constraint = UniqueConstraint(path, name='path_uniq')
+
+    @property
+    def storage_key(self) -> str:
+        if self.blob_hash:
+            return Blob.key_for(self.blob_hash)
+        return self.object_key
+
+    @staticmethod
+    def object_key_for(account_id, path: str) -> str:
+        return f'accounts/{account_id}/{path}'
+
+
+@event.listens_for(File.__table__, 'after_create')
+def create_file_partitions(target, connection, **kw) -> None:
+    for remainder in range(app_settings.files_partitions):
+        connection.execute(DDL(
+            f'CREATE TABLE {target.name}_p{remainder} '
+            f'PARTITION OF {target.name} FOR VALUES WITH '
+            f'(MODULUS {app_settings.files_partitions}, '
+            f'REMAINDER {remainder})'
+        ))
+
+
+class Directory(Base):
+    """
+    Directory of an account with rollups of the files anywhere under it,
+    kept up to date as files are written and deleted.
+    """
+    __tablename__ = 'directories'
+    __table_args__ = (
+        Index(
+            'ix_directories_account_id_parent_path_name',
+            'account_id', 'parent_path', 'name'
+        ),
+    )
+    account_id = Column(
+        ForeignKey('users.id', ondelete='CASCADE'), primary_key=True
+    )
+    path = Column(Text, primary_key=True)  # ends with '/'
+    parent_path = Column(Text, nullable=False)  # '' for the root
+    name = Column(Text, nullable=False)
+    file_count = Column(BigInteger, nullable=False, default=0)
+    total_size = Column(BigInteger, nullable=False, default=0)
+
+
+class AccountUsage(Base):
+    """
+    Files and bytes an account holds, the rollup of its root directory,
+    and its quotas.
+    """
+    __tablename__ = 'account_usage'
+    account_id = Column(
+        ForeignKey('users.id', ondelete='CASCADE'), primary_key=True
+    )
+    file_count = Column(BigInteger, nullable=False, default=0)
+    total_size = Column(BigInteger, nullable=False, default=0)
+    # NULL takes the default quota of the settings, 0 is unlimited
+    quota_bytes = Column(BigInteger, nullable=True)
+    quota_files = Column(BigInteger, nullable=True)
+
+
+class Blob(Base):
+    __tablename__ = 'blobs'
+    hash = Column(String(64), primary_key=True)  # sha256 hex digest
+    size = Column(BigInteger, nullable=False)
+    refcount = Column(Integer, nullable=False, default=0)
+    shard = Column(String(64), nullable=True)
+    created_at = Column(
+        DateTime, default=func.now(), server_default=func.now()
+    )
+    # content codings with a precompressed variant stored next to the blob
+    encodings = Column(
+        ARRAY(String(16)), nullable=False, default=list,
+        server_default='{}'
+    )
+
+    @staticmethod
+    def key_for(blob_hash: str) -> str:
+        return f'blobs/{blob_hash}'
+
+    @staticmethod
+    def variant_key_for(blob_hash: str, encoding: str) -> str:
+        return f'blobs/{blob_hash}.{encoding}'
+
+
+class UploadSession(Base):
+    __tablename__ = 'upload_sessions'
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid4)
+    created_at = Column(
+        DateTime, index=True, default=func.now(), server_default=func.now()
+    )
+    path = Column(Text, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    chunk_size = Column(BigInteger, nullable=False)
+    content_type = Column(String(256), nullable=True)
+    upload_id = Column(Text, nullable=False)
+    account_id = Column(
+        ForeignKey('users.id', ondelete='CASCADE'), nullable=False
+    )
+
+    parts = relationship(
+        'UploadPart', cascade='all, delete-orphan', passive_deletes=True,
+        order_by='UploadPart.number'
+    )
+
+    @property
+    def storage_key(self) -> str:
+        return File.object_key_for(self.account_id, self.path)
+
+    @property
+    def chunks_total(self) -> int:
+        return max(1, -(-self.size // self.chunk_size))
+
+    @property
+    def chunks_received(self) -> list[int]:
+        return [part.number for part in self.parts]
+
+    def chunk_length(self, number: int) -> int:
+        if number < self.chunks_total:
+            return self.chunk_size
+        return self.size - self.chunk_size * (self.chunks_total - 1)
+
+
+class UploadPart(Base):
+    __tablename__ = 'upload_parts'
+    session_id = Column(
+        ForeignKey('upload_sessions.id', ondelete='CASCADE'), primary_key=True
+    )
+    number = Column(Integer, primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    etag = Column(String(256), nullable=False)
@@ -14,5 +14,6 @@ class User(Base):
     password = Column(String(256), nullable=False)
     created_at = Column(DateTime, index=True, default=datetime.utcnow)
 
-    files = relationship('File')
+    # files are deleted with the user by the database
+    files = relationship('File', passive_deletes=True)
 
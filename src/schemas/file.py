@@ -1,8 +1,13 @@
+import os
 from datetime import datetime
+from enum import Enum
 from uuid import UUID
 from pathlib import Path
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, constr
+
+
+FilePath = constr(regex=r'^[^\/].+(?=\/)*[\/]?.+$')
 
 
 class FileInfo(BaseModel):
@@ -30,12 +35,150 @@ class FileCreate(BaseModel):
     account_id: UUID
     content_type: str
     extension: str
+    blob_hash: str | None = None
+    shard: str | None = None
+    object_key: str | None = None
+
+    @classmethod
+    def from_path(cls, path: str, **kwargs) -> 'FileCreate':
+        name = Path(path).name
+        return cls(
+            name=name,
+            path=path,
+            is_downloadable=True,
+            extension=os.path.splitext(name)[1].replace('.', ''),
+            **kwargs
+        )
+
+
+class ArchiveFormat(str, Enum):
+    zip = 'zip'
+    tar = 'tar'
+    tar_gz = 'tar.gz'
+    tar_zst = 'tar.zst'
+
+
+class BatchItemStatus(str, Enum):
+    created = 'created'
+    error = 'error'
+
+
+class BatchUploadItem(BaseModel):
+    path: str
+    status: BatchItemStatus
+    detail: str | None = None
+    file: FileInDBBase | None = None
+
+
+class BatchUploadResult(BaseModel):
+    results: list[BatchUploadItem]
+
+
+class ListOrder(str, Enum):
+    created_at = 'created_at'
+    path = 'path'
 
 
 class FileDownloaded(BaseModel):
     account_id: UUID
     files: list[FileInfo]
+    next_cursor: str | None = Field(
+        None, description='CURSOR of the next page, if there is one'
+    )
 
 
 class SearchFile(BaseModel):
     matches: list[FileInfo]
+
+
+class DirectoryInfo(BaseModel):
+    path: str
+    name: str
+    file_count: int
+    total_size: int
+
+    class Config:
+        orm_mode = True
+
+
+class DirectoryListing(DirectoryInfo):
+    directories: list[DirectoryInfo]
+    files: list[FileInfo]
+    next_cursor: str | None = Field(
+        None, description='CURSOR of the next page, if there is one'
+    )
+
+
+class AccountUsageInfo(BaseModel):
+    file_count: int
+    total_size: int
+    quota_bytes: int | None = Field(None, description='None is unlimited')
+    quota_files: int | None = Field(None, description='None is unlimited')
+
+
+class DeletedFiles(BaseModel):
+    deleted: int
+    size: int
+
+
+class UploadSessionCreate(BaseModel):
+    path: FilePath
+    size: int = Field(ge=0)
+    content_type: str = 'application/octet-stream'
+    # S3 part limits, 5 MB to 5 GB
+    chunk_size: int | None = Field(default=None, ge=5242880, le=5368709120)
+
+
+class UploadSessionInfo(BaseModel):
+    id: UUID
+    created_at: datetime
+    path: Path
+    size: int
+    chunk_size: int
+    chunks_total: int
+    chunks_received: list[int]
+
+    class Config:
+        orm_mode = True
+
+
+class UploadChunkInfo(BaseModel):
+    number: int
+    size: int
+    etag: str
+
+    class Config:
+        orm_mode = True
+
+
+class PresignedUploadCreate(BaseModel):
+    path: FilePath
+    size: int = Field(ge=0)
+    content_type: str = 'application/octet-stream'
+
+
+class PresignedPart(BaseModel):
+    number: int
+    url: str
+
+
+class PresignedUpload(BaseModel):
+    path: Path
+    expires_in: int
+    url: str | None = None
+    upload_id: str | None = None
+    part_size: int | None = None
+    parts: list[PresignedPart] = []
+
+
+class UploadedPart(BaseModel):
+    number: int
+    etag: str
+
+
+class PresignedUploadComplete(BaseModel):
+    path: FilePath
+    size: int = Field(ge=0)
+    etag: str | None = None
+    upload_id: str | None = None
+    parts: list[UploadedPart] = []
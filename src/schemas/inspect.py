@@ -26,3 +26,61 @@ class S3Status(BaseModel):
 class Ping(BaseModel):
     database: DatabaseStatus
     file_storage: S3Status
+
+
+class CacheStats(BaseModel):
+    hits: int
+    misses: int
+    evictions: int
+    fills: int
+    size: int = Field(description='bytes in cache')
+    max_size: int = Field(description='byte budget')
+
+
+class S3PoolStats(BaseModel):
+    limit: int = Field(description='max connections')
+    in_use: int
+    idle: int
+    waiting: int = Field(description='requests waiting for a connection')
+
+
+class DbPoolStats(BaseModel):
+    size: int
+    checked_out: int
+    idle: int
+    overflow: int = Field(description='connections above size')
+    waiting: int = Field(description='requests waiting for a connection')
+    checkouts: int
+    timeouts: int
+    wait_time: float = Field(description='seconds spent waiting, in total')
+    max_wait: float
+
+
+class S3ReadStats(BaseModel):
+    calls: int
+    retries: int
+    timeouts: int
+    hedges: int = Field(description='duplicate requests started')
+    hedge_wins: int = Field(description='duplicates answering first')
+    errors: int
+    p50: float | None = Field(description='seconds to response')
+    p99: float | None
+    hedge_delay: float | None = Field(
+        description='seconds before a duplicate is started'
+    )
+
+
+class Stats(BaseModel):
+    db_pool: DbPoolStats
+    db_replica_pools: list[DbPoolStats] = Field(
+        [], description='in the order of database_replica_dsns'
+    )
+    s3_pool: S3PoolStats
+    s3_shard_pools: dict[str, S3PoolStats] = Field(
+        {}, description='by endpoint, for s3_shards on other endpoints'
+    )
+    s3_reads: dict[str, S3ReadStats] = Field(
+        {}, description='by S3 operation'
+    )
+    object_cache: CacheStats
+    archive_cache: CacheStats
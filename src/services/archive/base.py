@@ -0,0 +1,100 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from typing import AsyncIterator, Awaitable, Callable, Iterable
+
+
+COMPRESSED_MEDIA_TYPES = (
+    'image/jpeg', 'image/png', 'image/gif', 'image/webp', 'image/avif',
+    'image/heic', 'video/', 'audio/mpeg', 'audio/ogg', 'audio/aac',
+    'audio/flac', 'audio/mp4', 'application/zip', 'application/gzip',
+    'application/x-gzip', 'application/x-bzip2', 'application/x-xz',
+    'application/zstd', 'application/x-7z-compressed',
+    'application/x-rar-compressed', 'application/vnd.rar',
+    'application/java-archive', 'application/epub+zip', 'application/pdf',
+    'application/vnd.openxmlformats-officedocument.',
+    'application/vnd.oasis.opendocument.',
+)
+COMPRESSED_EXTENSIONS = {
+    'zip', 'gz', 'tgz', 'bz2', 'xz', 'zst', '7z', 'rar', 'jar', 'apk',
+    'jpg', 'jpeg', 'png', 'gif', 'webp', 'avif', 'heic', 'mp3', 'mp4',
+    'm4a', 'aac', 'ogg', 'flac', 'mkv', 'avi', 'mov', 'webm', 'pdf',
+    'docx', 'xlsx', 'pptx', 'odt', 'ods', 'odp', 'epub',
+}
+
+
+def is_compressed(content_type: str | None, extension: str | None) -> bool:
+    """
+    Guess whether content is already compressed and not worth deflating.
+    """
+    if extension and extension.lower() in COMPRESSED_EXTENSIONS:
+        return True
+    return bool(content_type) and content_type.lower().startswith(
+        COMPRESSED_MEDIA_TYPES
+    )
+
+
+@dataclass
+class ArchiveEntry:
+    name: str
+    size: int
+    modified: datetime
+    open: Callable[[], Awaitable[AsyncIterator[bytes]]]
+    compress: bool = True
+
+
+async def open_entries(
+        entries: Iterable[ArchiveEntry], prefetch: int
+) -> AsyncIterator[tuple[ArchiveEntry, AsyncIterator[bytes]]]:
+    """
+    Open entries in order, keeping at most `prefetch` opens ahead of the
+    entry being consumed, so the next bodies are ready when needed
+    without holding a connection per entry.
+    """
+    entries = iter(entries)
+    pending = deque()
+
+    def schedule() -> None:
+        while len(pending) < max(prefetch, 1):
+            entry = next(entries, None)
+            if entry is None:
+                return
+            pending.append((entry, asyncio.create_task(entry.open())))
+
+    try:
+        schedule()
+        while pending:
+            entry, task = pending.popleft()
+            content = await task
+            schedule()
+            yield entry, content
+    finally:
+        for _, task in pending:
+            task.cancel()
+
+
+class ThreadedCompressor:
+    """
+    Run a zlib style compressobj in the default thread pool, feeding it
+    batches of at least `batch_size` bytes so the thread hops stay cheap
+    and the event loop stays responsive.
+    """
+
+    def __init__(self, compressor, batch_size: int = 262144):
+        self.compressor = compressor
+        self.batch_size = batch_size
+        self.buffer = bytearray()
+
+    async def compress(self, data: bytes) -> bytes:
+        self.buffer.extend(data)
+        if len(self.buffer) < self.batch_size:
+            return b''
+        data, self.buffer = bytes(self.buffer), bytearray()
+        return await asyncio.to_thread(self.compressor.compress, data)
+
+    async def flush(self) -> bytes:
+        data, self.buffer = bytes(self.buffer), bytearray()
+        return await asyncio.to_thread(
+            lambda: self.compressor.compress(data) + self.compressor.flush()
+        )
@@ -0,0 +1,47 @@
+import hashlib
+import os
+from typing import Iterable
+
+from core.config import app_settings
+from models.file import File
+from services.cache import DiskCache
+from services.utils import parent_prefixes
+
+
+archive_cache = DiskCache(
+    os.path.join(app_settings.cache_dir, 'archives'),
+    app_settings.archive_cache_size
+)
+
+
+def archive_namespace(user_id: str, prefix: str) -> str:
+    return f'{user_id}:{prefix}'
+
+
+def manifest_fingerprint(files: Iterable[File], *parts: object) -> str:
+    """
+    Fingerprint of the (path, size, created_at) manifest of a directory.
+
+    Any upload under the directory refreshes created_at of the row, so a
+    changed directory never matches a cached archive.
+    """
+    digest = hashlib.sha256(':'.join(map(str, parts)).encode())
+    for file in sorted(files, key=lambda file: file.path):
+        digest.update(
+            f'|{file.path}:{file.size}:{file.created_at.isoformat()}'.encode()
+        )
+    return digest.hexdigest()
+
+
+async def invalidate_archives(files: Iterable[tuple[str, str]]) -> None:
+    """
+    Drop archives cached for every directory above the (user_id, path)
+    pairs.
+    """
+    namespaces = {
+        archive_namespace(user_id, prefix)
+        for user_id, path in files
+        for prefix in parent_prefixes(path)
+    }
+    for namespace in namespaces:
+        await archive_cache.invalidate(namespace)
@@ -0,0 +1,54 @@
+from core.config import app_settings
+from services.archive.base import ArchiveEntry
+from services.archive.tar_stream import TarStream, zstandard
+from services.archive.zip_stream import ZipStream
+
+
+MEDIA_TYPES = {
+    'zip': 'application/x-zip-compressed',
+    'tar': 'application/x-tar',
+    'tar.gz': 'application/gzip',
+    'tar.zst': 'application/zstd',
+}
+LEVELS = {
+    'zip': range(0, 10),
+    'tar': range(0, 1),
+    'tar.gz': range(0, 10),
+    'tar.zst': range(1, 23),
+}
+
+
+def default_level(archive_format: str) -> int:
+    return {
+        'zip': app_settings.zip_compression_level,
+        'tar': 0,
+        'tar.gz': app_settings.gzip_compression_level,
+        'tar.zst': app_settings.zstd_compression_level,
+    }[archive_format]
+
+
+def check_format(archive_format: str, level: int) -> None:
+    """
+    Raise ValueError when the format can't be built with the level.
+    """
+    if archive_format == 'tar.zst' and zstandard is None:
+        raise ValueError('tar.zst is not available')
+    levels = LEVELS[archive_format]
+    if level not in levels:
+        raise ValueError(
+            f'Level for {archive_format} must be from {levels.start} '
+            f'to {levels.stop - 1}'
+        )
+
+
+def make_archive(
+        archive_format: str, entries: list[ArchiveEntry], level: int
+) -> ZipStream | TarStream:
+    if archive_format == 'zip':
+        return ZipStream(
+            entries, prefetch=app_settings.archive_prefetch, level=level
+        )
+    return TarStream(
+        entries, prefetch=app_settings.archive_prefetch,
+        compression=archive_format.partition('.')[2] or None, level=level
+    )
@@ -0,0 +1,101 @@
+import tarfile
+import zlib
+from typing import AsyncIterator
+
+from services.archive.base import (
+    ArchiveEntry, ThreadedCompressor, open_entries
+)
+from services.exceptions import DownloadException
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+
+BLOCK_SIZE = tarfile.BLOCKSIZE
+END_OF_ARCHIVE = bytes(BLOCK_SIZE * 2)
+COMPRESSION_LEVELS = {
+    None: None,
+    'gz': range(0, 10),
+    'zst': range(1, 23),
+}
+
+
+def compressobj(compression: str | None, level: int):
+    if compression == 'gz':
+        # wbits 31 writes a gzip header and trailer
+        return zlib.compressobj(level, zlib.DEFLATED, 31)
+    if compression == 'zst':
+        if zstandard is None:
+            raise DownloadException
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    return None
+
+
+class TarStream:
+    """
+    POSIX (pax) tar archive generated on the fly from archive entries,
+    optionally wrapped in gzip or zstd.
+
+    Tar headers carry the entry size, so entries must match their
+    declared size. Compression runs in the thread pool. An uncompressed
+    archive has an exact size, see `content_length`.
+    """
+
+    def __init__(
+            self, entries: list[ArchiveEntry], prefetch: int = 4,
+            compression: str | None = None, level: int = 3
+    ):
+        self.entries = entries
+        self.prefetch = prefetch
+        self.compression = compression
+        self.level = level
+
+    @staticmethod
+    def _header(entry: ArchiveEntry) -> bytes:
+        info = tarfile.TarInfo(entry.name)
+        info.size = entry.size
+        info.mtime = int(entry.modified.timestamp())
+        info.mode = 0o644
+        return info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+
+    @staticmethod
+    def _padding(size: int) -> bytes:
+        return bytes(-size % BLOCK_SIZE)
+
+    def content_length(self) -> int | None:
+        if self.compression:
+            return None
+        return sum(
+            len(self._header(entry)) + entry.size
+            + len(self._padding(entry.size))
+            for entry in self.entries
+        ) + len(END_OF_ARCHIVE)
+
+    async def _tar(self) -> AsyncIterator[bytes]:
+        async for entry, content in open_entries(self.entries, self.prefetch):
+            yield self._header(entry)
+            size = 0
+            async for chunk in content:
+                size += len(chunk)
+                if size > entry.size:
+                    break
+                yield chunk
+            if size != entry.size:
+                # the size was promised in the header
+                raise DownloadException
+            yield self._padding(size)
+        yield END_OF_ARCHIVE
+
+    async def stream(self) -> AsyncIterator[bytes]:
+        compressor = compressobj(self.compression, self.level)
+        if compressor is None:
+            async for chunk in self._tar():
+                yield chunk
+            return
+        compressor = ThreadedCompressor(compressor)
+        async for chunk in self._tar():
+            if data := await compressor.compress(chunk):
+                yield data
+        yield await compressor.flush()
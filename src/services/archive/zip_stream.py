@@ -0,0 +1,178 @@
+import struct
+import zlib
+from datetime import datetime
+from typing import AsyncIterator
+
+from services.archive.base import (
+    ArchiveEntry, ThreadedCompressor, open_entries
+)
+from services.exceptions import DownloadException
+
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_MAX_ENTRIES = 0xFFFF
+STORED = 0
+DEFLATED = 8
+# data descriptor follows the data, names are UTF-8
+FLAGS = 0x08 | 0x800
+
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+DATA_DESCRIPTOR = struct.Struct('<IIII')
+DATA_DESCRIPTOR64 = struct.Struct('<IIQQ')
+END_RECORD = struct.Struct('<IHHHHIIH')
+END_RECORD64 = struct.Struct('<IQHHIIQQQQ')
+END_LOCATOR64 = struct.Struct('<IIQI')
+
+
+def dos_datetime(value: datetime) -> tuple[int, int]:
+    value = max(value, datetime(1980, 1, 1))
+    return (
+        value.hour << 11 | value.minute << 5 | value.second // 2,
+        (value.year - 1980) << 9 | value.month << 5 | value.day
+    )
+
+
+class ZipStream:
+    """
+    Zip archive generated on the fly from archive entries.
+
+    Entries are streamed with a data descriptor, so nothing is buffered.
+    Already compressed content is stored, the rest is deflated in the
+    thread pool. ZIP64 records are written for entries and archives over
+    4 GB. When every entry is stored the archive size is known in
+    advance, see `content_length`.
+    """
+
+    def __init__(
+            self, entries: list[ArchiveEntry], prefetch: int = 4,
+            level: int = 6
+    ):
+        self.entries = entries
+        self.prefetch = prefetch
+        self.level = level
+
+    @staticmethod
+    def _is_zip64(entry: ArchiveEntry) -> bool:
+        # deflate may grow incompressible data a little
+        margin = 1.05 if entry.compress else 1
+        return entry.size * margin >= ZIP64_LIMIT
+
+    @staticmethod
+    def _local_header(entry: ArchiveEntry, zip64: bool) -> bytes:
+        name = entry.name.encode()
+        extra = struct.pack('<HHQQ', 1, 16, 0, 0) if zip64 else b''
+        size = ZIP64_LIMIT if zip64 else 0
+        return LOCAL_HEADER.pack(
+            0x04034b50, 45 if zip64 else 20, FLAGS,
+            DEFLATED if entry.compress else STORED,
+            *dos_datetime(entry.modified), 0, size, size,
+            len(name), len(extra)
+        ) + name + extra
+
+    @staticmethod
+    def _data_descriptor(
+            zip64: bool, crc: int, compressed: int, size: int) -> bytes:
+        if zip64:
+            return DATA_DESCRIPTOR64.pack(0x08074b50, crc, compressed, size)
+        return DATA_DESCRIPTOR.pack(0x08074b50, crc, compressed, size)
+
+    @staticmethod
+    def _central_header(
+            entry: ArchiveEntry, zip64: bool, crc: int, compressed: int,
+            size: int, offset: int
+    ) -> bytes:
+        name = entry.name.encode()
+        fields = [size, compressed] if zip64 else []
+        if offset >= ZIP64_LIMIT:
+            fields.append(offset)
+        extra = b''
+        if fields:
+            extra = struct.pack(
+                f'<HH{len(fields)}Q', 1, 8 * len(fields), *fields
+            )
+        return CENTRAL_HEADER.pack(
+            0x02014b50, 45 | 3 << 8, 45 if extra else 20, FLAGS,
+            DEFLATED if entry.compress else STORED,
+            *dos_datetime(entry.modified), crc,
+            ZIP64_LIMIT if zip64 else compressed,
+            ZIP64_LIMIT if zip64 else size,
+            len(name), len(extra), 0, 0, 0, 0o100644 << 16,
+            min(offset, ZIP64_LIMIT)
+        ) + name + extra
+
+    @staticmethod
+    def _end_records(count: int, size: int, offset: int) -> bytes:
+        records = b''
+        if (count >= ZIP_MAX_ENTRIES or size >= ZIP64_LIMIT
+                or offset >= ZIP64_LIMIT):
+            records = END_RECORD64.pack(
+                0x06064b50, END_RECORD64.size - 12, 45, 45, 0, 0,
+                count, count, size, offset
+            ) + END_LOCATOR64.pack(0x07064b50, 0, offset + size, 1)
+        return records + END_RECORD.pack(
+            0x06054b50, 0, 0, min(count, ZIP_MAX_ENTRIES),
+            min(count, ZIP_MAX_ENTRIES), min(size, ZIP64_LIMIT),
+            min(offset, ZIP64_LIMIT), 0
+        )
+
+    def content_length(self) -> int | None:
+        """
+        Exact archive size, or None when some entry is deflated.
+        """
+        if any(entry.compress for entry in self.entries):
+            return None
+        offset = 0
+        directory = 0
+        for entry in self.entries:
+            zip64 = self._is_zip64(entry)
+            directory += len(self._central_header(
+                entry, zip64, 0, entry.size, entry.size, offset
+            ))
+            offset += (
+                len(self._local_header(entry, zip64)) + entry.size
+                + len(self._data_descriptor(zip64, 0, 0, 0))
+            )
+        return offset + directory + len(
+            self._end_records(len(self.entries), directory, offset)
+        )
+
+    async def stream(self) -> AsyncIterator[bytes]:
+        offset = 0
+        directory = []
+        async for entry, content in open_entries(self.entries, self.prefetch):
+            zip64 = self._is_zip64(entry)
+            header = self._local_header(entry, zip64)
+            yield header
+            compressor = None
+            if entry.compress:
+                compressor = ThreadedCompressor(
+                    zlib.compressobj(self.level, zlib.DEFLATED, -15)
+                )
+            crc = size = compressed = 0
+            async for chunk in content:
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                if compressor:
+                    chunk = await compressor.compress(chunk)
+                compressed += len(chunk)
+                if chunk:
+                    yield chunk
+            if compressor:
+                chunk = await compressor.flush()
+                compressed += len(chunk)
+                yield chunk
+            if (not entry.compress and size != entry.size
+                    or not zip64 and compressed >= ZIP64_LIMIT):
+                # sizes were promised in headers or Content-Length
+                raise DownloadException
+            descriptor = self._data_descriptor(zip64, crc, compressed, size)
+            yield descriptor
+            directory.append(self._central_header(
+                entry, zip64, crc, compressed, size, offset
+            ))
+            offset += len(header) + compressed + len(descriptor)
+
+        directory = b''.join(directory)
+        yield directory
+        yield self._end_records(len(self.entries), len(directory), offset)
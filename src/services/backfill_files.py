@@ -0,0 +1,117 @@
+"""
+Copy files into files_new, the partitioned table of migration
+10_files_partitioned, while the application keeps writing to files:
+
+    python -m services.backfill_files [--batch-size N] [--pause SECONDS]
+    python -m services.backfill_files --verify
+
+The trigger of the migration mirrors every write made since it was
+created, this copies the rows written before. Batches are short
+transactions in primary key order and can be resumed with --after.
+11_files_switch copies what is left under its lock, so running this
+first keeps that lock short.
+"""
+import argparse
+import asyncio
+import logging
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text
+
+from db.db import async_session
+
+
+logger = logging.getLogger(__name__)
+COLUMNS = (
+    'id, name, created_at, path, size, is_downloadable, account_id, '
+    'content_type, extension, blob_hash, shard'
+)
+OBJECT_KEY = (
+    'COALESCE(object_key, CASE WHEN blob_hash IS NULL THEN path END)'
+)
+# FOR SHARE waits for writers of the batch rows and skips rows they
+# deleted, so a copy never brings back a row the trigger removed
+COPY_BATCH = text(f"""
+    WITH batch AS (
+        SELECT {COLUMNS}, object_key FROM files
+        WHERE id > CAST(:after AS uuid)
+        ORDER BY id
+        LIMIT :batch_size
+        FOR SHARE
+    ), copied AS (
+        INSERT INTO files_new ({COLUMNS}, object_key)
+        SELECT {COLUMNS}, {OBJECT_KEY}
+        FROM batch
+        WHERE account_id IS NOT NULL
+        ON CONFLICT DO NOTHING
+        RETURNING 1
+    )
+    SELECT
+        (SELECT CAST(id AS text) FROM batch ORDER BY id DESC LIMIT 1),
+        (SELECT count(*) FROM batch),
+        (SELECT count(*) FROM copied)
+""")
+MISSING = text("""
+    SELECT count(*) FROM files
+    WHERE account_id IS NOT NULL AND NOT EXISTS (
+        SELECT 1 FROM files_new
+        WHERE files_new.id = files.id
+            AND files_new.account_id = files.account_id
+    )
+""")
+FIRST_ID = '00000000-0000-0000-0000-000000000000'
+
+
+async def backfill(
+        db: AsyncSession, after: str = FIRST_ID, batch_size: int = 1000,
+        pause: float = 0
+) -> tuple[int, int]:
+    """
+    Copy the rows of files with an id above AFTER that files_new lacks.
+    Returns the number of rows read and copied; rows without an account
+    are not copied.
+    """
+    read = copied = 0
+    while True:
+        result = await db.execute(
+            COPY_BATCH, {'after': after, 'batch_size': batch_size}
+        )
+        last_id, batch_read, batch_copied = result.one()
+        await db.commit()
+        if last_id is None:
+            return read, copied
+        after = last_id
+        read += batch_read
+        copied += batch_copied
+        logger.info('Copied %d of %d rows, up to %s', copied, read, after)
+        if pause:
+            await asyncio.sleep(pause)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument(
+        '--pause', type=float, default=0,
+        help='seconds between batches, to spare replicas and vacuum'
+    )
+    parser.add_argument('--after', default=FIRST_ID, help='resume after id')
+    parser.add_argument(
+        '--verify', action='store_true',
+        help='count rows of files missing from files_new'
+    )
+    args = parser.parse_args()
+    async with async_session() as db:
+        if args.verify:
+            missing = (await db.execute(MISSING)).scalar()
+            logger.info('%d rows missing from files_new', missing)
+            return
+        read, copied = await backfill(
+            db, args.after, args.batch_size, args.pause
+        )
+    logger.info('Done: %d rows read, %d copied', read, copied)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,214 @@
+"""
+Content addressed blobs, shared by the files with the same content and
+counted by refcount. Blobs no file refers to are deleted with their
+objects by collect_blobs, after the files are deleted, and for
+overwritten files by
+
+    python -m services.blob
+
+Objects of blobs an upload wrote but could not register are deleted by
+discard_blobs.
+"""
+import asyncio
+import logging
+from collections import Counter
+from typing import Iterable
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, delete, bindparam, func, text
+from sqlalchemy.dialects.postgresql import insert
+
+from core.s3 import s3_pool, shard_pools
+from core.storage import get_storage
+from db.db import async_session
+from models.file import Blob
+from services.rebalance import delete_objects
+from services.storage import Storage
+
+
+logger = logging.getLogger(__name__)
+
+
+def blob_lock_id(blob_hash: str) -> int:
+    # advisory lock key of a blob, from the first 64 bits of its digest
+    return int(blob_hash[:16], 16) - (1 << 63)
+
+
+async def lock_uploads(db: AsyncSession, hashes: Iterable[str]) -> None:
+    """
+    Mark the blobs of HASHES as being uploaded until the end of the
+    caller's transaction, so discard_blobs keeps their objects.
+    """
+    await db.execute(
+        text(
+            'SELECT pg_advisory_xact_lock_shared(id) '
+            'FROM unnest(CAST(:ids AS bigint[])) AS id'
+        ),
+        {'ids': sorted({blob_lock_id(blob_hash) for blob_hash in hashes})}
+    )
+
+
+async def blob_exists(db: AsyncSession, blob_hash: str) -> bool:
+    # a blob found stored stays locked until the uploader's transaction
+    # ends, so collect_blobs cannot delete it before then; KEY SHARE
+    # still lets refcount updates of other transactions through
+    await lock_uploads(db, [blob_hash])
+    statement = (
+        select(Blob.hash).where(Blob.hash == blob_hash).with_for_update(
+            read=True, key_share=True
+        )
+    )
+    result = await db.execute(statement=statement)
+    return result.scalar_one_or_none() is not None
+
+
+async def get_stored_blobs(
+        db: AsyncSession, hashes: Iterable[str]) -> set[str]:
+    hashes = set(hashes)
+    await lock_uploads(db, hashes)
+    statement = (
+        select(Blob.hash).where(Blob.hash.in_(hashes)).
+        order_by(Blob.hash).
+        with_for_update(read=True, key_share=True)
+    )
+    result = await db.execute(statement=statement)
+    return set(result.scalars())
+
+
+async def acquire_blobs(
+        db: AsyncSession, blobs: Iterable[tuple[str, int, str | None]]
+) -> dict[str, str | None]:
+    """
+    Take a reference on each (hash, size, shard), creating missing blobs
+    as stored on that shard. Returns the shard every blob is stored on,
+    which for blobs stored before is where the first copy went.
+    """
+    counts = Counter()
+    sizes = {}
+    shards = {}
+    for blob_hash, size, shard in blobs:
+        counts[blob_hash] += 1
+        sizes[blob_hash] = size
+        shards.setdefault(blob_hash, shard)
+    if not counts:
+        return {}
+    query = insert(Blob).values([
+        {
+            'hash': blob_hash, 'size': sizes[blob_hash],
+            'refcount': count, 'shard': shards[blob_hash]
+        } for blob_hash, count in counts.items()
+    ])
+    query = query.on_conflict_do_update(
+        index_elements=[Blob.hash],
+        set_={'refcount': Blob.refcount + query.excluded.refcount}
+    ).returning(Blob.hash, Blob.shard)
+    result = await db.execute(query)
+    return dict(result.all())
+
+
+async def release_blobs(db: AsyncSession, hashes: Iterable[str]) -> None:
+    counts = Counter(blob_hash for blob_hash in hashes if blob_hash)
+    if not counts:
+        return
+    table = Blob.__table__
+    query = (
+        update(table).
+        where(table.c.hash == bindparam('b_hash')).
+        values(refcount=table.c.refcount - bindparam('b_count'))
+    )
+    await db.execute(query, [
+        {'b_hash': blob_hash, 'b_count': count}
+        for blob_hash, count in counts.items()
+    ])
+
+
+async def discard_blobs(
+        db: AsyncSession, storage: Storage,
+        blobs: Iterable[tuple[str, str | None]]
+) -> None:
+    """
+    Delete the objects of (hash, shard) BLOBS an upload wrote but could
+    not register, in a transaction of its own. Objects of blobs with a
+    row, or that another upload is about to register, are kept.
+    """
+    keys = {}
+    for blob_hash, shard in set(blobs):
+        locked = await db.scalar(
+            select(func.pg_try_advisory_xact_lock(blob_lock_id(blob_hash)))
+        )
+        if locked and not await db.scalar(
+                select(Blob.hash).where(Blob.hash == blob_hash)):
+            keys.setdefault(shard, []).append(Blob.key_for(blob_hash))
+    # the locks are held until the objects are gone
+    await asyncio.gather(*[
+        delete_objects(storage, shard_keys, shard)
+        for shard, shard_keys in keys.items()
+    ])
+    await db.commit()
+
+
+async def collect_blobs(
+        db: AsyncSession, storage: Storage,
+        hashes: Iterable[str] | None = None, batch_size: int = 100
+) -> int:
+    """
+    Delete blobs no file refers to, among HASHES or all of them, with
+    their objects and stored variants. Returns the number deleted.
+
+    Rows are deleted first and committed once their objects are gone:
+    an upload finding one of them stored waits for the commit and stores
+    the content again. Blobs locked by an upload are skipped. Objects
+    that cannot be deleted are logged and left behind, as a row kept for
+    them could be acquired by an upload without its content.
+    """
+    if hashes is not None:
+        hashes = sorted({blob_hash for blob_hash in hashes if blob_hash})
+        if not hashes:
+            return 0
+    collected = 0
+    while True:
+        candidates = (
+            select(Blob.hash).where(Blob.refcount <= 0).
+            order_by(Blob.hash).
+            limit(batch_size).
+            with_for_update(skip_locked=True)
+        )
+        if hashes is not None:
+            candidates = candidates.where(Blob.hash.in_(hashes))
+        result = await db.execute(
+            delete(Blob).
+            where(Blob.hash.in_(candidates.scalar_subquery())).
+            returning(Blob.hash, Blob.shard, Blob.encodings).
+            execution_options(synchronize_session=False)
+        )
+        blobs = result.all()
+        if not blobs:
+            await db.commit()
+            return collected
+        await asyncio.gather(*[
+            delete_objects(storage, [
+                Blob.key_for(blob.hash),
+                *(Blob.variant_key_for(blob.hash, encoding)
+                  for encoding in blob.encodings)
+            ], blob.shard) for blob in blobs
+        ])
+        await db.commit()
+        collected += len(blobs)
+        if len(blobs) < batch_size:
+            return collected
+
+
+async def main() -> None:
+    try:
+        storage = await get_storage()
+        async with async_session() as db:
+            collected = await collect_blobs(db, storage)
+        logger.info('Deleted %d unreferenced blobs', collected)
+    finally:
+        for pool in (s3_pool, *shard_pools.values()):
+            await pool.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
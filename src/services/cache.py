@@ -0,0 +1,202 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import time
+from collections import Counter, OrderedDict
+from contextlib import asynccontextmanager, suppress
+from pathlib import Path
+from typing import AsyncIterator
+from uuid import uuid4
+
+import aiofiles
+
+
+STALE_FILL_AGE = 86400  # seconds
+# the directory is shared by workers, each rescans it this often to
+# count and evict the entries the others filled
+RESCAN_INTERVAL = 60  # seconds
+
+
+class DiskCache:
+    """
+    Byte-budgeted LRU cache of files on local disk.
+
+    Entries are grouped in namespaces, so everything cached for a path or
+    a directory can be dropped at once. Files are filled under a temporary
+    name and renamed into place, readers never see a partial entry. The
+    LRU order is kept in memory; hits touch the file, so the order can be
+    rebuilt from modification times. Workers sharing the directory
+    rebuild it every RESCAN_INTERVAL seconds and hold the whole
+    directory to `max_size`, not only what they filled themselves. A
+    `max_size` of 0 disables the cache.
+    """
+
+    def __init__(
+            self, directory: str, max_size: int, chunk_size: int = 65536
+    ):
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.stats = Counter(hits=0, misses=0, evictions=0, fills=0)
+        self._entries: OrderedDict[Path, int] = OrderedDict()
+        self._size = 0
+        self._scanned_at: float | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def info(self) -> dict:
+        return {**self.stats, 'size': self._size, 'max_size': self.max_size}
+
+    @staticmethod
+    def _digest(value: str) -> str:
+        return hashlib.sha256(value.encode()).hexdigest()
+
+    def _namespace_dir(self, namespace: str) -> Path:
+        return self.directory / self._digest(namespace)
+
+    def _path(self, namespace: str, key: str) -> Path:
+        return self._namespace_dir(namespace) / self._digest(key)
+
+    def _scan(self) -> list[tuple[float, Path, int]]:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        found = []
+        for path in self.directory.glob('*/*'):
+            with suppress(FileNotFoundError):
+                stat = path.stat()
+                if path.parent.name != 'tmp':
+                    found.append((stat.st_mtime, path, stat.st_size))
+                elif stat.st_mtime < time.time() - STALE_FILL_AGE:
+                    # left by a crashed worker
+                    path.unlink()
+        return sorted(found)
+
+    async def _load(self) -> None:
+        now = time.monotonic()
+        if (self._scanned_at is not None
+                and now - self._scanned_at < RESCAN_INTERVAL):
+            return
+        self._scanned_at = now
+        found = await asyncio.to_thread(self._scan)
+        self._entries = OrderedDict((path, size) for _, path, size in found)
+        self._size = sum(self._entries.values())
+
+    def _add(self, path: Path, size: int) -> None:
+        self._size += size - self._entries.pop(path, 0)
+        self._entries[path] = size
+
+    def _discard(self, path: Path) -> None:
+        self._size -= self._entries.pop(path, 0)
+
+    async def _evict(self) -> None:
+        victims = []
+        while self._size > self.max_size and self._entries:
+            path, size = self._entries.popitem(last=False)
+            self._size -= size
+            victims.append(path)
+        self.stats['evictions'] += len(victims)
+        for path in victims:
+            with suppress(FileNotFoundError):
+                await asyncio.to_thread(path.unlink)
+
+    async def open(
+            self, namespace: str, key: str,
+            byte_range: tuple[int, int] | None = None
+    ) -> tuple[AsyncIterator[bytes], int] | None:
+        """
+        Return an iterator over the cached entry, or over the inclusive
+        `byte_range` of it, and the entry size. None on a miss.
+        """
+        if not self.enabled:
+            return None
+        await self._load()
+        path = self._path(namespace, key)
+        try:
+            file = await aiofiles.open(path, 'rb')
+        except FileNotFoundError:
+            # never filled, or evicted by another worker
+            self._discard(path)
+            self.stats['misses'] += 1
+            return None
+        size = (await asyncio.to_thread(os.fstat, file.fileno())).st_size
+        with suppress(FileNotFoundError):
+            await asyncio.to_thread(os.utime, path)
+        self._add(path, size)
+        self.stats['hits'] += 1
+        start, end = byte_range or (0, size - 1)
+
+        async def read() -> AsyncIterator[bytes]:
+            try:
+                await file.seek(start)
+                remaining = end - start + 1
+                while remaining > 0 and (chunk := await file.read(
+                        min(self.chunk_size, remaining))):
+                    remaining -= len(chunk)
+                    yield chunk
+            finally:
+                await file.close()
+
+        return read(), size
+
+    @asynccontextmanager
+    async def fill(self, namespace: str, key: str):
+        """
+        Write an entry; it becomes visible only if the block succeeds.
+        """
+        await self._load()
+        tmp_dir = self.directory / 'tmp'
+        await asyncio.to_thread(tmp_dir.mkdir, parents=True, exist_ok=True)
+        tmp_path = tmp_dir / uuid4().hex
+        path = self._path(namespace, key)
+        try:
+            async with aiofiles.open(tmp_path, 'wb') as file:
+                yield file
+                size = await file.tell()
+            if size <= self.max_size:
+                await asyncio.to_thread(
+                    path.parent.mkdir, parents=True, exist_ok=True
+                )
+                await asyncio.to_thread(os.replace, tmp_path, path)
+        finally:
+            with suppress(FileNotFoundError):
+                await asyncio.to_thread(tmp_path.unlink)
+        if size > self.max_size:
+            return
+        self._add(path, size)
+        self.stats['fills'] += 1
+        await self._evict()
+
+    async def write_through(
+            self, namespace: str, key: str, content: AsyncIterator[bytes]
+    ) -> AsyncIterator[bytes]:
+        """
+        Pass content through while caching it. An interrupted stream
+        leaves nothing behind.
+        """
+        if not self.enabled:
+            async for chunk in content:
+                yield chunk
+            return
+        async with self.fill(namespace, key) as file:
+            async for chunk in content:
+                await file.write(chunk)
+                yield chunk
+
+    async def invalidate(self, namespace: str) -> None:
+        """
+        Drop every entry of a namespace.
+        """
+        if not self.enabled:
+            return
+        await self._load()
+        directory = self._namespace_dir(namespace)
+        for path in [path for path in self._entries
+                     if path.parent == directory]:
+            self._discard(path)
+        await asyncio.to_thread(shutil.rmtree, directory, True)
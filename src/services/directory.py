@@ -0,0 +1,126 @@
+from collections import Counter
+from typing import Iterable
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, delete, tuple_
+from sqlalchemy.dialects.postgresql import insert
+
+from models.file import Directory, File
+from services.utils import parent_prefixes
+
+
+BATCH_SIZE = 1000
+
+
+def directory_row(account_id, path: str, count: int, size: int) -> dict:
+    parent_path, slash, name = path[:-1].rpartition('/')
+    return {
+        'account_id': account_id,
+        'path': path,
+        'parent_path': parent_path + slash,
+        'name': name,
+        'file_count': count,
+        'total_size': size,
+    }
+
+
+async def update_directories(
+        db: AsyncSession, changes: Iterable[tuple[object, str, int, int]]
+) -> None:
+    """
+    Apply (account_id, file path, count delta, size delta) CHANGES to the
+    rollups of every directory above the files, in the caller's
+    transaction. Directories left without files are removed. The root
+    has no row, its rollup is the account usage.
+
+    Rows are upserted in key order so concurrent writers of one account
+    lock its directories in the same order.
+    """
+    counts = Counter()
+    sizes = Counter()
+    for account_id, path, count, size in changes:
+        if account_id is None:
+            continue
+        account_id = str(account_id)
+        for directory in parent_prefixes(path):
+            counts[account_id, directory] += count
+            sizes[account_id, directory] += size
+    keys = sorted(key for key in counts if counts[key] or sizes[key])
+    for start in range(0, len(keys), BATCH_SIZE):
+        query = insert(Directory).values([
+            directory_row(*key, counts[key], sizes[key])
+            for key in keys[start:start + BATCH_SIZE]
+        ])
+        query = query.on_conflict_do_update(
+            index_elements=[Directory.account_id, Directory.path],
+            set_={
+                'file_count': (
+                    Directory.file_count + query.excluded.file_count
+                ),
+                'total_size': (
+                    Directory.total_size + query.excluded.total_size
+                ),
+            }
+        )
+        await db.execute(query)
+    emptied = [key for key in keys if counts[key] < 0]
+    for start in range(0, len(emptied), BATCH_SIZE):
+        await db.execute(
+            delete(Directory).
+            where(
+                tuple_(Directory.account_id, Directory.path).
+                in_(emptied[start:start + BATCH_SIZE]),
+                Directory.file_count <= 0
+            )
+        )
+
+
+async def get_directory(
+        db: AsyncSession, path: str, user_id: str) -> Directory | None:
+    statement = select(Directory).where(
+        Directory.account_id == user_id, Directory.path == path
+    )
+    result = await db.execute(statement=statement)
+    return result.scalar_one_or_none()
+
+
+async def get_children(
+        db: AsyncSession, path: str, user_id: str, limit: int = 100,
+        after: tuple[str, str] | None = None
+) -> tuple[list[Directory], list[File], Directory | File | None]:
+    """
+    Page of the subdirectories, then the files, right inside directory
+    PATH, each ordered by name and read from the parent indexes.
+
+    AFTER is the ('directories' or 'files', name) of the last entry of the
+    previous page. Returns the entries with the last one when more follow.
+    """
+    kind, name = after or ('directories', None)
+    directories = []
+    if kind == 'directories':
+        statement = select(Directory).where(
+            Directory.account_id == user_id, Directory.parent_path == path
+        )
+        if name is not None:
+            statement = statement.where(Directory.name > name)
+        result = await db.execute(
+            statement.order_by(Directory.name).limit(limit + 1)
+        )
+        directories = result.scalars().all()
+        if len(directories) > limit:
+            return directories[:limit], [], directories[limit - 1]
+        name = None
+    room = limit - len(directories)
+    statement = select(File).where(
+        File.account_id == user_id, File.parent_path == path
+    )
+    if name is not None:
+        statement = statement.where(File.name > name)
+    result = await db.execute(
+        statement.order_by(File.name).limit(room + 1)
+    )
+    files = result.scalars().all()
+    if len(files) > room:
+        files = files[:room]
+        return directories, files, (files or directories)[-1]
+    return directories, files, None
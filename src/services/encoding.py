@@ -0,0 +1,175 @@
+import zlib
+from typing import AsyncIterator, Iterable
+
+from botocore.exceptions import ClientError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, func, not_
+
+from db.db import primary_session
+from models.file import Blob, File
+from services.archive.base import ThreadedCompressor
+from services.exceptions import DownloadException, UploadException
+from services.storage import Storage
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+
+COMPRESSIBLE_MEDIA_TYPES = (
+    'text/', 'application/json', 'application/x-ndjson', 'application/xml',
+    'application/javascript', 'application/csv', 'application/x-yaml',
+    'application/yaml', 'application/sql', 'image/svg+xml',
+)
+COMPRESSIBLE_EXTENSIONS = {
+    'txt', 'log', 'csv', 'tsv', 'json', 'ndjson', 'jsonl', 'xml', 'html',
+    'htm', 'css', 'js', 'md', 'yaml', 'yml', 'sql', 'svg',
+}
+# levels for compressing responses on the fly and for stored variants
+LEVELS = {'zstd': 3, 'br': 4, 'gzip': 6}
+VARIANT_LEVELS = {'zstd': 12, 'br': 9, 'gzip': 9}
+# (blob hash, encoding) of the variants this worker is storing
+_storing: set[tuple[str, str]] = set()
+
+
+class BrotliCompressor:
+    """
+    Brotli compressor with the zlib compressobj interface.
+    """
+
+    def __init__(self, level: int):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.finish()
+
+
+def available_encodings() -> list[str]:
+    """
+    Supported content codings, most preferred first.
+    """
+    encodings = []
+    if zstandard is not None:
+        encodings.append('zstd')
+    if brotli is not None:
+        encodings.append('br')
+    encodings.append('gzip')
+    return encodings
+
+
+def compressobj(encoding: str, level: int):
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    if encoding == 'br':
+        return BrotliCompressor(level)
+    return zlib.compressobj(level, zlib.DEFLATED, 31)
+
+
+def negotiate(
+        accept_encoding: str | None, encodings: Iterable[str]
+) -> str | None:
+    """
+    Pick the content coding for an Accept-Encoding header, None means
+    identity. Ties are broken by the order of `encodings`.
+
+    >>> negotiate('gzip;q=0.5, br', ['zstd', 'br', 'gzip'])
+    'br'
+    """
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        weight = 1.0
+        name, _, value = params.strip().partition('=')
+        if name.strip() == 'q':
+            try:
+                weight = float(value)
+            except ValueError:
+                weight = 0.0
+        weights[coding.strip().lower()] = weight
+    best, best_weight = None, 0.0
+    for encoding in encodings:
+        weight = weights.get(encoding, weights.get('*', 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def is_compressible(file: File, min_size: int) -> bool:
+    """
+    Whether a file is text-like and large enough to be worth compressing.
+    """
+    if file.size < min_size:
+        return False
+    content_type = (file.content_type or '').split(';')[0].strip().lower()
+    extension = (file.extension or '').lower()
+    return (
+        content_type.startswith(COMPRESSIBLE_MEDIA_TYPES)
+        or content_type.endswith(('+json', '+xml'))
+        or extension in COMPRESSIBLE_EXTENSIONS
+    )
+
+
+async def compress_stream(
+        content: AsyncIterator[bytes], encoding: str, level: int
+) -> AsyncIterator[bytes]:
+    compressor = ThreadedCompressor(compressobj(encoding, level))
+    async for chunk in content:
+        if data := await compressor.compress(chunk):
+            yield data
+    yield await compressor.flush()
+
+
+async def get_blob_encodings(db: AsyncSession, blob_hash: str) -> list[str]:
+    statement = select(Blob.encodings).where(Blob.hash == blob_hash)
+    result = await db.execute(statement=statement)
+    return result.scalar_one_or_none() or []
+
+
+async def store_variant(
+        storage: Storage, blob_hash: str,
+        encoding: str, content_type: str | None = None
+) -> None:
+    """
+    Compress a blob into a variant stored next to it and record it, so
+    later downloads in this coding are served without compressing.
+    Runs after the response, in sessions of its own on the primary. A
+    variant stored since the download, or being stored by this worker
+    for another download, is not compressed again.
+    """
+    if (blob_hash, encoding) in _storing:
+        return
+    _storing.add((blob_hash, encoding))
+    try:
+        async with primary_session() as db:
+            if encoding in await get_blob_encodings(db, blob_hash):
+                return
+        try:
+            content = await storage.get(Blob.key_for(blob_hash))
+            await storage.put_stream(
+                Blob.variant_key_for(blob_hash, encoding),
+                compress_stream(content, encoding, VARIANT_LEVELS[encoding]),
+                content_type
+            )
+        except (UploadException, DownloadException, ClientError):
+            # the next compressed download will try again
+            return
+        async with primary_session() as db:
+            await db.execute(
+                update(Blob).
+                where(Blob.hash == blob_hash).
+                where(not_(Blob.encodings.any(encoding))).
+                values(encodings=func.array_append(Blob.encodings, encoding))
+            )
+            await db.commit()
+    finally:
+        _storing.discard((blob_hash, encoding))
@@ -6,5 +6,33 @@ class UploadException(Exception):
     pass
 
 
+class FileTooLarge(UploadException):
+    pass
+
+
 class DownloadException(Exception):
     pass
+
+
+class UnknownShard(DownloadException):
+    pass
+
+
+class MultipartException(Exception):
+    pass
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+class StorageNotSupported(Exception):
+    pass
+
+
+class SearchException(Exception):
+    pass
+
+
+class QuotaExceeded(Exception):
+    pass
@@ -1,37 +1,179 @@
+import asyncio
+
 from fastapi.encoders import jsonable_encoder
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, text, func
+from sqlalchemy import select, and_, func, tuple_, delete
+from sqlalchemy.engine import Row
 from sqlalchemy.orm import defer
 from sqlalchemy.dialects.postgresql import insert
 
+from db.db import pin_to_primary
 from models.file import File
 from schemas.file import FileCreate
+from services.archive.cache import invalidate_archives
+from services.blob import acquire_blobs, discard_blobs, release_blobs
+from services.directory import update_directories
+from services.exceptions import QuotaExceeded
+from services.rebalance import delete_objects
+from services.s3_files.cache import invalidate_objects
+from services.search_query import escape_like
+from services.storage import Storage
+from services.usage import lock_usage, update_usage
 from services.utils import is_valid_uuid
 
 
-async def add_file_db_record(db: AsyncSession, *, obj_in: FileCreate) -> File:
-    obj_in_data = jsonable_encoder(obj_in)
-    obj_in_data[File.created_at.key] = func.now()  # onupdate doesn't work. https://github.com/sqlalchemy/sqlalchemy/discussions/5903#discussioncomment-327672
-    query = insert(File).values(**obj_in_data).on_conflict_do_update(
-        constraint=File.path_uniq_constraint, set_=obj_in_data
-    ).returning(File)
-    result = await db.execute(query)
-    db_obj = result.one()
+BATCH_INSERT_SIZE = 1000
+
+
+def replaced_objects(
+        previous: list[Row], objs_in_data: dict[tuple[str, str], dict]
+) -> dict[str | None, list[str]]:
+    """
+    Keys by shard of the objects of PREVIOUS files rows that had their
+    own key, which the rows replacing them no longer refer to.
+    """
+    keys = {}
+    for account_id, path, _, shard, _, object_key in previous:
+        row = objs_in_data[(str(account_id), path)]
+        if object_key and object_key != row['object_key']:
+            keys.setdefault(shard, []).append(object_key)
+    return keys
+
+
+async def add_file_db_records(
+        db: AsyncSession, *, objs_in: list[FileCreate], storage: Storage
+) -> list[File]:
+    """
+    Upsert many files rows in one transaction, keyed by account and
+    path.
+
+    Rows are sent as multi-row INSERT ... ON CONFLICT statements of
+    BATCH_INSERT_SIZE rows to stay under the bind parameter limit of
+    asyncpg. When a batch repeats a path, the last object wins. Rows of
+    blobs that are already stored get the shard of the stored copy.
+    Account usage and directory rollups are updated in the same
+    transaction; QuotaExceeded is raised, with nothing written, when an
+    account would go over its quota, and the blobs uploaded for the rows
+    are discarded. Reads of the accounts are pinned to the primary
+    afterwards, and objects of replaced rows that had their own key are
+    deleted from STORAGE.
+    """
+    objs_in_data = {}
+    for obj_in in objs_in:
+        obj_in_data = jsonable_encoder(obj_in)
+        obj_in_data[File.created_at.key] = func.now()  # onupdate doesn't work. https://github.com/sqlalchemy/sqlalchemy/discussions/5903#discussioncomment-327672
+        key = (str(obj_in_data['account_id']), obj_in_data['path'])
+        objs_in_data[key] = obj_in_data
+    rows = list(objs_in_data.values())
+    if not rows:
+        return []
+
+    # first, the usage rows serialize writers of an account, so the
+    # rows replaced are read after the writes before are committed
+    await lock_usage(db, (row['account_id'] for row in rows))
+    previous = await db.execute(
+        select(
+            File.account_id, File.path, File.blob_hash, File.shard,
+            File.size, File.object_key
+        ).
+        where(tuple_(File.account_id, File.path).in_(list(objs_in_data)))
+    )
+    previous_hashes = {}
+    previous_shards = {}
+    previous_keys = []
+    changes = []
+    previous = previous.all()
+    for account_id, path, blob_hash, shard, size, object_key in previous:
+        key = (str(account_id), path)
+        previous_hashes[key] = blob_hash
+        previous_shards[key] = shard
+        if object_key:
+            previous_keys.append(object_key)
+        changes.append((account_id, path, -1, -size))
+    changes += [
+        (row['account_id'], row['path'], 1, row['size']) for row in rows
+    ]
+    if not await update_usage(db, changes):
+        await db.rollback()
+        await discard_blobs(db, storage, [
+            (row['blob_hash'], row['shard']) for row in rows
+            if row['blob_hash']
+        ])
+        raise QuotaExceeded
+    replaced = [
+        key for key, row in objs_in_data.items()
+        if row['blob_hash'] != previous_hashes.get(key)
+    ]
+    shards = await acquire_blobs(db, [
+        (row['blob_hash'], row['size'], row['shard'])
+        for row in map(objs_in_data.get, replaced) if row['blob_hash']
+    ])
+    # content already stored is read from where it is, not where this
+    # upload would have put it
+    for key, row in objs_in_data.items():
+        if row['blob_hash'] in shards:
+            row['shard'] = shards[row['blob_hash']]
+        elif row['blob_hash']:
+            row['shard'] = previous_shards[key]
+    db_objs = []
+    for start in range(0, len(rows), BATCH_INSERT_SIZE):
+        query = insert(File).values(rows[start:start + BATCH_INSERT_SIZE])
+        query = query.on_conflict_do_update(
+            index_elements=[File.account_id, File.path],
+            set_={key: query.excluded[key] for key in rows[0]}
+        ).returning(File)
+        result = await db.execute(query)
+        db_objs.extend(result.all())
+    await release_blobs(db, [previous_hashes.get(key) for key in replaced])
+    await update_directories(db, changes)
     await db.commit()
-    return db_obj
+    pin_to_primary({row['account_id'] for row in rows})
+    await invalidate_archives(
+        (row['account_id'], row['path']) for row in rows
+    )
+    await invalidate_objects(previous_keys)
+    await asyncio.gather(*[
+        delete_objects(storage, keys, shard)
+        for shard, keys in replaced_objects(previous, objs_in_data).items()
+    ])
+    return db_objs
+
+
+async def add_file_db_record(
+        db: AsyncSession, *, obj_in: FileCreate, storage: Storage
+) -> File:
+    db_objs = await add_file_db_records(
+        db=db, objs_in=[obj_in], storage=storage
+    )
+    return db_objs[0]
 
 
 async def get_all_files(
-        db: AsyncSession, *, user_id: str, skip=0, limit=100
+        db: AsyncSession, *, user_id: str, skip=0, limit=100,
+        order_by: str = 'created_at', after: tuple | None = None
 ) -> list[File]:
+    """
+    Page of an account's files ordered by (created_at, id) or by path.
+
+    AFTER is the sort key of the last file of the previous page; pages
+    are then read straight from the account index instead of skipping
+    rows.
+    """
+    if order_by == 'path':
+        sort_key = (File.path,)
+    else:
+        sort_key = (File.created_at, File.id)
     statement = (
         select(File).
         where(File.account_id == user_id).
         options(defer(File.account_id)).
-        offset(skip).
-        limit(limit)
+        order_by(*sort_key)
     )
-    results = await db.execute(statement=statement)
+    if after:
+        statement = statement.where(tuple_(*sort_key) > tuple_(*after))
+    elif skip:
+        statement = statement.offset(skip)
+    results = await db.execute(statement=statement.limit(limit))
     return results.scalars().all()
 
 
@@ -57,51 +199,60 @@ async def get_all_by_path(
         db: AsyncSession, path: str, user_id=str) -> list[File]:
     statement = (
         select(File).
-        where(and_(File.path.like(f'{path}%'), File.account_id == user_id))
+        where(and_(
+            File.path.like(f'{escape_like(path)}%'),
+            File.account_id == user_id
+        ))
     )
     result = await db.execute(statement=statement)
     return list(result.scalars())
 
 
-async def search_files_in_db(
-        db: AsyncSession, user_id: str, path: str, extension: str, query: str,
-        is_regex: bool, order_by: str, limit: int = 100
-) -> list[File]:
-    clause = []
-    params = {}
-
-    if path:
-        clause.append(File.path.like(f'{path}%'))
-    if extension:
-        clause.append(File.extension.like(f'%{extension}%'))
-    if query:
-        if is_regex:
-            clause.append(text(
-                ' OR '.join(
-                    [f"{column}::text ~ :x"
-                     for column in File.__table__.columns.keys()]
-                )
-            ))
-            params['x'] = f'{query}'
-
-        else:
-            clause.append(text(
-                ' OR '.join(
-                    [f"{column}::text ilike :x"
-                     for column in File.__table__.columns.keys()]
-                )
-            ))
-            params['x'] = f'%{query}%'
-    clause.append(File.account_id == user_id)
+async def delete_files(
+        db: AsyncSession, path: str, user_id: str) -> list[Row]:
+    """
+    Delete a file of an account, or every file under PATH when it ends
+    with '/', releasing their blobs and updating usage and directory
+    rollups.
 
-    statement = (
-        select(File).
-        where(and_(*clause)).
-        order_by(order_by).
-        limit(limit)
+    Returns (account_id, path, size, blob_hash, shard, object_key) of
+    the deleted files; objects not stored as blobs are left to the
+    caller.
+    """
+    if path.endswith('/'):
+        condition = File.path.like(f'{escape_like(path)}%')
+    else:
+        condition = File.path == path
+    # the usage row first, in the lock order of add_file_db_records
+    await lock_usage(db, [user_id])
+    result = await db.execute(
+        delete(File).
+        where(condition, File.account_id == user_id).
+        returning(
+            File.account_id, File.path, File.size, File.blob_hash,
+            File.shard, File.object_key
+        ).
+        execution_options(synchronize_session=False)
     )
-    results = await db.execute(statement=statement, params=params)
-    return results.scalars().all()
+    deleted = result.all()
+    if not deleted:
+        await db.rollback()
+        return []
+    await release_blobs(db, [file.blob_hash for file in deleted])
+    changes = [
+        (file.account_id, file.path, -1, -file.size) for file in deleted
+    ]
+    await update_usage(db, changes)
+    await update_directories(db, changes)
+    await db.commit()
+    pin_to_primary({file.account_id for file in deleted})
+    await invalidate_archives(
+        (file.account_id, file.path) for file in deleted
+    )
+    await invalidate_objects(
+        file.object_key for file in deleted if file.object_key
+    )
+    return deleted
 
 
 async def get_file_obj(db: AsyncSession, path: str, user_id=str):
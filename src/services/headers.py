@@ -0,0 +1,137 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Iterable, Mapping
+
+from models.file import File
+from services.exceptions import RangeNotSatisfiable
+
+
+MAX_RANGES = 16
+
+
+def parse_range_spec(spec: str, size: int) -> tuple[int, int] | None:
+    """
+    Parse one byte range spec, 'start-end', 'start-' or '-suffix', into
+    an inclusive (start, end) range clipped to SIZE. None means it does
+    not overlap the content; malformed specs raise ValueError.
+    """
+    start, dash, end = spec.strip().partition('-')
+    if not dash or not (start or end):
+        raise ValueError(spec)
+    if start:
+        first = int(start)
+        last = int(end) if end else size - 1
+        if first > last:
+            raise ValueError(spec)
+    else:
+        first, last = size - int(end), size - 1
+    first, last = max(first, 0), min(last, size - 1)
+    return (first, last) if first <= last else None
+
+
+def parse_range(header: str | None, size: int) -> list[tuple[int, int]] | None:
+    """
+    Parse a Range header into sorted inclusive (start, end) byte ranges.
+
+    None means the header is absent or should be ignored and the whole
+    content is sent: unknown units, malformed specs or more than
+    MAX_RANGES ranges. Overlapping and adjacent ranges are merged.
+    Raises RangeNotSatisfiable when no range overlaps the content.
+    """
+    if not header:
+        return None
+    unit, _, specs = header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+    try:
+        ranges = [parse_range_spec(spec, size) for spec in specs.split(',')]
+    except ValueError:
+        return None
+    ranges = [byte_range for byte_range in ranges if byte_range]
+    if len(ranges) > MAX_RANGES:
+        return None
+    if not ranges:
+        raise RangeNotSatisfiable
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def http_date(value: datetime) -> str:
+    # created_at is stored as naive UTC
+    return format_datetime(value.replace(tzinfo=timezone.utc), usegmt=True)
+
+
+def file_etag(file: File, encoding: str | None = None) -> str:
+    """
+    Strong ETag for content-addressed files, weak one for the rest.
+    Each content coding of a file gets its own tag.
+    """
+    suffix = f'-{encoding}' if encoding else ''
+    if file.blob_hash:
+        return f'"{file.blob_hash}{suffix}"'
+    digest = hashlib.md5(
+        f'{file.id}:{file.size}:{file.created_at.isoformat()}'.encode()
+    )
+    return f'W/"{digest.hexdigest()}{suffix}"'
+
+
+def listing_etag(files: Iterable[File], *parts: object) -> str:
+    digest = hashlib.md5(':'.join(map(str, parts)).encode())
+    for file in files:
+        digest.update(
+            f'|{file.id}:{file.path}:{file.size}:'
+            f'{file.created_at.isoformat()}'.encode()
+        )
+    return f'W/"{digest.hexdigest()}"'
+
+
+def _opaque(etag: str) -> str:
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+def is_not_modified(
+        headers: Mapping[str, str], etag: str,
+        last_modified: datetime | None = None
+) -> bool:
+    """
+    Evaluate If-None-Match, or If-Modified-Since when it is absent.
+    """
+    if_none_match = headers.get('if-none-match')
+    if if_none_match is not None:
+        if if_none_match.strip() == '*':
+            return True
+        return _opaque(etag) in {
+            _opaque(tag.strip()) for tag in if_none_match.split(',')
+        }
+    if_modified_since = headers.get('if-modified-since')
+    if if_modified_since and last_modified:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        modified = last_modified.replace(tzinfo=timezone.utc, microsecond=0)
+        return modified <= since
+    return False
+
+
+def if_range_matches(
+        value: str | None, etag: str, last_modified: datetime) -> bool:
+    """
+    Check If-Range; ranges are only served for an unchanged
+    representation, and weak ETags never match.
+    """
+    if value is None:
+        return True
+    value = value.strip()
+    if value.startswith(('"', 'W/')):
+        return not etag.startswith('W/') and value == etag
+    return value == http_date(last_modified)
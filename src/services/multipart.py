@@ -0,0 +1,128 @@
+from collections import deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Mapping
+
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import MultipartParser, parse_options_header
+
+from services.exceptions import MultipartException
+
+
+PART_BEGIN = 'part_begin'
+PART_DATA = 'part_data'
+PART_END = 'part_end'
+
+
+@dataclass
+class FormPart:
+    name: str
+    filename: str | None
+    content_type: str | None
+    _reader: 'MultipartReader' = field(repr=False)
+    _consumed: bool = field(default=False, repr=False)
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        if self._consumed:
+            return
+        self._consumed = True
+        async for kind, payload in self._reader.events:
+            if kind == PART_END:
+                return
+            if kind == PART_DATA and payload:
+                yield payload
+
+    async def read_text(self, max_size: int = 4096) -> str:
+        data = bytearray()
+        async for chunk in self:
+            data.extend(chunk)
+            if len(data) > max_size:
+                raise MultipartException
+        return data.decode(self._reader.charset)
+
+
+class MultipartReader:
+    """
+    Incremental multipart/form-data reader.
+
+    Body chunks are fed to the parser as they arrive from the client, so
+    only the current chunk is held in memory. Iterating the reader yields
+    parts in order; the data of each part must be consumed before moving
+    to the next one, otherwise it is skipped.
+    """
+
+    def __init__(
+            self, headers: Mapping[str, str], stream: AsyncIterator[bytes]
+    ):
+        content_type, params = parse_options_header(
+            headers.get('content-type', '')
+        )
+        if content_type != b'multipart/form-data' or b'boundary' not in params:
+            raise MultipartException
+        self.charset = params.get(b'charset', b'utf-8').decode()
+        self._stream = stream
+        self._messages = deque()
+        self._headers = {}
+        self._header_field = b''
+        self._header_value = b''
+        self._parser = MultipartParser(params[b'boundary'], {
+            'on_part_begin': self._on_part_begin,
+            'on_part_data': self._on_part_data,
+            'on_part_end': self._on_part_end,
+            'on_header_field': self._on_header_field,
+            'on_header_value': self._on_header_value,
+            'on_header_end': self._on_header_end,
+            'on_headers_finished': self._on_headers_finished,
+        })
+        self.events = self._iter_events()
+
+    async def __aiter__(self) -> AsyncIterator[FormPart]:
+        async for kind, payload in self.events:
+            if kind == PART_BEGIN:
+                yield payload
+
+    async def _iter_events(self) -> AsyncIterator[tuple[str, object]]:
+        try:
+            async for chunk in self._stream:
+                self._parser.write(chunk)
+                while self._messages:
+                    yield self._messages.popleft()
+            self._parser.finalize()
+        except MultipartParseError:
+            raise MultipartException
+        while self._messages:
+            yield self._messages.popleft()
+
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        self._messages.append((PART_DATA, data[start:end]))
+
+    def _on_part_end(self) -> None:
+        self._messages.append((PART_END, None))
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b''
+        self._header_value = b''
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(
+            self._headers.get(b'content-disposition', b'')
+        )
+        if b'name' not in options:
+            raise MultipartException
+        filename = options.get(b'filename')
+        content_type = self._headers.get(b'content-type')
+        self._messages.append((PART_BEGIN, FormPart(
+            name=options[b'name'].decode(self.charset),
+            filename=filename.decode(self.charset) if filename else None,
+            content_type=content_type.decode() if content_type else None,
+            _reader=self,
+        )))
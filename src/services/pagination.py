@@ -0,0 +1,68 @@
+import base64
+import json
+from datetime import datetime
+from uuid import UUID
+
+from models.file import Directory, File
+
+
+def encode_cursor(order_by: str, file: File) -> str:
+    """
+    Opaque cursor pointing after FILE in a listing ordered by ORDER_BY.
+    """
+    if order_by == 'path':
+        key = [file.path]
+    else:
+        key = [file.created_at.isoformat(), str(file.id)]
+    data = json.dumps([order_by, *key], separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(order_by: str, cursor: str) -> tuple:
+    """
+    Sort key a cursor points after, ValueError when it is malformed or
+    from a listing in another order.
+    """
+    try:
+        data = json.loads(
+            base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        )
+        cursor_order, *key = data
+        if cursor_order != order_by:
+            raise ValueError('Cursor is from another order')
+        if not all(isinstance(value, str) for value in key):
+            raise ValueError('Cursor key is not a string')
+        if order_by == 'path':
+            path, = key
+            return (path,)
+        created_at, pk = key
+        return datetime.fromisoformat(created_at), UUID(pk)
+    except (TypeError, ValueError, AttributeError) as error:
+        raise ValueError('Invalid cursor') from error
+
+
+def encode_child_cursor(entry: Directory | File) -> str:
+    """
+    Opaque cursor pointing after ENTRY in a directory listing.
+    """
+    kind = 'directories' if isinstance(entry, Directory) else 'files'
+    data = json.dumps([kind, entry.name], separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_child_cursor(cursor: str) -> tuple[str, str]:
+    """
+    (kind, name) of the entry a directory listing cursor points after,
+    ValueError when it is malformed.
+    """
+    try:
+        kind, name = json.loads(
+            base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        )
+        if kind not in ('directories', 'files'):
+            raise ValueError('Unknown cursor kind')
+        if not isinstance(name, str):
+            raise ValueError('Cursor name is not a string')
+        return kind, name
+    except (TypeError, ValueError, AttributeError) as error:
+        raise ValueError('Invalid cursor') from error
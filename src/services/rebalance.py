@@ -0,0 +1,176 @@
+"""
+Move objects to the shard the hash ring puts them on, after s3_shards
+changed. Runs next to the application, which keeps serving every object
+from the shard recorded for it:
+
+    python -m services.rebalance
+"""
+import asyncio
+import logging
+from collections import Counter
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, tuple_
+
+from core.config import app_settings
+from core.s3 import s3_pool, shard_pools
+from core.storage import get_storage
+from db.db import async_session
+from models.file import Blob, File
+from services.storage import Storage
+from services.storage.sharded import transfer
+
+
+logger = logging.getLogger(__name__)
+BATCH_SIZE = 100
+
+
+async def move_objects(
+        storage: Storage, keys: list[str], source: str | None,
+        target: str | None
+) -> bool:
+    """
+    Copy KEYS from shard SOURCE to shard TARGET, False when one failed.
+    """
+    try:
+        for key in keys:
+            await transfer(storage.on(source), storage.on(target), key)
+    except Exception as error:
+        logger.warning('Cannot move %s to %s: %r', keys[0], target, error)
+        return False
+    return True
+
+
+async def delete_objects(
+        storage: Storage, keys: list[str], shard: str | None) -> None:
+    for key in keys:
+        try:
+            await storage.on(shard).delete(key)
+        except Exception as error:
+            logger.warning('Cannot delete %s on %s: %r', key, shard, error)
+
+
+async def rebalance_blobs(
+        db: AsyncSession, storage: Storage, counts: Counter) -> None:
+    semaphore = asyncio.Semaphore(app_settings.rebalance_concurrency)
+
+    async def limited(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    last_hash = ''
+    while True:
+        result = await db.execute(
+            select(Blob.hash, Blob.shard, Blob.encodings).
+            where(Blob.hash > last_hash).
+            order_by(Blob.hash).
+            limit(BATCH_SIZE)
+        )
+        rows = result.all()
+        if not rows:
+            return
+        last_hash = rows[-1].hash
+        moves = []
+        for blob_hash, shard, encodings in rows:
+            target = storage.shard_for(Blob.key_for(blob_hash))
+            if target != shard:
+                keys = [Blob.key_for(blob_hash)] + [
+                    Blob.variant_key_for(blob_hash, encoding)
+                    for encoding in encodings
+                ]
+                moves.append((blob_hash, keys, shard, target))
+        moved = await asyncio.gather(*[
+            limited(move_objects(storage, keys, shard, target))
+            for _, keys, shard, target in moves
+        ])
+        for (blob_hash, _, shard, target), ok in zip(moves, moved):
+            if not ok:
+                counts['failed'] += 1
+                continue
+            # the blob row first: uploads racing with the move lock it and
+            # then read the new shard
+            await db.execute(
+                update(Blob).
+                where(Blob.hash == blob_hash).
+                values(shard=target)
+            )
+            await db.execute(
+                update(File).
+                where(File.blob_hash == blob_hash).
+                values(shard=target)
+            )
+            counts['moved'] += 1
+        await db.commit()
+        for (_, keys, shard, _), ok in zip(moves, moved):
+            if ok:
+                await delete_objects(storage, keys, shard)
+
+
+async def rebalance_files(
+        db: AsyncSession, storage: Storage, counts: Counter) -> None:
+    """
+    Move objects owned by a single file, not stored as blobs.
+    """
+    last = (None, '')
+    while True:
+        statement = (
+            select(File.account_id, File.path, File.object_key, File.shard).
+            where(File.blob_hash.is_(None)).
+            order_by(File.account_id, File.path).
+            limit(BATCH_SIZE)
+        )
+        if last[0] is not None:
+            statement = statement.where(
+                tuple_(File.account_id, File.path) > tuple_(*last)
+            )
+        rows = (await db.execute(statement)).all()
+        if not rows:
+            return
+        last = rows[-1].account_id, rows[-1].path
+        for account_id, path, key, shard in rows:
+            target = storage.shard_for(key)
+            if target == shard:
+                continue
+            if not await move_objects(storage, [key], shard, target):
+                counts['failed'] += 1
+                continue
+            await db.execute(
+                update(File).
+                where(File.account_id == account_id, File.path == path).
+                values(shard=target)
+            )
+            await db.commit()
+            await delete_objects(storage, [key], shard)
+            counts['moved'] += 1
+
+
+async def rebalance(db: AsyncSession, storage: Storage) -> Counter:
+    """
+    Move every object whose recorded shard is not its ring shard.
+
+    Rows are switched to the new shard once the copy is complete and the
+    old copy is deleted only after that, so lookups never miss. Returns
+    counts of moved and failed objects.
+    """
+    counts = Counter()
+    await rebalance_blobs(db, storage, counts)
+    await rebalance_files(db, storage, counts)
+    return counts
+
+
+async def main() -> None:
+    try:
+        storage = await get_storage()
+        async with async_session() as db:
+            counts = await rebalance(db, storage)
+        logger.info(
+            'Rebalanced: %d moved, %d failed',
+            counts['moved'], counts['failed']
+        )
+    finally:
+        for pool in (s3_pool, *shard_pools.values()):
+            await pool.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,20 @@
+import os
+from typing import Iterable
+
+from core.config import app_settings
+from services.cache import DiskCache
+
+
+object_cache = DiskCache(
+    os.path.join(app_settings.cache_dir, 'objects'),
+    app_settings.object_cache_size,
+    chunk_size=1048576
+)
+
+
+async def invalidate_objects(keys: Iterable[str]) -> None:
+    """
+    Drop cached copies of overwritten objects, by storage key.
+    """
+    for key in set(keys):
+        await object_cache.invalidate(key)
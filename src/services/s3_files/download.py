@@ -1,15 +1,69 @@
+import asyncio
+from functools import partial
+
 from aiobotocore.session import AioBaseClient
+from botocore.exceptions import BotoCoreError, ClientError
 
 from core.config import app_settings
 from services.exceptions import DownloadException
+from services.s3_files.policy import read_policy
+
+
+READ_ERRORS = (ClientError, BotoCoreError, asyncio.TimeoutError, OSError)
 
 
-async def download_content(client: AioBaseClient, file_path: str):
+async def download_content(
+        client: AioBaseClient, bucket: str, file_path: str,
+        byte_range: tuple[int, int] | None = None
+):
     # get object from s3
-    response = await client.get_object(
-        Bucket=app_settings.s3_bucket, Key=file_path
-    )
-    if response['ResponseMetadata']['HTTPStatusCode'] != 200:
+    params = {}
+    if byte_range:
+        params['Range'] = 'bytes={}-{}'.format(*byte_range)
+    try:
+        response = await read_policy.call(
+            'get_object',
+            partial(client.get_object, Bucket=bucket, Key=file_path, **params),
+            discard=lambda response: response['Body'].close()
+        )
+    except READ_ERRORS as error:
+        raise DownloadException from error
+    if response['ResponseMetadata']['HTTPStatusCode'] not in (200, 206):
         raise DownloadException
 
     return response['Body'].iter_chunks()
+
+
+async def get_content_info(
+        client: AioBaseClient, bucket: str, file_path: str) -> dict:
+    try:
+        response = await read_policy.call(
+            'head_object',
+            partial(client.head_object, Bucket=bucket, Key=file_path)
+        )
+    except READ_ERRORS as error:
+        raise DownloadException from error
+    return {
+        'size': response['ContentLength'],
+        'etag': response['ETag'],
+        'content_type': response.get('ContentType'),
+        'last_modified': response['LastModified'],
+    }
+
+
+async def presign_download(
+        client: AioBaseClient, bucket: str, file_path: str,
+        content_type: str | None, content_disposition: str
+) -> str:
+    params = {
+        'Bucket': bucket,
+        'Key': file_path,
+        'ResponseContentDisposition': content_disposition,
+    }
+    if content_type:
+        params['ResponseContentType'] = content_type
+    return await client.generate_presigned_url(
+        'get_object',
+        Params=params,
+        ExpiresIn=app_settings.presigned_download_lifetime
+    )
@@ -0,0 +1,186 @@
+import asyncio
+import random
+import time
+from collections import Counter, defaultdict, deque
+from functools import partial
+from typing import Any, Awaitable, Callable
+
+from aiohttp import ClientError as HTTPClientError
+from botocore.exceptions import BotoCoreError, ClientError
+
+from core.config import app_settings
+
+
+# S3 error codes worth another attempt, besides any 5xx
+RETRYABLE_CODES = {
+    'InternalError', 'RequestTimeout', 'ServiceUnavailable', 'SlowDown',
+    'Throttling', 'ThrottlingException',
+}
+STAT_KEYS = ('calls', 'retries', 'timeouts', 'hedges', 'hedge_wins', 'errors')
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, ClientError):
+        response = error.response
+        status = response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+        return (
+            (status or 0) >= 500
+            or response.get('Error', {}).get('Code') in RETRYABLE_CODES
+        )
+    return isinstance(
+        error,
+        (asyncio.TimeoutError, BotoCoreError, HTTPClientError, OSError)
+    )
+
+
+class LatencyWindow:
+    """
+    Latencies of the last SIZE calls, with percentiles recomputed every
+    REFRESH samples so lookups stay cheap.
+    """
+
+    min_samples = 20
+    refresh = 50
+
+    def __init__(self, size: int = 1000):
+        self._samples = deque(maxlen=size)
+        self._sorted = []
+        self._added = 0
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+        self._added += 1
+        if (self._added % self.refresh == 0
+                or len(self._samples) <= self.min_samples):
+            self._sorted = sorted(self._samples)
+
+    def percentile(self, percent: float) -> float | None:
+        if len(self._sorted) < self.min_samples:
+            return None
+        index = int(len(self._sorted) * percent / 100)
+        return self._sorted[min(index, len(self._sorted) - 1)]
+
+
+def discard_result(discard: Callable[[Any], Any], task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is None:
+        discard(task.result())
+
+
+class ReadPolicy:
+    """
+    Timeouts, retries and hedging for S3 read calls.
+
+    Each attempt has to return (for GET, to get the response headers)
+    within `attempt_timeout`. Failed attempts are retried after a
+    jittered exponential backoff when the error is transient. Within an
+    attempt, when the call is still pending after the `hedge_percentile`
+    latency of recent calls of the operation, a duplicate is started and
+    whichever answers first wins. The loser is cancelled, or its
+    response is passed to `discard` to release the connection.
+    """
+
+    def __init__(
+            self, attempts: int, attempt_timeout: float, base_delay: float,
+            max_delay: float, hedge_percentile: float,
+            hedge_min_delay: float
+    ):
+        self.attempts = attempts
+        self.attempt_timeout = attempt_timeout
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.stats = defaultdict(Counter)
+        self.latency = defaultdict(LatencyWindow)
+
+    def hedge_delay(self, operation: str) -> float | None:
+        if not self.hedge_percentile:
+            return None
+        delay = self.latency[operation].percentile(self.hedge_percentile)
+        if delay is None:
+            return None
+        return max(delay, self.hedge_min_delay)
+
+    async def _attempt(
+            self, operation: str, call: Callable[[], Awaitable],
+            discard: Callable[[Any], Any] | None
+    ) -> Any:
+        started = time.monotonic()
+        primary = asyncio.create_task(call())
+        pending = {primary}
+        try:
+            delay = self.hedge_delay(operation)
+            if delay is not None:
+                done, _ = await asyncio.wait(pending, timeout=delay)
+                if not done:
+                    self.stats[operation]['hedges'] += 1
+                    pending.add(asyncio.create_task(call()))
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                winners = [task for task in done if not task.exception()]
+                if not winners:
+                    error = next(iter(done)).exception()
+                    continue
+                winner = primary if primary in winners else winners[0]
+                if winner is not primary:
+                    self.stats[operation]['hedge_wins'] += 1
+                for task in winners:
+                    if task is not winner and discard:
+                        discard(task.result())
+                self.latency[operation].add(time.monotonic() - started)
+                return winner.result()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+                if discard:
+                    task.add_done_callback(partial(discard_result, discard))
+
+    async def call(
+            self, operation: str, call: Callable[[], Awaitable],
+            discard: Callable[[Any], Any] | None = None
+    ) -> Any:
+        """
+        Run CALL, a read without side effects, under the policy.
+        """
+        stats = self.stats[operation]
+        stats['calls'] += 1
+        for attempt in range(self.attempts):
+            try:
+                return await asyncio.wait_for(
+                    self._attempt(operation, call, discard),
+                    self.attempt_timeout
+                )
+            except Exception as error:
+                if isinstance(error, asyncio.TimeoutError):
+                    stats['timeouts'] += 1
+                if attempt + 1 == self.attempts or not is_retryable(error):
+                    stats['errors'] += 1
+                    raise
+                stats['retries'] += 1
+                await asyncio.sleep(random.uniform(
+                    0, min(self.max_delay, self.base_delay * 2 ** attempt)
+                ))
+
+    def info(self) -> dict[str, dict]:
+        return {
+            operation: {
+                **{key: stats[key] for key in STAT_KEYS},
+                'p50': self.latency[operation].percentile(50),
+                'p99': self.latency[operation].percentile(99),
+                'hedge_delay': self.hedge_delay(operation),
+            } for operation, stats in self.stats.items()
+        }
+
+
+read_policy = ReadPolicy(
+    attempts=app_settings.s3_read_attempts,
+    attempt_timeout=app_settings.s3_attempt_timeout,
+    base_delay=app_settings.s3_retry_base_delay,
+    max_delay=app_settings.s3_retry_max_delay,
+    hedge_percentile=app_settings.s3_hedge_percentile,
+    hedge_min_delay=app_settings.s3_hedge_min_delay
+)
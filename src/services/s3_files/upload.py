@@ -1,14 +1,352 @@
-from typing import BinaryIO
+import asyncio
+import hashlib
+from contextlib import suppress
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable
+from uuid import uuid4
 from aiobotocore.session import AioBaseClient
 
 from core.config import app_settings
-from services.exceptions import UploadException
+from models.file import Blob
+from services.exceptions import FileTooLarge, UploadException
+
+
+S3_MAX_COPY_SIZE = 5368709120  # 5 GB, limit of a single CopyObject
+S3_MAX_PARTS = 10000
+# keys written by the service itself, never accepted as a user path
+RESERVED_PREFIXES = ('blobs/', 'uploads/')
+
+
+def is_reserved_key(file_path: str) -> bool:
+    return file_path.startswith(RESERVED_PREFIXES)
 
 
 async def upload_content(
-        client: AioBaseClient, content: BinaryIO, file_path: str) -> None:
+        client: AioBaseClient, bucket: str, content: BinaryIO, file_path: str
+) -> None:
     response = await client.put_object(
-        Bucket=app_settings.s3_bucket, Key=file_path, Body=content
+        Bucket=bucket, Key=file_path, Body=content
     )
     if response['ResponseMetadata']['HTTPStatusCode'] != 200:
         raise UploadException
+
+
+async def presign_upload(
+        client: AioBaseClient, bucket: str, file_path: str, content_type: str
+) -> str:
+    return await client.generate_presigned_url(
+        'put_object',
+        Params={
+            'Bucket': bucket, 'Key': file_path,
+            'ContentType': content_type
+        },
+        ExpiresIn=app_settings.presigned_url_lifetime
+    )
+
+
+class MultipartUpload:
+    """
+    Thin wrapper over the S3 multipart upload calls for a single object.
+    """
+
+    def __init__(
+            self, client: AioBaseClient, bucket: str, file_path: str,
+            upload_id: str | None = None
+    ):
+        self._client = client
+        self.bucket = bucket
+        self.file_path = file_path
+        self.upload_id = upload_id
+
+    async def create(self, content_type: str | None = None) -> str:
+        params = {}
+        if content_type:
+            params['ContentType'] = content_type
+        response = await self._client.create_multipart_upload(
+            Bucket=self.bucket, Key=self.file_path, **params
+        )
+        if response['ResponseMetadata']['HTTPStatusCode'] != 200:
+            raise UploadException
+        self.upload_id = response['UploadId']
+        return self.upload_id
+
+    async def upload_part(self, number: int, body: bytes) -> str:
+        response = await self._client.upload_part(
+            Bucket=self.bucket, Key=self.file_path,
+            UploadId=self.upload_id, PartNumber=number, Body=body
+        )
+        if response['ResponseMetadata']['HTTPStatusCode'] != 200:
+            raise UploadException
+        return response['ETag']
+
+    async def presign_part(self, number: int) -> str:
+        return await self._client.generate_presigned_url(
+            'upload_part',
+            Params={
+                'Bucket': self.bucket, 'Key': self.file_path,
+                'UploadId': self.upload_id, 'PartNumber': number
+            },
+            ExpiresIn=app_settings.presigned_url_lifetime
+        )
+
+    async def copy_part(
+            self, number: int, source_key: str, start: int, end: int
+    ) -> str:
+        response = await self._client.upload_part_copy(
+            Bucket=self.bucket, Key=self.file_path,
+            UploadId=self.upload_id, PartNumber=number,
+            CopySource={'Bucket': self.bucket, 'Key': source_key},
+            CopySourceRange=f'bytes={start}-{end}'
+        )
+        if response['ResponseMetadata']['HTTPStatusCode'] != 200:
+            raise UploadException
+        return response['CopyPartResult']['ETag']
+
+    async def complete(self, parts: dict[int, str]) -> str:
+        response = await self._client.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.file_path,
+            UploadId=self.upload_id,
+            MultipartUpload={'Parts': [
+                {'PartNumber': number, 'ETag': parts[number]}
+                for number in sorted(parts)
+            ]}
+        )
+        if response['ResponseMetadata']['HTTPStatusCode'] != 200:
+            raise UploadException
+        return response['ETag']
+
+    async def abort(self) -> None:
+        await self._client.abort_multipart_upload(
+            Bucket=self.bucket, Key=self.file_path,
+            UploadId=self.upload_id
+        )
+
+
+async def copy_object(
+        client: AioBaseClient, bucket: str, source_key: str, target_key: str,
+        size: int
+) -> None:
+    source = {'Bucket': bucket, 'Key': source_key}
+    if size <= S3_MAX_COPY_SIZE:
+        response = await client.copy_object(
+            Bucket=bucket, Key=target_key, CopySource=source
+        )
+        if response['ResponseMetadata']['HTTPStatusCode'] != 200:
+            raise UploadException
+        return
+
+    upload = MultipartUpload(client, bucket, target_key)
+    await upload.create()
+    try:
+        parts = {}
+        for number, start in enumerate(range(0, size, S3_MAX_COPY_SIZE), 1):
+            end = min(start + S3_MAX_COPY_SIZE, size) - 1
+            parts[number] = await upload.copy_part(
+                number, source_key, start, end
+            )
+        await upload.complete(parts)
+    except Exception as error:
+        with suppress(Exception):
+            await upload.abort()
+        raise UploadException from error
+
+
+async def put_bytes(
+        client: AioBaseClient, bucket: str, key: str, body: bytes,
+        content_type: str | None = None
+) -> None:
+    params = {'ContentType': content_type} if content_type else {}
+    response = await client.put_object(
+        Bucket=bucket, Key=key, Body=body, **params
+    )
+    if response['ResponseMetadata']['HTTPStatusCode'] != 200:
+        raise UploadException
+
+
+async def buffered_parts(
+        content: AsyncIterator[bytes], part_size: int
+) -> AsyncIterator[bytes]:
+    """
+    Regroup an async byte stream into parts of PART_SIZE bytes. The last
+    part is shorter, possibly empty, and is the only one yielded once the
+    stream is exhausted.
+    """
+    buffer = bytearray()
+    async for chunk in content:
+        buffer.extend(chunk)
+        while len(buffer) >= part_size:
+            yield bytes(buffer[:part_size])
+            del buffer[:part_size]
+    yield bytes(buffer)
+
+
+async def hashed_chunks(
+        content: AsyncIterator[bytes], digest
+) -> AsyncIterator[bytes]:
+    """
+    Pass an async byte stream through, hashing it into DIGEST. Raises
+    FileTooLarge once it grows past max_size_stream_file.
+    """
+    size = 0
+    async for chunk in content:
+        size += len(chunk)
+        if size > app_settings.max_size_stream_file:
+            raise FileTooLarge
+        digest.update(chunk)
+        yield chunk
+
+
+async def upload_chunks(
+        client: AioBaseClient, bucket: str, content: AsyncIterator[bytes],
+        file_path: str, content_type: str | None = None
+) -> int:
+    """
+    Upload an async byte stream to a fixed key, one part at a time.
+    Returns the number of bytes written.
+    """
+    part_size = app_settings.s3_part_size
+    upload = MultipartUpload(client, bucket, file_path)
+    parts = {}
+    size = 0
+    try:
+        async for body in buffered_parts(content, part_size):
+            size += len(body)
+            if upload.upload_id is None and len(body) < part_size:
+                # the whole stream fits in a single put
+                await put_bytes(client, bucket, file_path, body, content_type)
+                return size
+            if upload.upload_id is None:
+                await upload.create(content_type)
+            if body:
+                number = len(parts) + 1
+                parts[number] = await upload.upload_part(number, body)
+        await upload.complete(parts)
+    except BaseException as error:
+        if upload.upload_id is not None:
+            with suppress(Exception):
+                await asyncio.shield(upload.abort())
+        if isinstance(error, Exception) and (
+                not isinstance(error, UploadException)):
+            raise UploadException from error
+        raise
+    return size
+
+
+class PartSender:
+    """
+    Sends the parts of a multipart upload as tasks, at most
+    `s3_parts_in_flight` at a time.
+    """
+
+    def __init__(self, upload: MultipartUpload):
+        self.upload = upload
+        self.parts = {}
+        self._semaphore = asyncio.Semaphore(app_settings.s3_parts_in_flight)
+        self._tasks = set()
+        self._number = 0
+
+    async def _send(self, number: int, body: bytes) -> None:
+        try:
+            self.parts[number] = await self.upload.upload_part(number, body)
+        finally:
+            self._semaphore.release()
+
+    async def send(self, body: bytes) -> None:
+        # returns once the part is in flight, so while all of them are
+        # busy the caller does not read further
+        await self._semaphore.acquire()
+        for task in [task for task in self._tasks if task.done()]:
+            self._tasks.discard(task)
+            task.result()
+        self._number += 1
+        self._tasks.add(asyncio.create_task(self._send(self._number, body)))
+
+    async def wait(self) -> dict[int, str]:
+        await asyncio.gather(*self._tasks)
+        return self.parts
+
+    def cancel(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+
+
+async def keep_blob(
+        client: AioBaseClient, upload: MultipartUpload,
+        parts: dict[int, str], blob_hash: str, size: int,
+        blob_exists: Callable[[str], Awaitable[bool]]
+) -> None:
+    """
+    Complete the upload of a temporary key and copy it to the key of
+    BLOB_HASH, or abort it when that blob is already stored.
+    """
+    if await blob_exists(blob_hash):
+        await upload.abort()
+        return
+    await upload.complete(parts)
+    try:
+        await copy_object(
+            client, upload.bucket, upload.file_path, Blob.key_for(blob_hash),
+            size
+        )
+    except BaseException:
+        with suppress(Exception):
+            await asyncio.shield(client.delete_object(
+                Bucket=upload.bucket, Key=upload.file_path
+            ))
+        raise
+    await client.delete_object(Bucket=upload.bucket, Key=upload.file_path)
+
+
+async def upload_stream(
+        client: AioBaseClient, bucket: str, content: AsyncIterator[bytes],
+        blob_exists: Callable[[str], Awaitable[bool]],
+        content_type: str | None = None
+) -> tuple[str, int]:
+    """
+    Upload an async byte stream under the SHA-256 of its content.
+
+    The stream is hashed while it is sent as fixed-size multipart parts to
+    a temporary key. At most `s3_parts_in_flight` parts are sent
+    concurrently; while all of them are busy the stream is not read, so
+    memory per upload stays bounded by part size. If a blob with the same
+    digest is already stored nothing is kept: streams shorter than one part
+    skip the put entirely and multipart uploads are aborted instead of
+    completed. Streams over `max_size_stream_file` raise FileTooLarge.
+    Returns the digest and the number of bytes read.
+    """
+    part_size = app_settings.s3_part_size
+    upload = MultipartUpload(client, bucket, f'uploads/{uuid4()}')
+    sender = PartSender(upload)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async for body in buffered_parts(
+                hashed_chunks(content, digest), part_size):
+            size += len(body)
+            if upload.upload_id is None and len(body) < part_size:
+                blob_hash = digest.hexdigest()
+                if not await blob_exists(blob_hash):
+                    await put_bytes(
+                        client, bucket, Blob.key_for(blob_hash), body,
+                        content_type
+                    )
+                return blob_hash, size
+            if upload.upload_id is None:
+                await upload.create(content_type)
+            if body:
+                await sender.send(body)
+        blob_hash = digest.hexdigest()
+        await keep_blob(
+            client, upload, await sender.wait(), blob_hash, size,
+            blob_exists
+        )
+    except BaseException as error:
+        sender.cancel()
+        if upload.upload_id is not None:
+            # fails harmlessly once keep_blob completed the upload
+            with suppress(Exception):
+                await asyncio.shield(upload.abort())
+        if isinstance(error, Exception) and (
+                not isinstance(error, UploadException)):
+            raise UploadException from error
+        raise
+    return blob_hash, size
@@ -0,0 +1,139 @@
+import json
+
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.base import Executable
+from sqlalchemy.sql.elements import ClauseElement
+from sqlalchemy import select, func, literal_column
+
+from core.config import app_settings
+from models.file import File
+from services.exceptions import SearchException
+from services.search_query import compile_query, escape_like
+
+
+# text search configuration of files.search_vector
+TS_CONFIG = literal_column("'simple'::regconfig")
+ORDER_COLUMNS = {
+    'id': File.id,
+    'name': File.name,
+    'created_at': File.created_at,
+    'path': File.path,
+    'size': File.size,
+}
+QUERY_CANCELED = '57014'
+INVALID_REGULAR_EXPRESSION = '2201B'
+
+
+class Explain(Executable, ClauseElement):
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain, 'postgresql')
+def compile_explain(element, compiler, **kw):
+    return 'EXPLAIN (FORMAT JSON) ' + compiler.process(element.statement, **kw)
+
+
+async def check_cost(db: AsyncSession, statement) -> None:
+    """
+    Refuse STATEMENT when the planner expects it to cost more than
+    search_max_cost, e.g. a regex that no index can narrow down.
+    """
+    result = await db.execute(Explain(statement))
+    plan = result.scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    if plan[0]['Plan']['Total Cost'] > app_settings.search_max_cost:
+        raise SearchException('Query is too expensive, narrow it down')
+
+
+def search_conditions(
+        user_id: str, path: str, extension: str, query: str, is_regex: bool,
+        ts_query
+) -> tuple[list, bool]:
+    """
+    WHERE conditions of a search, and whether one of them matches a
+    regular expression. EXTENSION matches extensions containing it.
+    """
+    conditions = [File.account_id == user_id]
+    if path:
+        conditions.append(File.path.like(f'{escape_like(path)}%'))
+    if extension:
+        conditions.append(
+            File.extension.like(f'%{escape_like(extension)}%')
+        )
+    has_regex = False
+    if query and is_regex:
+        conditions.append(File.path.regexp_match(query))
+        has_regex = True
+    elif query:
+        clause, has_regex = compile_query(query)
+        conditions.append(clause)
+    if ts_query is not None:
+        conditions.append(File.search_vector.op('@@')(ts_query))
+    return conditions, has_regex
+
+
+def search_order(
+        order_by: str, query: str, is_regex: bool, ts_query) -> tuple:
+    if order_by != 'relevance':
+        return (ORDER_COLUMNS[order_by],)
+    if ts_query is not None:
+        return func.ts_rank(File.search_vector, ts_query).desc(), File.id
+    if query and not is_regex:
+        return func.similarity(File.name, query).desc(), File.id
+    return File.created_at.desc(), File.id
+
+
+async def search_files_in_db(
+        db: AsyncSession, user_id: str, path: str, extension: str, query: str,
+        is_regex: bool, order_by: str, limit: int = 100,
+        words: str | None = None
+) -> list[File]:
+    """
+    Search an account's files.
+
+    QUERY is in the search query language of services.search_query, or
+    with IS_REGEX a regular expression of the path; both are served by
+    the trigram index on path, which covers the name too. WORDS is a
+    web-style full-text query over the words of the path, served by the
+    search_vector index. Ordering by relevance ranks full-text matches by
+    ts_rank and other matches by trigram similarity to QUERY.
+
+    Queries with a regular expression run under search_timeout and are
+    refused when their plan costs more than search_max_cost. Raises
+    SearchException for invalid or refused queries.
+    """
+    ts_query = None
+    if words:
+        ts_query = func.websearch_to_tsquery(TS_CONFIG, words)
+    conditions, has_regex = search_conditions(
+        user_id, path, extension, query, is_regex, ts_query
+    )
+    statement = (
+        select(File).
+        where(*conditions).
+        order_by(*search_order(order_by, query, is_regex, ts_query)).
+        limit(limit)
+    )
+    try:
+        if has_regex:
+            await db.execute(select(func.set_config(
+                'statement_timeout', str(app_settings.search_timeout), True
+            )))
+            await check_cost(db, statement)
+        results = await db.execute(statement=statement)
+    except DBAPIError as error:
+        code = getattr(error.orig, 'sqlstate', None)
+        if code == QUERY_CANCELED:
+            await db.rollback()
+            raise SearchException('Search timed out, narrow it down')
+        if code == INVALID_REGULAR_EXPRESSION:
+            await db.rollback()
+            raise SearchException('Invalid regular expression')
+        raise
+    return results.scalars().all()
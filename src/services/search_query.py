@@ -0,0 +1,243 @@
+"""
+Search query language.
+
+    annual report ext:pdf size>10MB created<2026-01-01
+    (name:invoice OR path:billing/) -re:"\\.tmp$"
+
+Terms are ANDed unless joined with OR, NOT or a leading '-' negates a
+term and parentheses group. Values with spaces or parentheses are
+quoted. Terms compile to predicates on indexed columns:
+
+    word, "some words"   substring of the path
+    name:VALUE           substring of the name
+    path:VALUE           path prefix
+    ext:VALUE            extension
+    re:VALUE             regular expression on the path
+    size OP N[KB|MB|GB|TB], created OP DATE, with OP one of
+                         : = < <= > >=
+"""
+import re
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+
+from sqlalchemy import and_, or_, not_
+from sqlalchemy.sql.elements import ColumnElement
+
+from models.file import File
+from services.exceptions import SearchException
+
+
+MAX_QUERY_LENGTH = 1000
+MAX_TERMS = 32
+# sizes are compared as bigint, against the value and the value + 1
+MAX_SIZE = 2 ** 63 - 2
+SIZE_UNITS = {'': 1, 'b': 1, 'kb': 1024, 'mb': 1024 ** 2,
+              'gb': 1024 ** 3, 'tb': 1024 ** 4}
+TOKEN = re.compile(
+    r'''\s*(?:
+        (?P<paren>[()])
+        | (?P<negated>-)?
+          (?:(?P<field>[a-z]+)(?P<op>:|<=|>=|<|>|=))?
+          (?P<value>"(?:[^"\\]|\\.)*"|[^\s()"]+)
+    )\s*''',
+    re.VERBOSE | re.IGNORECASE
+)
+SIZE = re.compile(r'(\d+(?:\.\d+)?)\s*([kmgt]?b)?', re.IGNORECASE)
+KEYWORDS = ('AND', 'OR', 'NOT')
+
+
+def escape_like(value: str) -> str:
+    return (
+        value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    )
+
+
+def contains(column, value: str) -> ColumnElement:
+    return column.ilike(f'%{escape_like(value)}%')
+
+
+def compare(column, op: str, start, end) -> ColumnElement:
+    """
+    Compare COLUMN with the interval [START, END) a value stands for.
+    """
+    if op == '<':
+        return column < start
+    if op == '<=':
+        return column < end
+    if op == '>':
+        return column >= end
+    if op == '>=':
+        return column >= start
+    return and_(column >= start, column < end)
+
+
+def parse_size(value: str) -> int:
+    match = SIZE.fullmatch(value)
+    if not match:
+        raise SearchException(f'Invalid size: {value}')
+    number, unit = match.groups()
+    size = float(number) * SIZE_UNITS[(unit or '').lower()]
+    if size > MAX_SIZE:
+        raise SearchException(f'Size out of range: {value}')
+    return int(size)
+
+
+def next_moment(moment: datetime, step: timedelta) -> datetime:
+    try:
+        return moment + step
+    except OverflowError:
+        raise SearchException(f'Date out of range: {moment.date()}')
+
+
+def parse_created(value: str) -> tuple[datetime, datetime]:
+    try:
+        day = date.fromisoformat(value)
+    except ValueError:
+        pass
+    else:
+        start = datetime.combine(day, time())
+        return start, next_moment(start, timedelta(days=1))
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise SearchException(f'Invalid date: {value}')
+    return moment, next_moment(moment, timedelta(microseconds=1))
+
+
+def term_clause(field: str | None, op: str | None, value: str
+                ) -> tuple[ColumnElement, bool]:
+    """
+    Predicate of one term and whether it is a regular expression.
+    """
+    field = (field or '').lower()
+    if field in ('size', 'created'):
+        if field == 'size':
+            size = parse_size(value)
+            return compare(File.size, op, size, size + 1), False
+        return compare(File.created_at, op, *parse_created(value)), False
+    if op not in (':', None) or field not in ('name', 'path', 'ext', 're'):
+        # not a field of ours, e.g. a word with a colon
+        value = f'{field}{op}{value}' if field else value
+        return contains(File.path, value), False
+    if field == 'name':
+        # the path condition lets the trigram index on path find rows
+        return and_(contains(File.path, value),
+                    contains(File.name, value)), False
+    if field == 'path':
+        return File.path.like(f'{escape_like(value)}%'), False
+    if field == 'ext':
+        extension = value.lstrip('.')
+        return and_(File.path.ilike(f'%.{escape_like(extension)}'),
+                    File.extension.ilike(escape_like(extension))), False
+    return File.path.regexp_match(value), True
+
+
+def tokenize(query: str) -> list[dict]:
+    tokens = []
+    position = 0
+    while position < len(query):
+        match = TOKEN.match(query, position)
+        if not match or match.end() == position:
+            raise SearchException(f'Unexpected input at {position}')
+        position = match.end()
+        token = match.groupdict()
+        if token['value'] and token['value'].startswith('"'):
+            # only quotes are escaped, regexes keep their backslashes
+            token['value'] = token['value'][1:-1].replace('\\"', '"')
+        elif (token['value'] in KEYWORDS and not token['field']
+              and not token['negated']):
+            token['keyword'] = token['value']
+        tokens.append(token)
+    if len(tokens) > MAX_TERMS:
+        raise SearchException(f'At most {MAX_TERMS} terms per query')
+    return tokens
+
+
+class Parser:
+    """
+    Recursive descent parser building the predicate of a query.
+    """
+
+    def __init__(self, query: str):
+        self.tokens = tokenize(query)
+        self.position = 0
+        self.regex = False
+
+    def _peek(self) -> dict | None:
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def _keyword(self, keyword: str) -> bool:
+        token = self._peek()
+        if token and token.get('keyword') == keyword:
+            self.position += 1
+            return True
+        return False
+
+    def parse(self) -> ColumnElement:
+        if not self.tokens:
+            raise SearchException('Empty query')
+        clause = self._or()
+        if self._peek():
+            raise SearchException('Unbalanced parentheses')
+        return clause
+
+    def _or(self) -> ColumnElement:
+        clauses = [self._and()]
+        while self._keyword('OR'):
+            clauses.append(self._and())
+        return or_(*clauses) if len(clauses) > 1 else clauses[0]
+
+    def _and(self) -> ColumnElement:
+        clauses = [self._not()]
+        while True:
+            token = self._peek()
+            if (token is None or token['paren'] == ')'
+                    or token.get('keyword') == 'OR'):
+                break
+            self._keyword('AND')
+            clauses.append(self._not())
+        return and_(*clauses) if len(clauses) > 1 else clauses[0]
+
+    def _not(self) -> ColumnElement:
+        if self._keyword('NOT'):
+            return not_(self._not())
+        return self._term()
+
+    def _term(self) -> ColumnElement:
+        token = self._peek()
+        if token is None or token.get('keyword'):
+            raise SearchException('Expected a search term')
+        self.position += 1
+        if token['paren'] == '(':
+            clause = self._or()
+            end = self._peek()
+            if not end or end['paren'] != ')':
+                raise SearchException('Unbalanced parentheses')
+            self.position += 1
+            return clause
+        if token['paren']:
+            raise SearchException('Unbalanced parentheses')
+        clause, regex = term_clause(
+            token['field'], token['op'], token['value']
+        )
+        self.regex = self.regex or regex
+        return not_(clause) if token['negated'] else clause
+
+
+@lru_cache(maxsize=1024)
+def compile_query(query: str) -> tuple[ColumnElement, bool]:
+    """
+    Predicate of a search query and whether it has a regular expression.
+
+    Values are bound parameters, so statements of queries with the same
+    shape also share SQLAlchemy's compiled SQL cache.
+    """
+    if len(query) > MAX_QUERY_LENGTH:
+        raise SearchException(
+            f'Query is longer than {MAX_QUERY_LENGTH} characters'
+        )
+    parser = Parser(query)
+    clause = parser.parse()
+    return clause, parser.regex
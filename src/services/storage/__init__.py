@@ -0,0 +1,8 @@
+from .base import Storage
+from .local import LocalStorage
+from .s3 import S3Storage
+from .sharded import HashRing, ShardedStorage
+
+__all__ = [
+    'Storage', 'LocalStorage', 'S3Storage', 'HashRing', 'ShardedStorage',
+]
@@ -0,0 +1,176 @@
+import hashlib
+from abc import ABC, abstractmethod
+from contextlib import suppress
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable
+from uuid import uuid4
+
+from core.config import app_settings
+from models.file import Blob
+from services.exceptions import (
+    FileTooLarge, StorageNotSupported, UploadException
+)
+
+
+class Storage(ABC):
+    """
+    Object storage used for file contents, addressed by key.
+
+    Errors are reported as UploadException and DownloadException,
+    features a backend lacks as StorageNotSupported.
+    """
+
+    # serves URLs clients can upload to and download from directly
+    presigned = False
+    # contents already live on local disk, no point caching them
+    local = False
+
+    @abstractmethod
+    async def put(
+            self, key: str, content: BinaryIO,
+            content_type: str | None = None
+    ) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def put_stream(
+            self, key: str, content: AsyncIterator[bytes],
+            content_type: str | None = None
+    ) -> int:
+        """
+        Write an async byte stream, return the number of bytes written.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get(
+            self, key: str, byte_range: tuple[int, int] | None = None
+    ) -> AsyncIterator[bytes]:
+        """
+        Open the object, or its inclusive `byte_range`, for reading.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def head(self, key: str) -> dict:
+        """
+        Return size, etag, content_type and last_modified of the object.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def copy(self, source_key: str, target_key: str, size: int) -> None:
+        raise NotImplementedError
+
+    async def move(self, source_key: str, target_key: str, size: int) -> None:
+        await self.copy(source_key, target_key, size)
+        await self.delete(source_key)
+
+    @abstractmethod
+    async def create_multipart(
+            self, key: str, content_type: str | None = None) -> str:
+        """
+        Start an upload assembled from numbered parts, return its id.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def upload_part(
+            self, key: str, upload_id: str, number: int, body: bytes) -> str:
+        """
+        Store part NUMBER of an upload, return its etag.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def complete_multipart(
+            self, key: str, upload_id: str, parts: dict[int, str]) -> str:
+        """
+        Assemble the parts in order into the object, return its etag.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def abort_multipart(self, key: str, upload_id: str) -> None:
+        raise NotImplementedError
+
+    async def presign_put(self, key: str, content_type: str) -> str:
+        raise StorageNotSupported
+
+    async def presign_part(
+            self, key: str, upload_id: str, number: int) -> str:
+        raise StorageNotSupported
+
+    async def presign_get(
+            self, key: str, content_type: str | None,
+            content_disposition: str
+    ) -> str:
+        raise StorageNotSupported
+
+    def shard_for(self, key: str) -> str | None:
+        """
+        Shard a new object with this key is written to, None for the
+        default one.
+        """
+        return None
+
+    def on(self, shard: str | None) -> 'Storage':
+        """
+        Storage of the objects recorded on SHARD.
+        """
+        return self
+
+    def local_path(self, key: str) -> str | None:
+        """
+        Path of the object on local disk, for zero-copy serving.
+        """
+        return None
+
+    @abstractmethod
+    async def ping(self) -> bool:
+        raise NotImplementedError
+
+    async def put_blob_stream(
+            self, content: AsyncIterator[bytes],
+            blob_exists: Callable[[str], Awaitable[bool]],
+            content_type: str | None = None
+    ) -> tuple[str, int, str | None]:
+        """
+        Store an async byte stream under the SHA-256 of its content.
+
+        The stream is hashed while written to a temporary key, which is
+        then moved to the blob key, or dropped when the blob is already
+        stored. Streams over max_size_stream_file raise FileTooLarge.
+        Returns the digest, the number of bytes read and the shard the
+        blob was written to.
+        """
+        digest = hashlib.sha256()
+        temp_key = f'uploads/{uuid4()}'
+
+        async def hashed() -> AsyncIterator[bytes]:
+            size = 0
+            async for chunk in content:
+                size += len(chunk)
+                if size > app_settings.max_size_stream_file:
+                    raise FileTooLarge
+                digest.update(chunk)
+                yield chunk
+
+        try:
+            size = await self.put_stream(temp_key, hashed(), content_type)
+            blob_hash = digest.hexdigest()
+            if await blob_exists(blob_hash):
+                await self.delete(temp_key)
+            else:
+                await self.move(temp_key, Blob.key_for(blob_hash), size)
+        except BaseException as error:
+            with suppress(Exception):
+                await self.delete(temp_key)
+            if isinstance(error, Exception) and (
+                    not isinstance(error, UploadException)):
+                raise UploadException from error
+            raise
+        return blob_hash, size, None
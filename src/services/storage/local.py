@@ -0,0 +1,262 @@
+import asyncio
+import hashlib
+import mimetypes
+import os
+import shutil
+from contextlib import suppress
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO
+from uuid import uuid4
+
+import aiofiles
+
+from services.exceptions import DownloadException, UploadException
+from services.storage.base import Storage
+
+
+def preallocate(fd: int, size: int) -> None:
+    """
+    Reserve SIZE bytes for a file so it is written in few extents.
+    """
+    if size > 0 and hasattr(os, 'posix_fallocate'):
+        with suppress(OSError):
+            os.posix_fallocate(fd, 0, size)
+
+
+def copy_range(source: BinaryIO, target: BinaryIO, size: int) -> None:
+    """
+    Append the SIZE bytes of unbuffered SOURCE to unbuffered TARGET,
+    inside the kernel when possible.
+    """
+    if hasattr(os, 'copy_file_range'):
+        with suppress(OSError):
+            while size > 0:
+                copied = os.copy_file_range(
+                    source.fileno(), target.fileno(), size
+                )
+                if not copied:
+                    break
+                size -= copied
+    if size > 0:
+        shutil.copyfileobj(source, target)
+
+
+class LocalStorage(Storage):
+    """
+    Storage in a directory on local disk or NFS.
+
+    Objects are written to a temporary file, preallocated when the size
+    is known, and renamed into place. Downloads are served straight from
+    the files and copies stay in the kernel.
+    """
+
+    local = True
+    chunk_size = 1048576
+
+    def __init__(self, root: str):
+        self.root = Path(root).resolve()
+        # under a reserved prefix, so no user path can reach it
+        self.tmp_dir = self.root / 'uploads' / '.tmp'
+        self.multipart_dir = self.root / 'uploads' / '.multipart'
+
+    def _path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if self.root not in path.parents:
+            raise DownloadException
+        return path
+
+    def _tmp_path(self) -> Path:
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        return self.tmp_dir / uuid4().hex
+
+    def _commit(self, tmp_path: Path, key: str) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp_path, path)
+
+    def _put(self, key: str, content: BinaryIO) -> None:
+        tmp_path = self._tmp_path()
+        try:
+            with open(tmp_path, 'wb') as file:
+                content.seek(0, os.SEEK_END)
+                preallocate(file.fileno(), content.tell())
+                content.seek(0)
+                shutil.copyfileobj(content, file, self.chunk_size)
+            self._commit(tmp_path, key)
+        finally:
+            with suppress(FileNotFoundError):
+                tmp_path.unlink()
+
+    async def put(
+            self, key: str, content: BinaryIO,
+            content_type: str | None = None
+    ) -> None:
+        try:
+            await asyncio.to_thread(self._put, key, content)
+        except (OSError, DownloadException) as error:
+            raise UploadException from error
+
+    async def put_stream(
+            self, key: str, content: AsyncIterator[bytes],
+            content_type: str | None = None
+    ) -> int:
+        tmp_path = await asyncio.to_thread(self._tmp_path)
+        size = 0
+        try:
+            async with aiofiles.open(tmp_path, 'wb') as file:
+                async for chunk in content:
+                    size += len(chunk)
+                    await file.write(chunk)
+            await asyncio.to_thread(self._commit, tmp_path, key)
+        except (OSError, DownloadException) as error:
+            raise UploadException from error
+        finally:
+            with suppress(FileNotFoundError):
+                await asyncio.to_thread(tmp_path.unlink)
+        return size
+
+    async def get(
+            self, key: str, byte_range: tuple[int, int] | None = None
+    ) -> AsyncIterator[bytes]:
+        try:
+            file = await aiofiles.open(self._path(key), 'rb')
+        except OSError:
+            raise DownloadException
+        start, end = byte_range or (0, None)
+
+        async def read() -> AsyncIterator[bytes]:
+            try:
+                await file.seek(start)
+                remaining = None if end is None else end - start + 1
+                while remaining is None or remaining > 0:
+                    size = self.chunk_size
+                    if remaining is not None:
+                        size = min(size, remaining)
+                        remaining -= size
+                    chunk = await file.read(size)
+                    if not chunk:
+                        break
+                    yield chunk
+            finally:
+                await file.close()
+
+        return read()
+
+    async def head(self, key: str) -> dict:
+        try:
+            stat = await asyncio.to_thread(os.stat, self._path(key))
+        except OSError:
+            raise DownloadException
+        return {
+            'size': stat.st_size,
+            'etag': f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"',
+            'content_type': mimetypes.guess_type(key)[0],
+            'last_modified': datetime.fromtimestamp(
+                stat.st_mtime, timezone.utc
+            ),
+        }
+
+    async def delete(self, key: str) -> None:
+        with suppress(FileNotFoundError):
+            await asyncio.to_thread(self._path(key).unlink)
+
+    def _copy(self, source_key: str, target_key: str) -> None:
+        tmp_path = self._tmp_path()
+        try:
+            # uses copy_file_range / sendfile on Linux
+            shutil.copyfile(self._path(source_key), tmp_path)
+            self._commit(tmp_path, target_key)
+        finally:
+            with suppress(FileNotFoundError):
+                tmp_path.unlink()
+
+    async def copy(self, source_key: str, target_key: str, size: int) -> None:
+        try:
+            await asyncio.to_thread(self._copy, source_key, target_key)
+        except (OSError, DownloadException) as error:
+            raise UploadException from error
+
+    async def move(self, source_key: str, target_key: str, size: int) -> None:
+        try:
+            await asyncio.to_thread(
+                self._commit, self._path(source_key), target_key
+            )
+        except (OSError, DownloadException) as error:
+            raise UploadException from error
+
+    def _parts_dir(self, upload_id: str) -> Path:
+        if not upload_id.isalnum():
+            raise UploadException
+        return self.multipart_dir / upload_id
+
+    async def create_multipart(
+            self, key: str, content_type: str | None = None) -> str:
+        upload_id = uuid4().hex
+        await asyncio.to_thread(
+            self._parts_dir(upload_id).mkdir, parents=True
+        )
+        return upload_id
+
+    def _upload_part(self, upload_id: str, number: int, body: bytes) -> str:
+        parts_dir = self._parts_dir(upload_id)
+        if not parts_dir.is_dir():
+            raise UploadException
+        tmp_path = self._tmp_path()
+        tmp_path.write_bytes(body)
+        os.replace(tmp_path, parts_dir / str(number))
+        return f'"{hashlib.md5(body).hexdigest()}"'
+
+    async def upload_part(
+            self, key: str, upload_id: str, number: int, body: bytes) -> str:
+        try:
+            return await asyncio.to_thread(
+                self._upload_part, upload_id, number, body
+            )
+        except OSError as error:
+            raise UploadException from error
+
+    def _complete_multipart(
+            self, key: str, upload_id: str, numbers: list[int]) -> None:
+        parts_dir = self._parts_dir(upload_id)
+        paths = [parts_dir / str(number) for number in numbers]
+        sizes = [path.stat().st_size for path in paths]
+        tmp_path = self._tmp_path()
+        try:
+            with open(tmp_path, 'wb', buffering=0) as file:
+                preallocate(file.fileno(), sum(sizes))
+                for path, size in zip(paths, sizes):
+                    with open(path, 'rb', buffering=0) as part:
+                        copy_range(part, file, size)
+            self._commit(tmp_path, key)
+        finally:
+            with suppress(FileNotFoundError):
+                tmp_path.unlink()
+        shutil.rmtree(parts_dir, ignore_errors=True)
+
+    async def complete_multipart(
+            self, key: str, upload_id: str, parts: dict[int, str]) -> str:
+        try:
+            await asyncio.to_thread(
+                self._complete_multipart, key, upload_id, sorted(parts)
+            )
+        except (OSError, DownloadException) as error:
+            raise UploadException from error
+        return (await self.head(key))['etag']
+
+    async def abort_multipart(self, key: str, upload_id: str) -> None:
+        await asyncio.to_thread(
+            shutil.rmtree, self._parts_dir(upload_id), True
+        )
+
+    def local_path(self, key: str) -> str | None:
+        return str(self._path(key))
+
+    async def ping(self) -> bool:
+        try:
+            await asyncio.to_thread(
+                self.root.mkdir, parents=True, exist_ok=True
+            )
+        except OSError:
+            return False
+        return await asyncio.to_thread(os.access, self.root, os.W_OK)
@@ -0,0 +1,81 @@
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable
+
+from services.storage.base import Storage
+
+
+async def upload_content(
+        storage: Storage, content: BinaryIO, file_path: str,
+        content_type: str | None = None
+) -> None:
+    await storage.put(file_path, content, content_type)
+
+
+async def upload_stream(
+        storage: Storage, content: AsyncIterator[bytes],
+        blob_exists: Callable[[str], Awaitable[bool]],
+        content_type: str | None = None
+) -> tuple[str, int, str | None]:
+    return await storage.put_blob_stream(content, blob_exists, content_type)
+
+
+async def download_content(
+        storage: Storage, file_path: str,
+        byte_range: tuple[int, int] | None = None
+) -> AsyncIterator[bytes]:
+    return await storage.get(file_path, byte_range)
+
+
+async def get_content_info(storage: Storage, file_path: str) -> dict:
+    return await storage.head(file_path)
+
+
+async def presign_upload(
+        storage: Storage, file_path: str, content_type: str) -> str:
+    return await storage.presign_put(file_path, content_type)
+
+
+async def presign_download(
+        storage: Storage, file_path: str, content_type: str | None,
+        content_disposition: str
+) -> str:
+    return await storage.presign_get(
+        file_path, content_type, content_disposition
+    )
+
+
+class MultipartUpload:
+    """
+    Upload of a single object assembled from numbered parts.
+    """
+
+    def __init__(
+            self, storage: Storage, file_path: str,
+            upload_id: str | None = None
+    ):
+        self._storage = storage
+        self.file_path = file_path
+        self.upload_id = upload_id
+
+    async def create(self, content_type: str | None = None) -> str:
+        self.upload_id = await self._storage.create_multipart(
+            self.file_path, content_type
+        )
+        return self.upload_id
+
+    async def upload_part(self, number: int, body: bytes) -> str:
+        return await self._storage.upload_part(
+            self.file_path, self.upload_id, number, body
+        )
+
+    async def presign_part(self, number: int) -> str:
+        return await self._storage.presign_part(
+            self.file_path, self.upload_id, number
+        )
+
+    async def complete(self, parts: dict[int, str]) -> str:
+        return await self._storage.complete_multipart(
+            self.file_path, self.upload_id, parts
+        )
+
+    async def abort(self) -> None:
+        await self._storage.abort_multipart(self.file_path, self.upload_id)
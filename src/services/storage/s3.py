@@ -0,0 +1,137 @@
+from functools import partial
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable
+
+from aiobotocore.session import AioBaseClient
+
+from core.config import app_settings
+from services.s3_files.download import (
+    download_content, get_content_info, presign_download
+)
+from services.s3_files.policy import read_policy
+from services.s3_files.upload import (
+    MultipartUpload, copy_object, presign_upload, upload_chunks,
+    upload_content, upload_stream
+)
+from services.storage.base import Storage
+
+
+class S3Storage(Storage):
+    """
+    Storage in an S3 bucket, s3_bucket by default.
+    """
+
+    presigned = True
+
+    def __init__(
+            self, client: AioBaseClient, bucket: str | None = None,
+            read_client: AioBaseClient | None = None
+    ):
+        self.client = client
+        # without botocore retries, reads are retried by read_policy
+        self.read_client = read_client or client
+        self.bucket = bucket or app_settings.s3_bucket
+
+    async def put(
+            self, key: str, content: BinaryIO,
+            content_type: str | None = None
+    ) -> None:
+        await upload_content(
+            client=self.client, bucket=self.bucket, content=content,
+            file_path=key
+        )
+
+    async def put_stream(
+            self, key: str, content: AsyncIterator[bytes],
+            content_type: str | None = None
+    ) -> int:
+        return await upload_chunks(
+            self.client, self.bucket, content, key, content_type=content_type
+        )
+
+    async def put_blob_stream(
+            self, content: AsyncIterator[bytes],
+            blob_exists: Callable[[str], Awaitable[bool]],
+            content_type: str | None = None
+    ) -> tuple[str, int, str | None]:
+        # sends parts concurrently and skips the temporary key for
+        # streams shorter than a part
+        blob_hash, size = await upload_stream(
+            self.client, self.bucket, content, blob_exists, content_type
+        )
+        return blob_hash, size, None
+
+    async def get(
+            self, key: str, byte_range: tuple[int, int] | None = None
+    ) -> AsyncIterator[bytes]:
+        return await download_content(
+            client=self.read_client, bucket=self.bucket, file_path=key,
+            byte_range=byte_range
+        )
+
+    async def head(self, key: str) -> dict:
+        return await get_content_info(
+            client=self.read_client, bucket=self.bucket, file_path=key
+        )
+
+    async def delete(self, key: str) -> None:
+        await self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    async def copy(self, source_key: str, target_key: str, size: int) -> None:
+        await copy_object(
+            self.client, self.bucket, source_key, target_key, size
+        )
+
+    def _multipart(
+            self, key: str, upload_id: str | None = None
+    ) -> MultipartUpload:
+        return MultipartUpload(self.client, self.bucket, key, upload_id)
+
+    async def create_multipart(
+            self, key: str, content_type: str | None = None) -> str:
+        return await self._multipart(key).create(content_type)
+
+    async def upload_part(
+            self, key: str, upload_id: str, number: int, body: bytes) -> str:
+        return await self._multipart(key, upload_id).upload_part(
+            number, body
+        )
+
+    async def complete_multipart(
+            self, key: str, upload_id: str, parts: dict[int, str]) -> str:
+        return await self._multipart(key, upload_id).complete(parts)
+
+    async def abort_multipart(self, key: str, upload_id: str) -> None:
+        await self._multipart(key, upload_id).abort()
+
+    async def presign_put(self, key: str, content_type: str) -> str:
+        return await presign_upload(
+            client=self.client, bucket=self.bucket, file_path=key,
+            content_type=content_type
+        )
+
+    async def presign_part(
+            self, key: str, upload_id: str, number: int) -> str:
+        return await self._multipart(key, upload_id).presign_part(number)
+
+    async def presign_get(
+            self, key: str, content_type: str | None,
+            content_disposition: str
+    ) -> str:
+        return await presign_download(
+            client=self.client, bucket=self.bucket, file_path=key,
+            content_type=content_type,
+            content_disposition=content_disposition
+        )
+
+    async def ping(self) -> bool:
+        try:
+            response = await read_policy.call(
+                'get_object_acl',
+                partial(
+                    self.read_client.get_object_acl,
+                    Bucket=self.bucket, Key='for_ping.txt'
+                )
+            )
+        except Exception:
+            return False
+        return response['ResponseMetadata']['HTTPStatusCode'] == 200
@@ -0,0 +1,170 @@
+import asyncio
+import bisect
+import hashlib
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable, Iterable
+from uuid import uuid4
+
+from services.exceptions import UnknownShard
+from services.storage.base import Storage
+
+
+class HashRing:
+    """
+    Consistent hash ring over shard names.
+
+    Each shard owns VNODES points of the ring and a key belongs to the
+    next point clockwise, so adding a shard to N moves about 1/(N+1) of
+    the keys, all of them onto the new shard.
+    """
+
+    def __init__(self, names: Iterable[str], vnodes: int = 128):
+        points = sorted(
+            (self._hash(f'{name}#{index}'), name)
+            for name in set(names) for index in range(vnodes)
+        )
+        if not points:
+            raise ValueError('Hash ring needs at least one shard')
+        self._hashes = [point for point, _ in points]
+        self._names = [name for _, name in points]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(
+            hashlib.md5(value.encode()).digest()[:8], 'big'
+        )
+
+    def get(self, key: str) -> str:
+        index = bisect.bisect(self._hashes, self._hash(key))
+        return self._names[index % len(self._names)]
+
+
+async def transfer(
+        source: Storage, target: Storage, key: str,
+        target_key: str | None = None
+) -> None:
+    """
+    Copy the object KEY between storages by streaming it through.
+    """
+    info = await source.head(key)
+    await target.put_stream(
+        target_key or key, await source.get(key), info['content_type']
+    )
+
+
+class ShardedStorage(Storage):
+    """
+    Storage spreading new objects over named shards by consistent
+    hashing of their keys.
+
+    The shard an object was written to is recorded by the caller and
+    read back through `on`, so moving to a bigger ring never makes
+    lookups probe; objects recorded without a shard live on DEFAULT.
+    """
+
+    def __init__(
+            self, shards: dict[str, Storage], ring: HashRing,
+            default: Storage
+    ):
+        self.shards = shards
+        self.ring = ring
+        self.default = default
+        self.presigned = all(
+            shard.presigned for shard in (default, *shards.values())
+        )
+
+    def shard_for(self, key: str) -> str | None:
+        return self.ring.get(key)
+
+    def on(self, shard: str | None) -> Storage:
+        if shard is None:
+            return self.default
+        try:
+            return self.shards[shard]
+        except KeyError:
+            # dropped from the configuration while objects are on it
+            raise UnknownShard(shard)
+
+    def _locate(self, key: str) -> Storage:
+        return self.shards[self.ring.get(key)]
+
+    async def put(
+            self, key: str, content: BinaryIO,
+            content_type: str | None = None
+    ) -> None:
+        await self._locate(key).put(key, content, content_type)
+
+    async def put_stream(
+            self, key: str, content: AsyncIterator[bytes],
+            content_type: str | None = None
+    ) -> int:
+        return await self._locate(key).put_stream(key, content, content_type)
+
+    async def put_blob_stream(
+            self, content: AsyncIterator[bytes],
+            blob_exists: Callable[[str], Awaitable[bool]],
+            content_type: str | None = None
+    ) -> tuple[str, int, str | None]:
+        # the digest is known only at the end, so the blob stays on a
+        # random shard instead of being copied to its ring position
+        shard = self.ring.get(uuid4().hex)
+        blob_hash, size, _ = await self.shards[shard].put_blob_stream(
+            content, blob_exists, content_type
+        )
+        return blob_hash, size, shard
+
+    async def get(
+            self, key: str, byte_range: tuple[int, int] | None = None
+    ) -> AsyncIterator[bytes]:
+        return await self._locate(key).get(key, byte_range)
+
+    async def head(self, key: str) -> dict:
+        return await self._locate(key).head(key)
+
+    async def delete(self, key: str) -> None:
+        await self._locate(key).delete(key)
+
+    async def copy(self, source_key: str, target_key: str, size: int) -> None:
+        source, target = self._locate(source_key), self._locate(target_key)
+        if source is target:
+            await source.copy(source_key, target_key, size)
+            return
+        await transfer(source, target, source_key, target_key)
+
+    async def create_multipart(
+            self, key: str, content_type: str | None = None) -> str:
+        return await self._locate(key).create_multipart(key, content_type)
+
+    async def upload_part(
+            self, key: str, upload_id: str, number: int, body: bytes) -> str:
+        return await self._locate(key).upload_part(
+            key, upload_id, number, body
+        )
+
+    async def complete_multipart(
+            self, key: str, upload_id: str, parts: dict[int, str]) -> str:
+        return await self._locate(key).complete_multipart(
+            key, upload_id, parts
+        )
+
+    async def abort_multipart(self, key: str, upload_id: str) -> None:
+        await self._locate(key).abort_multipart(key, upload_id)
+
+    async def presign_put(self, key: str, content_type: str) -> str:
+        return await self._locate(key).presign_put(key, content_type)
+
+    async def presign_part(
+            self, key: str, upload_id: str, number: int) -> str:
+        return await self._locate(key).presign_part(key, upload_id, number)
+
+    async def presign_get(
+            self, key: str, content_type: str | None,
+            content_disposition: str
+    ) -> str:
+        return await self._locate(key).presign_get(
+            key, content_type, content_disposition
+        )
+
+    async def ping(self) -> bool:
+        return all(await asyncio.gather(*[
+            shard.ping() for shard in (self.default, *self.shards.values())
+        ]))
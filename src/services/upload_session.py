@@ -0,0 +1,148 @@
+"""
+Resumable upload sessions. Sessions left unfinished past
+upload_session_lifetime are deleted, and their uploaded parts dropped,
+when their account starts a new session, or for every account with
+
+    python -m services.upload_session
+"""
+import asyncio
+import logging
+from datetime import timedelta
+
+from botocore.exceptions import ClientError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, delete, and_, func
+from sqlalchemy.orm import selectinload
+from sqlalchemy.dialects.postgresql import insert
+
+from core.config import app_settings
+from core.s3 import s3_pool, shard_pools
+from core.storage import get_storage
+from db.db import async_session
+from models.file import UploadSession, UploadPart
+from schemas.file import UploadSessionCreate
+from services.exceptions import UploadException
+from services.storage import Storage
+from services.storage.operations import MultipartUpload
+
+
+logger = logging.getLogger(__name__)
+
+
+async def create_upload_session(
+        db: AsyncSession, *, obj_in: UploadSessionCreate, user_id: str,
+        upload_id: str
+) -> UploadSession:
+    db_obj = UploadSession(
+        path=str(obj_in.path),
+        size=obj_in.size,
+        chunk_size=obj_in.chunk_size or app_settings.s3_part_size,
+        content_type=obj_in.content_type,
+        upload_id=upload_id,
+        account_id=user_id,
+        parts=[]
+    )
+    db.add(db_obj)
+    await db.commit()
+    await db.refresh(db_obj, attribute_names=['created_at'])
+    return db_obj
+
+
+async def get_upload_session(
+        db: AsyncSession, pk: str, user_id: str
+) -> UploadSession | None:
+    lifetime = timedelta(seconds=app_settings.upload_session_lifetime)
+    statement = (
+        select(UploadSession).
+        where(and_(
+            UploadSession.id == pk,
+            UploadSession.account_id == user_id,
+            UploadSession.created_at > func.now() - lifetime
+        )).
+        options(selectinload(UploadSession.parts))
+    )
+    result = await db.execute(statement=statement)
+    return result.scalar_one_or_none()
+
+
+async def add_upload_part(
+        db: AsyncSession, *, session_id: str, number: int, size: int,
+        etag: str
+) -> UploadPart:
+    values = {'session_id': session_id, 'number': number,
+              'size': size, 'etag': etag}
+    query = insert(UploadPart).values(**values).on_conflict_do_update(
+        index_elements=[UploadPart.session_id, UploadPart.number],
+        set_={'size': size, 'etag': etag}
+    ).returning(UploadPart)
+    result = await db.execute(query)
+    db_obj = result.one()
+    await db.commit()
+    return db_obj
+
+
+async def delete_upload_session(db: AsyncSession, pk: str) -> None:
+    await db.execute(delete(UploadSession).where(UploadSession.id == pk))
+    await db.commit()
+
+
+async def delete_expired_upload_sessions(
+        db: AsyncSession, storage: Storage, user_id: str | None = None,
+        batch_size: int = 100
+) -> int:
+    """
+    Abort the multipart uploads of sessions older than
+    upload_session_lifetime, of USER_ID or of every account, and delete
+    them. Sessions whose upload cannot be aborted now are kept for the
+    next run. Returns the number of sessions deleted.
+    """
+    lifetime = timedelta(seconds=app_settings.upload_session_lifetime)
+    deleted = 0
+    while True:
+        statement = (
+            select(UploadSession).
+            where(UploadSession.created_at <= func.now() - lifetime).
+            order_by(UploadSession.created_at).
+            limit(batch_size).
+            with_for_update(skip_locked=True)
+        )
+        if user_id is not None:
+            statement = statement.where(UploadSession.account_id == user_id)
+        expired = (await db.execute(statement)).scalars().all()
+        aborted = []
+        for upload_session in expired:
+            upload = MultipartUpload(
+                storage, upload_session.storage_key, upload_session.upload_id
+            )
+            try:
+                await upload.abort()
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'NoSuchUpload':
+                    continue
+            except UploadException:
+                continue
+            aborted.append(upload_session.id)
+        if aborted:
+            await db.execute(
+                delete(UploadSession).where(UploadSession.id.in_(aborted))
+            )
+        await db.commit()
+        deleted += len(aborted)
+        if len(expired) < batch_size:
+            return deleted
+
+
+async def main() -> None:
+    try:
+        storage = await get_storage()
+        async with async_session() as db:
+            deleted = await delete_expired_upload_sessions(db, storage)
+        logger.info('Deleted %d expired upload sessions', deleted)
+    finally:
+        for pool in (s3_pool, *shard_pools.values()):
+            await pool.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
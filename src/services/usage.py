@@ -0,0 +1,124 @@
+from collections import Counter
+from typing import Iterable
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from core.config import app_settings
+from models.file import AccountUsage
+
+
+def quotas(usage: AccountUsage | None) -> tuple[int, int]:
+    """
+    (bytes, files) an account may hold, 0 for no limit.
+    """
+    quota_bytes = quota_files = None
+    if usage is not None:
+        quota_bytes, quota_files = usage.quota_bytes, usage.quota_files
+    if quota_bytes is None:
+        quota_bytes = app_settings.quota_bytes
+    if quota_files is None:
+        quota_files = app_settings.quota_files
+    return quota_bytes, quota_files
+
+
+async def get_usage(db: AsyncSession, user_id: str) -> AccountUsage | None:
+    statement = select(AccountUsage).where(AccountUsage.account_id == user_id)
+    result = await db.execute(statement=statement)
+    return result.scalar_one_or_none()
+
+
+async def check_quota(
+        db: AsyncSession, user_id: str, size: int, count: int = 1) -> bool:
+    """
+    Whether the account can take COUNT more files of SIZE bytes, from
+    its usage row alone. Advisory, to refuse uploads before their body
+    is read; update_usage enforces quotas.
+    """
+    usage = await get_usage(db, user_id)
+    quota_bytes, quota_files = quotas(usage)
+    total_size = usage.total_size if usage is not None else 0
+    file_count = usage.file_count if usage is not None else 0
+    return not (
+        quota_bytes and total_size + size > quota_bytes
+        or quota_files and file_count + count > quota_files
+    )
+
+
+async def lock_usage(db: AsyncSession, account_ids: Iterable) -> None:
+    """
+    Lock the usage rows of ACCOUNT_IDS, creating missing ones, until the
+    end of the caller's transaction. Writers of files rows take these
+    locks first, in account order, so writers of an account run one
+    after the other and see each other's rows.
+    """
+    accounts = sorted({
+        str(account_id) for account_id in account_ids
+        if account_id is not None
+    })
+    if not accounts:
+        return
+    query = insert(AccountUsage).values([
+        {'account_id': account, 'file_count': 0, 'total_size': 0}
+        for account in accounts
+    ])
+    await db.execute(query.on_conflict_do_update(
+        index_elements=[AccountUsage.account_id],
+        set_={'file_count': AccountUsage.file_count}
+    ))
+
+
+async def update_usage(
+        db: AsyncSession, changes: Iterable[tuple[object, str, int, int]]
+) -> bool:
+    """
+    Apply (account_id, file path, count delta, size delta) CHANGES to the
+    accounts' usage in the caller's transaction.
+
+    Returns False, for the caller to roll back, when an account that
+    grows ends up over one of its quotas. The usage rows stay locked
+    until the end of the transaction, so concurrent uploads of an
+    account cannot both pass the check; callers that read files rows
+    first lock them before with lock_usage.
+    """
+    counts = Counter()
+    sizes = Counter()
+    for account_id, _, count, size in changes:
+        if account_id is not None:
+            counts[str(account_id)] += count
+            sizes[str(account_id)] += size
+    accounts = sorted(
+        account for account in counts if counts[account] or sizes[account]
+    )
+    if not accounts:
+        return True
+    query = insert(AccountUsage).values([
+        {
+            'account_id': account, 'file_count': counts[account],
+            'total_size': sizes[account],
+        } for account in accounts
+    ])
+    query = query.on_conflict_do_update(
+        index_elements=[AccountUsage.account_id],
+        set_={
+            'file_count': (
+                AccountUsage.file_count + query.excluded.file_count
+            ),
+            'total_size': (
+                AccountUsage.total_size + query.excluded.total_size
+            ),
+        }
+    ).returning(AccountUsage)
+    result = await db.execute(query)
+    for usage in result.all():
+        account = str(usage.account_id)
+        quota_bytes, quota_files = quotas(usage)
+        if (
+            sizes[account] > 0 and quota_bytes
+            and usage.total_size > quota_bytes
+            or counts[account] > 0 and quota_files
+            and usage.file_count > quota_files
+        ):
+            return False
+    return True
@@ -1,3 +1,5 @@
+import hashlib
+from typing import BinaryIO
 from uuid import UUID
 
 
@@ -32,3 +34,28 @@ def is_valid_uuid(uuid_to_test, version=4) -> bool:
     except ValueError:
         return False
     return str(uuid_obj) == uuid_to_test
+
+
+def hash_file(file: BinaryIO, chunk_size: int = 1048576) -> tuple[str, int]:
+    """
+    Return SHA-256 hex digest and size of a file object and rewind it.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    file.seek(0)
+    while chunk := file.read(chunk_size):
+        digest.update(chunk)
+        size += len(chunk)
+    file.seek(0)
+    return digest.hexdigest(), size
+
+
+def parent_prefixes(path: str) -> list[str]:
+    """
+    Directories holding PATH, from the top one down to its parent; the
+    root is not one of them.
+    >>> parent_prefixes('a/b/c.txt')
+    ['a/', 'a/b/']
+    """
+    parts = path.split('/')[:-1]
+    return ['/'.join(parts[:i]) + '/' for i in range(1, len(parts) + 1)]
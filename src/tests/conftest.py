@@ -5,6 +5,7 @@ import asyncio
 from _pytest.monkeypatch import MonkeyPatch
 from typing import AsyncGenerator, Generator
 from asyncio import AbstractEventLoop
+from unittest.mock import AsyncMock, patch
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.asyncio import (
@@ -76,3 +77,27 @@ async def session(
 async def client() -> AsyncGenerator[AsyncClient, None]:
     async with AsyncClient(app=app, base_url='http://test') as client:
         yield client
+
+
+@pytest_asyncio.fixture()
+async def access_token(client: AsyncClient, request) -> str:
+    """
+    Authorization header of a new user named after the test.
+    """
+    response = await client.post(
+        app.url_path_for('create_user'),
+        json={'username': request.node.name, 'password': 'pass123_'}
+    )
+    return f'Bearer {response.json()["access_token"]}'
+
+
+@pytest.fixture()
+def mocked_upload() -> Generator[AsyncMock, None, None]:
+    with patch('api.v1.files.upload_content', return_value=None) as mocked:
+        yield mocked
+
+
+@pytest.fixture()
+def mocked_download() -> Generator[AsyncMock, None, None]:
+    with patch('api.v1.files.download_content') as mocked:
+        yield mocked
@@ -35,6 +35,7 @@ class DBUtils:
 
     async def create_tables(self, base: DeclarativeMeta) -> None:
         async with self.db_engine.begin() as conn:
+            await conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
             await conn.run_sync(base.metadata.create_all)
 
     async def drop_database(self) -> None:
@@ -1,11 +1,31 @@
+import asyncio
+import hashlib
+import tarfile
 import zipfile
 import io
+import logging
+from uuid import UUID
 
-from unittest.mock import AsyncMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
+import pytest
+from botocore.exceptions import ClientError
 from httpx import AsyncClient
 from fastapi import status
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from core.config import app_settings
+from core.storage import get_storage
+from db import db
+from models.file import Blob, File
 from services.auth.auth_handler import decode_jwt
+from services.backfill_files import backfill
+from services.blob import collect_blobs
+from services.cache import DiskCache
+from services.encoding import store_variant
+from services.rebalance import rebalance
+from services.s3_files.policy import LatencyWindow, ReadPolicy
+from services.storage import HashRing, LocalStorage, ShardedStorage
 from main import app
 
 
@@ -160,6 +180,9 @@ async def test_files(
     )
     assert response.status_code == status.HTTP_200_OK
     assert len(response.json()['files']) == 4
+    # same content is stored once
+    assert mocked_upload.call_count == 1
+    assert all(file['size'] == 4 for file in response.json()['files'])
 
     # search files
     response = await client.get(
@@ -202,3 +225,1292 @@ async def test_files(
     assert response.status_code == status.HTTP_200_OK
     assert len(response.json()['matches']) == 1
     assert response.json()['matches'][0]['name'] == 'file.txt'
+
+
+@patch(
+    'api.v1.files.upload_stream',
+    return_value=(hashlib.sha256(b'test').hexdigest(), 4, None)
+)
+async def test_upload_stream(
+        mocked_upload: AsyncMock, client: AsyncClient, access_token: str,
+        session: AsyncSession
+) -> None:
+    # path from query
+    response = await client.post(
+        app.url_path_for('upload_file_stream'),
+        params={'path': 'stream/'},
+        files={'file_bytes': ('big.bin', b'test')},
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()['path'] == 'stream/big.bin'
+    assert response.json()['size'] == 4
+    assert mocked_upload.await_args.kwargs['content_type'] == (
+        'application/octet-stream'
+    )
+    blob_hash = await session.scalar(
+        select(File.blob_hash).where(File.id == UUID(response.json()['id']))
+    )
+    assert blob_hash == hashlib.sha256(b'test').hexdigest()
+
+    # path from form field
+    response = await client.post(
+        app.url_path_for('upload_file_stream'),
+        data={'path': 'stream/other.bin'},
+        files={'file_bytes': ('big.bin', b'test')},
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()['path'] == 'stream/other.bin'
+
+    # no path at all
+    response = await client.post(
+        app.url_path_for('upload_file_stream'),
+        files={'file_bytes': ('big.bin', b'test')},
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+@patch('api.v1.uploads.MultipartUpload')
+async def test_upload_session(
+        mocked_upload: MagicMock, client: AsyncClient, access_token: str
+) -> None:
+    upload = mocked_upload.return_value
+    upload.create = AsyncMock(return_value='upload-id')
+    upload.upload_part = AsyncMock(return_value='"etag"')
+    upload.complete = AsyncMock(return_value='"etag"')
+    upload.abort = AsyncMock(return_value=None)
+
+    chunk_size = 5242880
+    response = await client.post(
+        app.url_path_for('start_upload_session'),
+        json={'path': 'big/file.bin', 'size': chunk_size + 3,
+              'chunk_size': chunk_size},
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()['chunks_total'] == 2
+    session_id = response.json()['id']
+
+    # chunks in any order, wrong size is rejected
+    response = await client.put(
+        app.url_path_for('upload_chunk', session_id=session_id, number=2),
+        content=b'abcd',
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    response = await client.put(
+        app.url_path_for('upload_chunk', session_id=session_id, number=2),
+        content=b'abc',
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+    response = await client.get(
+        app.url_path_for('get_upload_session_state', session_id=session_id),
+        headers={'Authorization': access_token}
+    )
+    assert response.json()['chunks_received'] == [2]
+
+    response = await client.post(
+        app.url_path_for('complete_upload_session', session_id=session_id),
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_409_CONFLICT
+
+    response = await client.put(
+        app.url_path_for('upload_chunk', session_id=session_id, number=1),
+        content=b'x' * chunk_size,
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+    response = await client.post(
+        app.url_path_for('complete_upload_session', session_id=session_id),
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()['size'] == chunk_size + 3
+    upload.complete.assert_awaited_once_with({1: '"etag"', 2: '"etag"'})
+
+    response = await client.get(
+        app.url_path_for('get_upload_session_state', session_id=session_id),
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    response = await client.post(
+        app.url_path_for('start_upload_session'),
+        json={'path': 'big/huge.bin', 'size': 2 ** 33,
+              'chunk_size': 2 ** 31},
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    # expired sessions are aborted when the account starts another one
+    response = await client.post(
+        app.url_path_for('start_upload_session'),
+        json={'path': 'big/stale.bin', 'size': chunk_size},
+        headers={'Authorization': access_token}
+    )
+    stale_id = response.json()['id']
+    with patch.object(app_settings, 'upload_session_lifetime', 0), patch(
+            'services.upload_session.MultipartUpload') as expired_upload:
+        expired_upload.return_value.abort = AsyncMock(return_value=None)
+        response = await client.post(
+            app.url_path_for('start_upload_session'),
+            json={'path': 'big/fresh.bin', 'size': chunk_size},
+            headers={'Authorization': access_token}
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+        expired_upload.return_value.abort.assert_awaited_once()
+    response = await client.get(
+        app.url_path_for('get_upload_session_state', session_id=stale_id),
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+async def test_upload_batch(
+        mocked_upload: AsyncMock, client: AsyncClient, access_token: str
+) -> None:
+    response = await client.post(
+        app.url_path_for('upload_files_batch'),
+        data={'path': 'sync/'},
+        files=[
+            ('files', ('a.txt', b'same')),
+            ('files', ('sub/b.txt', b'same')),
+            ('files', ('c.txt', b'other')),
+        ],
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    results = {item['path']: item for item in response.json()['results']}
+    assert set(results) == {'sync/a.txt', 'sync/sub/b.txt', 'sync/c.txt'}
+    assert all(item['status'] == 'created' for item in results.values())
+    assert results['sync/c.txt']['file']['size'] == 5
+    # duplicate content is sent to S3 once
+    assert mocked_upload.call_count == 2
+
+    response = await client.get(
+        app.url_path_for('get_list_files'),
+        headers={'Authorization': access_token}
+    )
+    assert len(response.json()['files']) == 3
+
+    response = await client.post(
+        app.url_path_for('upload_files_batch'),
+        data={'path': 'dup/'},
+        files=[
+            ('files', ('a.txt', b'first')),
+            ('files', ('a.txt', b'second')),
+            ('files', ('b.txt', b'other')),
+        ],
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    results = {item['path']: item for item in response.json()['results']}
+    assert results['dup/a.txt']['status'] == 'error'
+    assert results['dup/a.txt']['detail'] == 'Duplicate path'
+    assert results['dup/b.txt']['status'] == 'created'
+
+
+@patch('api.v1.files.get_content_info')
+@patch('api.v1.files.presign_upload', return_value='https://s3/presigned')
+async def test_upload_presigned(
+        mocked_presign: AsyncMock, mocked_info: AsyncMock,
+        mocked_upload: AsyncMock, client: AsyncClient, access_token: str,
+        caplog
+) -> None:
+    response = await client.post(
+        app.url_path_for('presign_file_upload'),
+        json={'path': 'direct/file.txt', 'size': 4},
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()['url'] == 'https://s3/presigned'
+
+    response = await client.post(
+        app.url_path_for('presign_file_upload'),
+        json={'path': 'blobs/file.txt', 'size': 4},
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    mocked_info.return_value = {
+        'size': 4, 'etag': '"abc"', 'content_type': 'text/plain',
+        'last_modified': None
+    }
+    response = await client.post(
+        app.url_path_for('complete_presigned_upload'),
+        json={'path': 'direct/file.txt', 'size': 5, 'etag': 'abc'},
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_409_CONFLICT
+
+    # an object larger than presigned is refused and deleted
+    with patch.object(app_settings, 'max_size_stream_file', 3):
+        with patch('api.v1.files.delete_objects') as mocked_delete:
+            response = await client.post(
+                app.url_path_for('complete_presigned_upload'),
+                json={'path': 'direct/file.txt', 'size': 4, 'etag': 'abc'},
+                headers={'Authorization': access_token}
+            )
+    assert response.status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    mocked_delete.assert_awaited_once()
+
+    response = await client.post(
+        app.url_path_for('complete_presigned_upload'),
+        json={'path': 'direct/file.txt', 'size': 4, 'etag': 'abc'},
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()['content_type'] == 'text/plain'
+
+    # the object under its own key goes once a blob replaces it
+    with patch('services.file.delete_objects') as mocked_delete:
+        response = await client.post(
+            app.url_path_for('upload_file'),
+            data={'path': 'direct/file.txt'},
+            files={'file_bytes': b'blob'},
+            headers={'Authorization': access_token}
+        )
+    assert response.status_code == status.HTTP_201_CREATED
+    user_id = decode_jwt(access_token.split()[1])['user_id']
+    assert mocked_delete.await_args.args[1] == [
+        f'accounts/{user_id}/direct/file.txt'
+    ]
+
+    # objects that cannot be deleted with their file are logged
+    response = await client.post(
+        app.url_path_for('complete_presigned_upload'),
+        json={'path': 'direct/kept.txt', 'size': 4, 'etag': 'abc'},
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    storage = MagicMock()
+    storage.on.return_value.delete = AsyncMock(side_effect=OSError)
+    app.dependency_overrides[get_storage] = lambda: storage
+    try:
+        with caplog.at_level(logging.WARNING):
+            response = await client.delete(
+                app.url_path_for('delete_file'),
+                params={'path': 'direct/kept.txt'},
+                headers={'Authorization': access_token}
+            )
+    finally:
+        del app.dependency_overrides[get_storage]
+    assert response.status_code == status.HTTP_200_OK
+    assert f'Cannot delete accounts/{user_id}/direct/kept.txt' in caplog.text
+
+
+@patch('api.v1.files.presign_download', return_value='https://s3/get')
+async def test_download_redirect(
+        mocked_presign: AsyncMock, mocked_upload: AsyncMock,
+        client: AsyncClient, access_token: str
+) -> None:
+    response = await client.post(
+        app.url_path_for('upload_file'),
+        data={'path': 'docs/report.txt'},
+        files={'file_bytes': b'test'},
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+
+    response = await client.get(
+        app.url_path_for('download_file'),
+        params={'path': 'docs/report.txt', 'redirect': True},
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_307_TEMPORARY_REDIRECT
+    assert response.headers['location'] == 'https://s3/get'
+    assert mocked_presign.await_args.kwargs['content_disposition'] == (
+        'attachment; filename="report.txt"'
+    )
+
+
+async def chunk_iterator(data: bytes):
+    yield data
+
+
+async def test_download_zip(
+        mocked_download: AsyncMock, mocked_upload: AsyncMock,
+        client: AsyncClient, access_token: str
+) -> None:
+    contents = {'photo.png': b'\x89PNG', 'notes/todo.txt': b'todo todo'}
+    for name, content in contents.items():
+        response = await client.post(
+            app.url_path_for('upload_file'),
+            data={'path': f'album/{name}'},
+            files={'file_bytes': content},
+            headers={'Authorization': access_token}
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+
+    blobs = {
+        f'blobs/{hashlib.sha256(content).hexdigest()}': content
+        for content in contents.values()
+    }
+    mocked_download.side_effect = (
+        lambda storage, file_path, byte_range: chunk_iterator(blobs[file_path])
+    )
+    response = await client.get(
+        app.url_path_for('download_file'),
+        params={'path': 'album/'},
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert 'content-length' not in response.headers
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    assert {name: archive.read(name) for name in archive.namelist()} == (
+        contents
+    )
+    assert archive.getinfo('photo.png').compress_type == zipfile.ZIP_STORED
+    assert archive.getinfo('notes/todo.txt').compress_type == (
+        zipfile.ZIP_DEFLATED
+    )
+
+    # repeat download is served from the archive cache
+    archive_content = response.content
+    calls = mocked_download.call_count
+    response = await client.get(
+        app.url_path_for('download_file'),
+        params={'path': 'album/'},
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.content == archive_content
+    assert mocked_download.call_count == calls
+
+    # only stored entries, size is known upfront
+    response = await client.get(
+        app.url_path_for('download_file'),
+        params={'path': 'album/photo.png', 'zipped': True},
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert int(response.headers['content-length']) == len(response.content)
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    assert archive.read('photo.png') == contents['photo.png']
+
+    response = await client.get(
+        app.url_path_for('download_file'),
+        params={'path': 'album/', 'format': 'tar.gz', 'level': 1},
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['content-type'] == 'application/gzip'
+    archive = tarfile.open(fileobj=io.BytesIO(response.content))
+    assert {
+        name: archive.extractfile(name).read()
+        for name in archive.getnames()
+    } == contents
+
+    response = await client.get(
+        app.url_path_for('download_file'),
+        params={'path': 'album/', 'format': 'zip', 'level': 10},
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+async def test_download_range(
+        mocked_download: AsyncMock, mocked_upload: AsyncMock,
+        client: AsyncClient, access_token: str
+) -> None:
+    response = await client.post(
+        app.url_path_for('upload_file'),
+        data={'path': 'video/movie.txt'},
+        files={'file_bytes': b'test'},
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+
+    mocked_download.return_value = chunk_iterator(b'es')
+    response = await client.get(
+        app.url_path_for('download_file'),
+        params={'path': 'video/movie.txt'},
+        headers={'Authorization': access_token, 'Range': 'bytes=1-2'}
+    )
+    assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+    assert response.headers['content-range'] == 'bytes 1-2/4'
+    assert response.headers['accept-ranges'] == 'bytes'
+    assert response.content == b'es'
+    assert mocked_download.await_args.kwargs['byte_range'] == (1, 2)
+
+    mocked_download.side_effect = [chunk_iterator(b't'), chunk_iterator(b't')]
+    response = await client.get(
+        app.url_path_for('download_file'),
+        params={'path': 'video/movie.txt'},
+        headers={'Authorization': access_token, 'Range': 'bytes=0-0,-1'}
+    )
+    assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+    assert response.headers['content-type'].startswith('multipart/byteranges')
+    assert int(response.headers['content-length']) == len(response.content)
+    assert b'Content-Range: bytes 3-3/4' in response.content
+
+    response = await client.get(
+        app.url_path_for('download_file'),
+        params={'path': 'video/movie.txt'},
+        headers={'Authorization': access_token, 'Range': 'bytes=10-'}
+    )
+    assert response.status_code == (
+        status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+    )
+    assert response.headers['content-range'] == 'bytes */4'
+
+
+async def test_conditional_get(
+        mocked_download: AsyncMock, mocked_upload: AsyncMock,
+        client: AsyncClient, access_token: str
+) -> None:
+    response = await client.post(
+        app.url_path_for('upload_file'),
+        data={'path': 'poll/state.json'},
+        files={'file_bytes': b'test'},
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+
+    mocked_download.return_value = chunk_iterator(b'test')
+    response = await client.get(
+        app.url_path_for('download_file'),
+        params={'path': 'poll/state.json'},
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    etag = response.headers['etag']
+    assert etag == f'"{hashlib.sha256(b"test").hexdigest()}"'
+    assert response.headers['last-modified']
+
+    mocked_download.reset_mock()
+    response = await client.get(
+        app.url_path_for('download_file'),
+        params={'path': 'poll/state.json'},
+        headers={'Authorization': access_token, 'If-None-Match': etag}
+    )
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    mocked_download.assert_not_called()
+
+    response = await client.get(
+        app.url_path_for('get_list_files'),
+        headers={'Authorization': access_token}
+    )
+    list_etag = response.headers['etag']
+    response = await client.get(
+        app.url_path_for('get_list_files'),
+        headers={'Authorization': access_token, 'If-None-Match': list_etag}
+    )
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    response = await client.post(
+        app.url_path_for('upload_file'),
+        data={'path': 'poll/other.json'},
+        files={'file_bytes': b'test'},
+        headers={'Authorization': access_token}
+    )
+    response = await client.get(
+        app.url_path_for('get_list_files'),
+        headers={'Authorization': access_token, 'If-None-Match': list_etag}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert len(response.json()['files']) == 2
+
+
+async def test_object_cache(
+        mocked_download: AsyncMock, mocked_upload: AsyncMock,
+        client: AsyncClient, access_token: str, tmp_path
+) -> None:
+    response = await client.post(
+        app.url_path_for('upload_file'),
+        data={'path': 'hot/file.txt'},
+        files={'file_bytes': b'test'},
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+
+    with patch(
+            'api.v1.files.object_cache', DiskCache(str(tmp_path), 1048576)
+    ) as cache:
+        mocked_download.return_value = chunk_iterator(b'test')
+        response = await client.get(
+            app.url_path_for('download_file'),
+            params={'path': 'hot/file.txt'},
+            headers={'Authorization': access_token}
+        )
+        assert response.content == b'test'
+        assert mocked_download.call_count == 1
+
+        # served from disk, including ranges
+        response = await client.get(
+            app.url_path_for('download_file'),
+            params={'path': 'hot/file.txt'},
+            headers={'Authorization': access_token}
+        )
+        assert response.content == b'test'
+        response = await client.get(
+            app.url_path_for('download_file'),
+            params={'path': 'hot/file.txt'},
+            headers={'Authorization': access_token, 'Range': 'bytes=1-2'}
+        )
+        assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+        assert response.content == b'es'
+        assert mocked_download.call_count == 1
+        assert cache.stats['hits'] == 2
+        assert cache.stats['misses'] == 1
+
+
+async def test_shared_disk_cache(tmp_path) -> None:
+    # two workers on one directory hold it to a single budget
+    first, second = DiskCache(str(tmp_path), 10), DiskCache(str(tmp_path), 10)
+    for cache, key in ((first, 'a'), (second, 'b'), (first, 'c')):
+        with patch('services.cache.RESCAN_INTERVAL', 0):
+            async with cache.fill('namespace', key) as file:
+                await file.write(b'1234')
+    assert await first.open('namespace', 'a') is None
+    assert await second.open('namespace', 'b') is not None
+    assert sum(
+        path.stat().st_size for path in tmp_path.glob('*/*')
+    ) <= 10
+
+
+async def test_download_compressed(
+        mocked_download: AsyncMock, mocked_upload: AsyncMock,
+        client: AsyncClient, access_token: str
+) -> None:
+    file_content = b'2026-10-18 INFO request served\n' * 1000
+    response = await client.post(
+        app.url_path_for('upload_file'),
+        data={'path': 'logs/app.log'},
+        files={'file_bytes': file_content},
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+
+    mocked_download.return_value = chunk_iterator(file_content)
+    response = await client.get(
+        app.url_path_for('download_file'),
+        params={'path': 'logs/app.log'},
+        headers={'Authorization': access_token, 'Accept-Encoding': 'gzip'}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['content-encoding'] == 'gzip'
+    assert response.headers['vary'] == 'Accept-Encoding'
+    assert response.headers['etag'].endswith('-gzip"')
+    assert response.content == file_content
+
+    mocked_download.return_value = chunk_iterator(file_content)
+    response = await client.get(
+        app.url_path_for('download_file'),
+        params={'path': 'logs/app.log'},
+        headers={'Authorization': access_token, 'Accept-Encoding': 'identity'}
+    )
+    assert 'content-encoding' not in response.headers
+    assert response.headers['vary'] == 'Accept-Encoding'
+    assert response.content == file_content
+
+
+async def test_store_variant_once() -> None:
+    started, finish = asyncio.Event(), asyncio.Event()
+
+    async def get(key: str):
+        started.set()
+        await finish.wait()
+        return chunk_iterator(b'content')
+
+    storage = MagicMock(get=get, put_stream=AsyncMock(return_value=None))
+    blob_hash = hashlib.sha256(b'content').hexdigest()
+    first = asyncio.create_task(store_variant(storage, blob_hash, 'gzip'))
+    await started.wait()
+    # another download of the same blob while the first one compresses
+    await store_variant(storage, blob_hash, 'gzip')
+    finish.set()
+    await first
+    storage.put_stream.assert_awaited_once()
+
+
+async def test_local_storage(
+        client: AsyncClient, access_token: str, tmp_path
+) -> None:
+    app.dependency_overrides[get_storage] = (
+        lambda: LocalStorage(str(tmp_path))
+    )
+    try:
+        response = await client.post(
+            app.url_path_for('upload_file'),
+            data={'path': 'local/file.bin'},
+            files={'file_bytes': b'local content'},
+            headers={'Authorization': access_token}
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+        blob_hash = hashlib.sha256(b'local content').hexdigest()
+        assert (tmp_path / 'blobs' / blob_hash).read_bytes() == (
+            b'local content'
+        )
+
+        response = await client.get(
+            app.url_path_for('download_file'),
+            params={'path': 'local/file.bin'},
+            headers={'Authorization': access_token}
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert response.content == b'local content'
+        response = await client.get(
+            app.url_path_for('download_file'),
+            params={'path': 'local/file.bin'},
+            headers={'Authorization': access_token, 'Range': 'bytes=6-12'}
+        )
+        assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+        assert response.content == b'content'
+
+        with patch.object(app_settings, 'max_size_stream_file', 4):
+            response = await client.post(
+                app.url_path_for('upload_file_stream'),
+                params={'path': 'local/big.bin'},
+                files={'file_bytes': ('big.bin', b'too large')},
+                headers={'Authorization': access_token}
+            )
+        assert response.status_code == (
+            status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+        assert not any(
+            path.is_file() for path in (tmp_path / 'uploads').rglob('*')
+        )
+
+        response = await client.post(
+            app.url_path_for('presign_file_upload'),
+            json={'path': 'local/other.bin', 'size': 4},
+            headers={'Authorization': access_token}
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+    finally:
+        del app.dependency_overrides[get_storage]
+
+
+async def test_sharded_storage(
+        client: AsyncClient, access_token: str, tmp_path
+) -> None:
+    shards = {
+        name: LocalStorage(str(tmp_path / name)) for name in ('a', 'b')
+    }
+    storage = ShardedStorage(
+        shards, HashRing(shards), LocalStorage(str(tmp_path / 'default'))
+    )
+    app.dependency_overrides[get_storage] = lambda: storage
+    try:
+        for number in range(8):
+            content = f'shard content {number}'.encode()
+            response = await client.post(
+                app.url_path_for('upload_file'),
+                data={'path': f'shards/{number}.txt'},
+                files={'file_bytes': content},
+                headers={'Authorization': access_token}
+            )
+            assert response.status_code == status.HTTP_201_CREATED
+            key = f'blobs/{hashlib.sha256(content).hexdigest()}'
+            shard = storage.shard_for(key)
+            assert (tmp_path / shard / key).read_bytes() == content
+
+            response = await client.get(
+                app.url_path_for('download_file'),
+                params={'path': f'shards/{number}.txt'},
+                headers={'Authorization': access_token}
+            )
+            assert response.content == content
+
+        # a shard dropped from the configuration while files are on it
+        removed = next(
+            number for number in range(8) if storage.shard_for(
+                'blobs/' + hashlib.sha256(
+                    f'shard content {number}'.encode()
+                ).hexdigest()
+            ) == 'a'
+        )
+        del shards['a']
+        for params in ({'path': f'shards/{removed}.txt'},
+                       {'path': 'shards/'}):
+            response = await client.get(
+                app.url_path_for('download_file'),
+                params=params,
+                headers={'Authorization': access_token}
+            )
+            assert response.status_code == (
+                status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+    finally:
+        del app.dependency_overrides[get_storage]
+
+
+async def test_rebalance(
+        client: AsyncClient, access_token: str, session: AsyncSession,
+        tmp_path
+) -> None:
+    shards = {
+        name: LocalStorage(str(tmp_path / name)) for name in ('a', 'b')
+    }
+    default = LocalStorage(str(tmp_path / 'default'))
+    app.dependency_overrides[get_storage] = lambda: ShardedStorage(
+        shards, HashRing(['a']), default
+    )
+    try:
+        contents = [f'rebalanced {number}'.encode() for number in range(8)]
+        for number, content in enumerate(contents):
+            response = await client.post(
+                app.url_path_for('upload_file'),
+                data={'path': f'rebalance/{number}.txt'},
+                files={'file_bytes': content},
+                headers={'Authorization': access_token}
+            )
+            assert response.status_code == status.HTTP_201_CREATED
+
+        # shard b joins the ring
+        storage = ShardedStorage(shards, HashRing(['a', 'b']), default)
+        counts = await rebalance(session, storage)
+        keys = [
+            f'blobs/{hashlib.sha256(content).hexdigest()}'
+            for content in contents
+        ]
+        moved = [key for key in keys if storage.shard_for(key) == 'b']
+        assert moved and counts['moved'] == len(moved)
+        assert counts['failed'] == 0
+        for key, content in zip(keys, contents):
+            shard = storage.shard_for(key)
+            assert (tmp_path / shard / key).read_bytes() == content
+            assert (tmp_path / 'a' / key).exists() == (shard == 'a')
+        assert set(await session.scalars(
+            select(Blob.shard).where(Blob.hash.in_([
+                key.split('/')[1] for key in moved
+            ]))
+        )) == {'b'}
+
+        app.dependency_overrides[get_storage] = lambda: storage
+        response = await client.get(
+            app.url_path_for('download_file'),
+            params={'path': 'rebalance/'},
+            headers={'Authorization': access_token}
+        )
+        assert response.status_code == status.HTTP_200_OK
+    finally:
+        del app.dependency_overrides[get_storage]
+
+
+async def test_backfill_files(
+        mocked_upload: AsyncMock, client: AsyncClient, access_token: str,
+        session: AsyncSession
+) -> None:
+    for number in range(3):
+        response = await client.post(
+            app.url_path_for('upload_file'),
+            data={'path': f'backfill/{number}.txt'},
+            files={'file_bytes': f'backfilled {number}'.encode()},
+            headers={'Authorization': access_token}
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+    # files_new of 10_files_partitioned, gone with the test transaction
+    await session.execute(text(
+        'CREATE TABLE files_new (LIKE files INCLUDING ALL)'
+    ))
+    ids = set(await session.scalars(select(File.id)))
+
+    assert await backfill(session, batch_size=2) == (len(ids), len(ids))
+    assert set(await session.scalars(
+        text('SELECT id FROM files_new')
+    )) == ids
+    # copied rows are read again and left as they are
+    assert await backfill(session, batch_size=2) == (len(ids), 0)
+    assert await backfill(session, after=str(max(ids))) == (0, 0)
+
+
+async def test_stats(client: AsyncClient, access_token: str) -> None:
+    response = await client.get(
+        app.url_path_for('get_stats'),
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    stats = response.json()
+    assert stats['db_pool']['size'] == app_settings.db_pool_size
+    assert stats['db_pool']['waiting'] == 0
+    assert {'object_cache', 'archive_cache', 's3_pool'} <= set(stats)
+
+
+async def test_list_files_cursor(
+        mocked_upload: AsyncMock, client: AsyncClient, access_token: str
+) -> None:
+    for number in range(5):
+        response = await client.post(
+            app.url_path_for('upload_file'),
+            data={'path': f'pages/{number}.txt'},
+            files={'file_bytes': f'page {number}'.encode()},
+            headers={'Authorization': access_token}
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+
+    for order_by in ('created_at', 'path'):
+        paths = []
+        params = {'limit': 2, 'order_by': order_by}
+        while True:
+            response = await client.get(
+                app.url_path_for('get_list_files'),
+                params=params,
+                headers={'Authorization': access_token}
+            )
+            assert response.status_code == status.HTTP_200_OK
+            paths.extend(file['path'] for file in response.json()['files'])
+            if not response.json()['next_cursor']:
+                break
+            params['cursor'] = response.json()['next_cursor']
+        assert sorted(paths) == [f'pages/{number}.txt' for number in range(5)]
+        assert len(set(paths)) == 5
+
+    # malformed, and well-formed JSON with keys of the wrong type
+    for cursor in ('garbage', 'WyJjcmVhdGVkX2F0IiwiMjAyMC0wMS0wMSIsMV0'):
+        response = await client.get(
+            app.url_path_for('get_list_files'),
+            params={'cursor': cursor},
+            headers={'Authorization': access_token}
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+async def test_search_words(
+        mocked_upload: AsyncMock, client: AsyncClient, access_token: str
+) -> None:
+    for path in ('reports/annual_report.pdf', 'reports/2022/summary.txt',
+                 'photos/report-cover.png', 'photos/100%_done.png'):
+        response = await client.post(
+            app.url_path_for('upload_file'),
+            data={'path': path},
+            files={'file_bytes': path.encode()},
+            headers={'Authorization': access_token}
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+
+    response = await client.get(
+        app.url_path_for('search_files'),
+        params={'words': 'report', 'order_by': 'relevance'},
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert {match['path'] for match in response.json()['matches']} == {
+        'reports/annual_report.pdf', 'photos/report-cover.png'
+    }
+
+    response = await client.get(
+        app.url_path_for('search_files'),
+        params={'words': 'report -photos'},
+        headers={'Authorization': access_token}
+    )
+    assert [match['path'] for match in response.json()['matches']] == [
+        'reports/annual_report.pdf'
+    ]
+
+    # LIKE wildcards in the query are literal
+    response = await client.get(
+        app.url_path_for('search_files'),
+        params={'query': '0%_'},
+        headers={'Authorization': access_token}
+    )
+    assert [match['path'] for match in response.json()['matches']] == [
+        'photos/100%_done.png'
+    ]
+
+
+async def test_search_query_language(
+        mocked_upload: AsyncMock, client: AsyncClient, access_token: str
+) -> None:
+    for path in ('reports/annual_report.pdf', 'reports/2022/summary.txt',
+                 'photos/report-cover.png', 'photos/100%_done.png'):
+        response = await client.post(
+            app.url_path_for('upload_file'),
+            data={'path': path},
+            files={'file_bytes': path.encode()},
+            headers={'Authorization': access_token}
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+
+    async def search(query: str) -> set[str]:
+        response = await client.get(
+            app.url_path_for('search_files'),
+            params={'query': query},
+            headers={'Authorization': access_token}
+        )
+        assert response.status_code == status.HTTP_200_OK
+        return {match['path'] for match in response.json()['matches']}
+
+    assert await search('report ext:pdf') == {'reports/annual_report.pdf'}
+    assert await search('path:photos/ -name:done') == {
+        'photos/report-cover.png'
+    }
+    assert await search('ext:txt OR (name:cover AND size<1KB)') == {
+        'reports/2022/summary.txt', 'photos/report-cover.png'
+    }
+    assert await search('size>=24 NOT re:"\\.pdf$"') == {
+        'reports/2022/summary.txt'
+    }
+    assert await search('created>2000-01-01 "100%_"') == {
+        'photos/100%_done.png'
+    }
+
+    # the extension parameter matches extensions containing it
+    response = await client.get(
+        app.url_path_for('search_files'),
+        params={'extension': 'p'},
+        headers={'Authorization': access_token}
+    )
+    assert {match['path'] for match in response.json()['matches']} == {
+        'reports/annual_report.pdf', 'photos/report-cover.png',
+        'photos/100%_done.png'
+    }
+
+    for query in ('(report', 'size>big', 'report OR', 're:"("',
+                  'size>9000000TB', 'created<9999-12-31'):
+        response = await client.get(
+            app.url_path_for('search_files'),
+            params={'query': query},
+            headers={'Authorization': access_token}
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+async def test_directories(
+        mocked_upload: AsyncMock, client: AsyncClient, access_token: str
+) -> None:
+    for path, content in (('docs/a.txt', b'12345'), ('docs/b.txt', b'123'),
+                          ('docs/old/c.txt', b'1'), ('readme.md', b'12')):
+        response = await client.post(
+            app.url_path_for('upload_file'),
+            data={'path': path},
+            files={'file_bytes': content},
+            headers={'Authorization': access_token}
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+
+    response = await client.get(
+        app.url_path_for('list_directory'),
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    root = response.json()
+    assert (root['file_count'], root['total_size']) == (4, 11)
+    assert [(entry['path'], entry['file_count'], entry['total_size'])
+            for entry in root['directories']] == [('docs/', 3, 9)]
+    assert [file['path'] for file in root['files']] == ['readme.md']
+
+    # one entry per page, subdirectories first
+    names = []
+    cursor = None
+    while True:
+        params = {'path': 'docs/', 'limit': 1}
+        if cursor:
+            params['cursor'] = cursor
+        response = await client.get(
+            app.url_path_for('list_directory'),
+            params=params,
+            headers={'Authorization': access_token}
+        )
+        page = response.json()
+        names += [entry['name'] for entry in page['directories']]
+        names += [file['name'] for file in page['files']]
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+    assert names == ['old', 'a.txt', 'b.txt']
+
+    # overwriting only changes the size
+    response = await client.post(
+        app.url_path_for('upload_file'),
+        data={'path': 'docs/a.txt'},
+        files={'file_bytes': b'1'},
+        headers={'Authorization': access_token}
+    )
+    response = await client.delete(
+        app.url_path_for('delete_file'),
+        params={'path': 'docs/old/'},
+        headers={'Authorization': access_token}
+    )
+    assert response.json() == {'deleted': 1, 'size': 1}
+    response = await client.get(
+        app.url_path_for('list_directory'),
+        params={'path': 'docs/'},
+        headers={'Authorization': access_token}
+    )
+    docs = response.json()
+    assert (docs['file_count'], docs['total_size']) == (2, 4)
+    assert docs['directories'] == []
+
+    response = await client.get(
+        app.url_path_for('list_directory'),
+        params={'path': 'docs/old/'},
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+async def test_usage_quota(
+        mocked_upload: AsyncMock, client: AsyncClient, access_token: str
+) -> None:
+    response = await client.get(
+        app.url_path_for('get_account_usage'),
+        headers={'Authorization': access_token}
+    )
+    assert response.json() == {
+        'file_count': 0, 'total_size': 0,
+        'quota_bytes': None, 'quota_files': None
+    }
+
+    with patch.object(app_settings, 'quota_bytes', 2000):
+        response = await client.post(
+            app.url_path_for('upload_file'),
+            data={'path': 'quota/first.bin'},
+            files={'file_bytes': b'1' * 1200},
+            headers={'Authorization': access_token}
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+        # refused from the request size, before the body is stored
+        response = await client.post(
+            app.url_path_for('upload_file'),
+            data={'path': 'quota/second.bin'},
+            files={'file_bytes': b'2' * 1200},
+            headers={'Authorization': access_token}
+        )
+        assert response.status_code == (
+            status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+        # stored, then refused when registered: the new blob is deleted
+        with patch('api.v1.files.check_quota', return_value=True):
+            with patch('services.blob.delete_objects') as mocked_delete:
+                response = await client.post(
+                    app.url_path_for('upload_file'),
+                    data={'path': 'quota/second.bin'},
+                    files={'file_bytes': b'2' * 1200},
+                    headers={'Authorization': access_token}
+                )
+        assert response.status_code == (
+            status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+        assert mocked_delete.await_args.args[1] == [
+            f'blobs/{hashlib.sha256(b"2" * 1200).hexdigest()}'
+        ]
+        response = await client.post(
+            app.url_path_for('start_upload_session'),
+            json={'path': 'quota/big.bin', 'size': 1000},
+            headers={'Authorization': access_token}
+        )
+        assert response.status_code == (
+            status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+        response = await client.get(
+            app.url_path_for('get_account_usage'),
+            headers={'Authorization': access_token}
+        )
+        assert response.json() == {
+            'file_count': 1, 'total_size': 1200,
+            'quota_bytes': 2000, 'quota_files': None
+        }
+
+    response = await client.delete(
+        app.url_path_for('delete_file'),
+        params={'path': 'quota/first.bin'},
+        headers={'Authorization': access_token}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    response = await client.get(
+        app.url_path_for('get_account_usage'),
+        headers={'Authorization': access_token}
+    )
+    assert response.json()['file_count'] == 0
+
+
+async def test_paths_per_account(
+        mocked_upload: AsyncMock, client: AsyncClient
+) -> None:
+    tokens = []
+    for username in ('user_paths_1', 'user_paths_2'):
+        response = await client.post(
+            app.url_path_for('create_user'),
+            json={'username': username, 'password': 'pass123_'}
+        )
+        tokens.append(f'Bearer {response.json()["access_token"]}')
+
+    for number, access_token in enumerate(tokens, 1):
+        response = await client.post(
+            app.url_path_for('upload_file'),
+            data={'path': 'shared/same.txt'},
+            files={'file_bytes': b'x' * number},
+            headers={'Authorization': access_token}
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+
+    for number, access_token in enumerate(tokens, 1):
+        response = await client.get(
+            app.url_path_for('get_list_files'),
+            headers={'Authorization': access_token}
+        )
+        assert [(file['path'], file['size'])
+                for file in response.json()['files']] == [
+            ('shared/same.txt', number)
+        ]
+
+
+async def test_read_replicas(
+        mocked_upload: AsyncMock, client: AsyncClient, access_token: str
+) -> None:
+    # the replica is the test connection as well, to see the uploads
+    replica = MagicMock(wraps=db.async_session)
+    with patch('db.db.replica_sessions', [replica]):
+        with patch.object(app_settings, 'replica_pin_seconds', 0):
+            response = await client.post(
+                app.url_path_for('upload_file'),
+                data={'path': 'replicas/first.txt'},
+                files={'file_bytes': b'first'},
+                headers={'Authorization': access_token}
+            )
+        assert response.status_code == status.HTTP_201_CREATED
+        response = await client.get(
+            app.url_path_for('get_list_files'),
+            headers={'Authorization': access_token}
+        )
+        assert len(response.json()['files']) == 1
+        assert replica.call_count == 1
+
+        # read-your-writes: the primary serves reads after an upload
+        response = await client.post(
+            app.url_path_for('upload_file'),
+            data={'path': 'replicas/second.txt'},
+            files={'file_bytes': b'second'},
+            headers={'Authorization': access_token}
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+        response = await client.get(
+            app.url_path_for('search_files'),
+            params={'query': 'second'},
+            headers={'Authorization': access_token}
+        )
+        assert len(response.json()['matches']) == 1
+        assert replica.call_count == 1
+
+
+@patch('services.blob.delete_objects')
+async def test_collect_blobs(
+        mocked_delete: AsyncMock, mocked_upload: AsyncMock,
+        client: AsyncClient, access_token: str, session: AsyncSession
+) -> None:
+    async def upload(path: str, content: bytes) -> None:
+        response = await client.post(
+            app.url_path_for('upload_file'),
+            data={'path': path},
+            files={'file_bytes': content},
+            headers={'Authorization': access_token}
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+
+    async def delete(path: str) -> None:
+        response = await client.delete(
+            app.url_path_for('delete_file'),
+            params={'path': path},
+            headers={'Authorization': access_token}
+        )
+        assert response.status_code == status.HTTP_200_OK
+
+    shared_key = f'blobs/{hashlib.sha256(b"shared blob").hexdigest()}'
+    await upload('gc/a.txt', b'shared blob')
+    await upload('gc/b.txt', b'shared blob')
+    await delete('gc/a.txt')
+    mocked_delete.assert_not_awaited()
+    await delete('gc/b.txt')
+    mocked_delete.assert_awaited_once()
+    assert mocked_delete.await_args.args[1] == [shared_key]
+
+    # overwritten content is left to the sweep
+    mocked_delete.reset_mock()
+    await upload('gc/c.txt', b'old blob')
+    await upload('gc/c.txt', b'new blob')
+    mocked_delete.assert_not_awaited()
+    assert await collect_blobs(session, MagicMock()) == 1
+    assert mocked_delete.await_args.args[1] == [
+        f'blobs/{hashlib.sha256(b"old blob").hexdigest()}'
+    ]
+
+
+class FakeS3Client:
+    """
+    get_object answering with the scripted (delay, result) pairs in
+    turn; results that are exceptions are raised.
+    """
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.calls = 0
+        self.cancelled = 0
+
+    async def get_object(self, **params):
+        delay, result = self.script[min(self.calls, len(self.script) - 1)]
+        self.calls += 1
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def s3_error(code: str, status_code: int) -> ClientError:
+    return ClientError(
+        {'Error': {'Code': code},
+         'ResponseMetadata': {'HTTPStatusCode': status_code}},
+        'GetObject'
+    )
+
+
+def read_policy(**options) -> ReadPolicy:
+    return ReadPolicy(**{
+        'attempts': 3, 'attempt_timeout': 1, 'base_delay': 0,
+        'max_delay': 0, 'hedge_percentile': 0, 'hedge_min_delay': 0,
+        **options
+    })
+
+
+async def test_read_policy_retries() -> None:
+    policy = read_policy()
+    client = FakeS3Client((0, s3_error('SlowDown', 503)), (0, 'body'))
+    assert await policy.call('get_object', client.get_object) == 'body'
+    assert client.calls == 2
+    assert policy.stats['get_object']['retries'] == 1
+
+    # not retried, and raised as it is
+    client = FakeS3Client((0, s3_error('NoSuchKey', 404)))
+    with pytest.raises(ClientError):
+        await policy.call('get_object', client.get_object)
+    assert client.calls == 1
+    assert policy.stats['get_object']['errors'] == 1
+
+
+async def test_read_policy_timeout() -> None:
+    policy = read_policy(attempts=2, attempt_timeout=0.05)
+    client = FakeS3Client((1, 'slow'))
+    with pytest.raises(asyncio.TimeoutError):
+        await policy.call('get_object', client.get_object)
+    await asyncio.sleep(0)
+    assert client.calls == 2
+    assert client.cancelled == 2
+    assert policy.stats['get_object']['timeouts'] == 2
+
+
+async def test_read_policy_hedge() -> None:
+    policy = read_policy(hedge_percentile=50, hedge_min_delay=0.01)
+    for _ in range(LatencyWindow.min_samples):
+        policy.latency['get_object'].add(0.01)
+    discarded = []
+    client = FakeS3Client((1, 'primary'), (0, 'hedge'))
+    result = await policy.call(
+        'get_object', client.get_object, discard=discarded.append
+    )
+    assert result == 'hedge'
+    assert client.calls == 2
+    assert policy.stats['get_object']['hedge_wins'] == 1
+    await asyncio.sleep(0)
+    assert client.cancelled == 1
+    assert discarded == []